@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+import metrics
+
+ACTIVE_REQUESTS = metrics.Gauge("inference_active_requests", "Số request đang giữ chỗ xử lý", ("pool",))
+QUEUED_REQUESTS = metrics.Gauge("inference_queued_requests", "Số request đang chờ chỗ xử lý", ("pool",))
+REJECTED_REQUESTS = metrics.Counter("inference_rejected_total", "Số request bị từ chối hoặc bỏ", ("pool", "reason"))
+
+class Overloaded(Exception):
+    """Hàng đợi đã đầy (hoặc thời gian chờ ước tính vượt quá hạn của request)"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Máy chủ đang quá tải, thử lại sau {retry_after} giây")
+        self.retry_after = retry_after
+
+class DeadlineExceeded(Exception):
+    """Request đã hết hạn trước khi được xử lý xong"""
+
+    def __init__(self, message="Request đã hết hạn trước khi được xử lý"):
+        super().__init__(message)
+
+def check_deadline(deadline):
+    """
+    Ném DeadlineExceeded nếu đã quá hạn
+
+    Args:
+        deadline: Thời điểm hết hạn theo time.monotonic() (None nếu không có hạn)
+    """
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded()
+
+class AdmissionController:
+    """
+    Giới hạn số request được xử lý đồng thời với một hàng đợi có kích thước cố định
+    Request vượt quá giới hạn phải chờ theo thứ tự đến; khi hàng đợi đầy request mới bị
+    từ chối ngay (kèm thời gian nên thử lại) thay vì làm tăng độ trễ của mọi request
+    """
+
+    def __init__(self, name, max_concurrency, max_queue):
+        """
+        Khởi tạo bộ kiểm soát
+
+        Args:
+            name: Tên nhóm (nhãn của các chỉ số)
+            max_concurrency: Số request được xử lý đồng thời
+            max_queue: Số request tối đa được chờ
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters = deque()   # Event của các request đang chờ, theo thứ tự đến
+        self._lock = threading.Lock()
+        self._service_time = None # Thời gian xử lý trung bình (trung bình trượt, giây)
+
+    def retry_after(self):
+        """Số giây ước tính đến khi có chỗ cho một request mới"""
+        with self._lock:
+            return self._retry_after()
+
+    def _retry_after(self):
+        service_time = self._service_time or 1.0
+        return max(1, math.ceil(service_time * (len(self._waiters) + 1) / self.max_concurrency))
+
+    def _estimated_wait(self):
+        if self._service_time is None:
+            return 0.0
+        return self._service_time * (len(self._waiters) + 1) / self.max_concurrency
+
+    @contextmanager
+    def admit(self, deadline=None):
+        """
+        Giữ một chỗ xử lý trong khi khối lệnh chạy
+
+        Args:
+            deadline: Thời điểm hết hạn theo time.monotonic() (None nếu không có hạn)
+
+        Raises:
+            Overloaded: Hàng đợi đầy hoặc không thể đến lượt trước khi hết hạn
+            DeadlineExceeded: Hết hạn trong khi chờ
+        """
+        waiter = None
+        with self._lock:
+            if self.active < self.max_concurrency and not self._waiters:
+                self.active += 1
+            elif len(self._waiters) >= self.max_queue or (
+                    deadline is not None and time.monotonic() + self._estimated_wait() > deadline):
+                REJECTED_REQUESTS.inc(pool=self.name, reason="overloaded")
+                raise Overloaded(self._retry_after())
+            else:
+                waiter = threading.Event()
+                self._waiters.append(waiter)
+                QUEUED_REQUESTS.set(len(self._waiters), pool=self.name)
+
+        if waiter is not None and not waiter.wait(None if deadline is None else max(0.0, deadline - time.monotonic())):
+            with self._lock:
+                # Có thể vừa được nhường chỗ ngay khi hết thời gian chờ
+                expired = not waiter.is_set()
+                if expired:
+                    self._waiters.remove(waiter)
+                    QUEUED_REQUESTS.set(len(self._waiters), pool=self.name)
+            if expired:
+                REJECTED_REQUESTS.inc(pool=self.name, reason="deadline")
+                raise DeadlineExceeded("Request đã hết hạn khi đang chờ trong hàng đợi")
+
+        ACTIVE_REQUESTS.set(self.active, pool=self.name)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def _release(self, elapsed):
+        with self._lock:
+            if self._service_time is None:
+                self._service_time = elapsed
+            else:
+                self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+            if self._waiters:
+                # Nhường chỗ trực tiếp cho request chờ lâu nhất (số chỗ đang dùng không đổi)
+                self._waiters.popleft().set()
+                QUEUED_REQUESTS.set(len(self._waiters), pool=self.name)
+            else:
+                self.active -= 1
+            ACTIVE_REQUESTS.set(self.active, pool=self.name)
@@ -1,19 +1,51 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import io
 import os
-import uuid
+import math
 import json
+import time
+import functools
+import tarfile
+import threading
+import zipfile
 import tempfile
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.exceptions import RequestEntityTooLarge
+from flask import Flask, Request, Response, request, jsonify, send_from_directory, g
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
+from flask_sock import Sock
 from speaker_recognition_app import SpeakerRecognitionApp
 from speech_to_text import SpeechToText
+from batch_scheduler import BatchScheduler
+from background_jobs import JobManager
+from streaming_identifier import StreamingIdentifier, PcmDecoder
+from online_diarization import OnlineDiarizer
+from admission_control import AdmissionController, Overloaded, DeadlineExceeded, check_deadline
+import metrics
+
+class InMemoryRequest(Request):
+    """
+    Request giữ các file upload trong bộ nhớ thay vì file tạm trên đĩa
+    Body được đọc theo từng khối, tổng kích thước bị giới hạn bởi MAX_CONTENT_LENGTH;
+    các endpoint trong UPLOAD_LIMITS có giới hạn riêng và file lớn được ghi ra file tạm
+    """
+    @property
+    def max_content_length(self):
+        limit = UPLOAD_LIMITS.get(self.endpoint)
+        return limit if limit is not None else super().max_content_length
+        
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint in UPLOAD_LIMITS:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return io.BytesIO()
 
 # Khởi tạo Flask app
 app = Flask(__name__, static_folder='static')
+app.request_class = InMemoryRequest
+sock = Sock(app)
 
 # Cấu hình CORS chi tiết hơn với các domain cụ thể
 CORS(app, resources={r"/*": {
@@ -24,6 +56,20 @@ CORS(app, resources={r"/*": {
     "supports_credentials": True
 }})
 
+# Số request đang xử lý và độ trễ theo endpoint
+REQUESTS_IN_FLIGHT = metrics.Gauge("http_requests_in_flight", "Số request đang được xử lý", ("endpoint",))
+REQUEST_SECONDS = metrics.Histogram("http_request_duration_seconds", "Thời gian xử lý request", ("endpoint", "status"))
+
+@app.before_request
+def track_request_start():
+    request.metrics_started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc(endpoint=request.endpoint)
+
+@app.teardown_request
+def track_request_end(error=None):
+    if hasattr(request, 'metrics_started'):
+        REQUESTS_IN_FLIGHT.dec(endpoint=request.endpoint)
+
 # Middleware để đảm bảo CORS headers được áp dụng cho mỗi response
 @app.after_request
 def after_request(response):
@@ -36,25 +82,189 @@ def after_request(response):
     else:
         response.headers.add('Access-Control-Allow-Credentials', 'true')
         response.headers.add('Access-Control-Allow-Origin', origin)
+    if hasattr(request, 'metrics_started'):
+        REQUEST_SECONDS.observe(time.perf_counter() - request.metrics_started,
+                                endpoint=request.endpoint, status=response.status_code)
     return response
 
 # Cấu hình
-UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'wav', 'mp3', 'ogg', 'flac', 'm4a'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+EMBED_MAX_BATCH_SIZE = 16   # Số yêu cầu embed tối đa được gom vào một batch
+EMBED_MAX_WAIT = 0.005      # Thời gian chờ gom batch (giây)
+ENROLLMENT_WORKERS = 1      # Số tác vụ đăng ký người nói chạy nền đồng thời
+BULK_CHUNK_SIZE = 64        # Số file được giải mã, embed và tìm kiếm cùng lúc khi nhận dạng hàng loạt
+BULK_MAX_FILE_SIZE = 16 * 1024 * 1024  # Kích thước tối đa của mỗi file trong archive sau khi giải nén
+BULK_MAX_CONTENT_LENGTH = 1024 * 1024 * 1024  # Kích thước tối đa của request nhận dạng hàng loạt (1GB)
+DB_RELOAD_INTERVAL = 1.0    # Chu kỳ (giây) kiểm tra thay đổi cơ sở dữ liệu do tiến trình khác ghi
+INFERENCE_CONCURRENCY = EMBED_MAX_BATCH_SIZE  # Số request nhận dạng/so sánh được xử lý đồng thời
+INFERENCE_QUEUE_SIZE = 64   # Số request nhận dạng/so sánh được chờ, vượt quá thì trả về 429
+STT_CONCURRENCY = 8         # Số request speech-to-text được xử lý đồng thời
+STT_QUEUE_SIZE = 32         # Số request speech-to-text được chờ
+STT_BACKEND = "google"      # Backend nhận dạng văn bản (xem speech_to_text.RECOGNIZER_BACKENDS)
+STT_CHUNK_WORKERS = 4       # Số đoạn của một file âm thanh dài được nhận dạng đồng thời
+JOBS_DIRNAME = "jobs"       # Thư mục con của speaker_db chứa trạng thái tác vụ nền
+STREAM_MAX_WINDOW = 30.0    # Độ dài cửa sổ tối đa (giây) của các endpoint WebSocket
+# Giới hạn kích thước request riêng theo endpoint (thay cho MAX_CONTENT_LENGTH)
+UPLOAD_LIMITS = {'identify_speakers_batch': BULK_MAX_CONTENT_LENGTH}
+REQUEST_TIMEOUT = 30.0      # Hạn mặc định (giây) của request khi client không gửi X-Request-Timeout
+MAX_REQUEST_TIMEOUT = 300.0 # Hạn tối đa (giây) client được yêu cầu, hạn dài hơn bị giới hạn về giá trị này
 
-# Đảm bảo thư mục upload tồn tại
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-# Khởi tạo ứng dụng nhận dạng người nói
+# Khởi tạo ứng dụng nhận dạng người nói (model được tải một lần khi import; với
+# gunicorn --preload các worker fork từ tiến trình này dùng chung bộ nhớ model)
 speaker_app = SpeakerRecognitionApp()
 speaker_app.initialize()
 
+def watch_database():
+    """Định kỳ tải lại cơ sở dữ liệu khi tiến trình khác (worker khác, CLI) ghi thay đổi"""
+    while True:
+        time.sleep(DB_RELOAD_INTERVAL)
+        try:
+            if speaker_app.reload_database():
+                print(f"Tiến trình {os.getpid()} đã tải lại cơ sở dữ liệu")
+        except Exception as e:
+            print(f"Lỗi khi tải lại cơ sở dữ liệu: {str(e)}")
+
+def start_worker_services():
+    """
+    Khởi tạo các thành phần chạy luồng nền của tiến trình phục vụ request
+    Với gunicorn được gọi trong post_fork của từng worker (xem gunicorn.conf.py); khi chạy
+    một tiến trình (python api.py, gunicorn không preload) được gọi ở request đầu tiên.
+    Tiến trình chính của gunicorn --preload không phục vụ request nên không chạy các luồng này.
+    """
+    global jobs, decode_pool, stt_pool, _services_pid
+    speaker_app.after_fork()
+
+    # Gom các yêu cầu nhận dạng đồng thời thành một lần chạy model
+    speaker_app.scheduler = BatchScheduler(speaker_app.embedder, max_batch_size=EMBED_MAX_BATCH_SIZE,
+                                           max_wait=EMBED_MAX_WAIT)
+
+    # Các tác vụ đăng ký người nói chạy nền, không giữ luồng xử lý request; trạng thái
+    # được lưu trong thư mục cơ sở dữ liệu để worker nào cũng trả lời được GET /jobs/<id>
+    jobs = JobManager(max_workers=ENROLLMENT_WORKERS, state_dir=os.path.join(speaker_app.database_dir, JOBS_DIRNAME))
+
+    # Nhóm luồng giải mã âm thanh song song cho nhận dạng hàng loạt
+    decode_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="decode")
+
+    # Nhóm luồng gọi dịch vụ speech-to-text song song với trích xuất embedding
+    stt_pool = ThreadPoolExecutor(max_workers=STT_CONCURRENCY, thread_name_prefix="stt")
+
+    # Nhận thay đổi cơ sở dữ liệu từ các worker khác
+    threading.Thread(target=watch_database, name="database-watch", daemon=True).start()
+    _services_pid = os.getpid()
+
+# Tiến trình đã khởi tạo các luồng nền (tiến trình con sau fork phải khởi tạo lại)
+jobs = decode_pool = stt_pool = None
+_services_pid = None
+_services_lock = threading.Lock()
+
+@app.before_request
+def ensure_worker_services():
+    """Khởi tạo các luồng nền ở request đầu tiên nếu tiến trình này chưa có"""
+    if _services_pid != os.getpid():
+        with _services_lock:
+            if _services_pid != os.getpid():
+                start_worker_services()
+
+# Giới hạn số request suy luận đồng thời, request quá hạn bị bỏ trước khi chạy model
+inference_admission = AdmissionController("inference", INFERENCE_CONCURRENCY, INFERENCE_QUEUE_SIZE)
+stt_admission = AdmissionController("speech_to_text", STT_CONCURRENCY, STT_QUEUE_SIZE)
+
+def request_deadline():
+    """
+    Thời điểm hết hạn của request theo time.monotonic()
+    Client gửi X-Request-Timeout (số giây kể từ lúc gửi) hoặc X-Request-Deadline
+    (thời điểm Unix, giây); không có thì dùng REQUEST_TIMEOUT. Thời gian còn lại
+    được giới hạn tối đa MAX_REQUEST_TIMEOUT
+    
+    Raises:
+        ValueError: Nếu giá trị không phải số hữu hạn (ví dụ inf, nan)
+    """
+    if 'X-Request-Deadline' in request.headers:
+        timeout = float(request.headers['X-Request-Deadline']) - time.time()
+    else:
+        timeout = float(request.headers.get('X-Request-Timeout', REQUEST_TIMEOUT))
+    if not math.isfinite(timeout):
+        raise ValueError(f'Hạn của request phải là số hữu hạn: {timeout}')
+    return time.monotonic() + min(timeout, MAX_REQUEST_TIMEOUT)
+
+def admission_controlled(controller):
+    """
+    Chỉ chạy endpoint khi có chỗ trong nhóm xử lý của controller
+    Trả về 429 kèm Retry-After khi hàng đợi đầy và 504 khi request hết hạn; hạn của
+    request được lưu trong g.deadline để truyền xuống các bước xử lý
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                g.deadline = request_deadline()
+            except ValueError:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'X-Request-Timeout hoặc X-Request-Deadline không hợp lệ'
+                }), 400
+            try:
+                with controller.admit(g.deadline):
+                    return view(*args, **kwargs)
+            except Overloaded as e:
+                response = jsonify({
+                    'status': 'error',
+                    'message': str(e)
+                })
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response, 429
+            except DeadlineExceeded as e:
+                return jsonify({
+                    'status': 'error',
+                    'message': str(e)
+                }), 504
+        return wrapper
+    return decorator
+
+# Các chỉ số đọc trực tiếp từ trạng thái ứng dụng khi /metrics được gọi
+def _cache_hit_ratio():
+    cache = speaker_app.embedder.cache
+    if cache is None or cache.hits + cache.misses == 0:
+        return None
+    return cache.hits / (cache.hits + cache.misses)
+
+metrics.Callback("speaker_model_load_seconds", "Thời gian tải model nhận dạng người nói",
+                 lambda: speaker_app.embedder.load_seconds)
+metrics.Callback("speaker_index_vectors", "Số embeddings trong Faiss index", lambda: speaker_app.database.ntotal)
+metrics.Callback("speaker_count", "Số người nói trong cơ sở dữ liệu", lambda: len(speaker_app.database.names))
+metrics.Callback("embedding_cache_hits_total", "Số lần tìm thấy embedding trong cache",
+                 lambda: speaker_app.embedder.cache.hits if speaker_app.embedder.cache else None, type="counter")
+metrics.Callback("embedding_cache_misses_total", "Số lần không tìm thấy embedding trong cache",
+                 lambda: speaker_app.embedder.cache.misses if speaker_app.embedder.cache else None, type="counter")
+metrics.Callback("embedding_cache_hit_ratio", "Tỉ lệ tìm thấy embedding trong cache", _cache_hit_ratio)
+metrics.Callback("embedding_batches_total", "Số batch đã chạy qua bộ gom batch",
+                 lambda: speaker_app.scheduler.batches, type="counter")
+metrics.Callback("embedding_batched_requests_total", "Số yêu cầu embed đã xử lý qua bộ gom batch",
+                 lambda: speaker_app.scheduler.items, type="counter")
+metrics.Callback("embedding_queue_size", "Số yêu cầu embed đang chờ trong bộ gom batch",
+                 lambda: speaker_app.scheduler.pending())
+metrics.Callback("embedding_expired_total", "Số yêu cầu embed bị bỏ vì hết hạn trước khi chạy model",
+                 lambda: speaker_app.scheduler.expired, type="counter")
+
 # Hàm kiểm tra định dạng file
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Hàm lấy nội dung file upload (đã nằm trong bộ nhớ, không ghi ra đĩa)
+def upload_stream(file):
+    file.stream.seek(0)
+    return file.stream
+
+def detach_upload(file):
+    """
+    Lấy stream của file upload ra khỏi request để đọc sau khi request kết thúc
+    (request chỉ đóng stream rỗng được gắn thay), người gọi phải tự đóng stream
+    """
+    stream = upload_stream(file)
+    file.stream = io.BytesIO()
+    return stream
+
 # Route phục vụ file index.html
 @app.route('/')
 def index():
@@ -65,6 +275,12 @@ def index():
 def static_files(path):
     return send_from_directory('static', path)
 
+# ====================== METRICS ======================
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Các chỉ số vận hành theo định dạng văn bản của Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # ====================== HEALTH CHECK ======================
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -122,19 +338,11 @@ def create_speaker():
                 'message': 'Không có file nào được gửi lên'
             }), 400
         
-        # Lưu các file vào thư mục upload
+        # Giữ nội dung các file trong bộ nhớ cho tác vụ nền (stream của request sẽ bị đóng)
         saved_files = []
         for file in files:
             if file and allowed_file(file.filename):
-                # Tạo tên file ngẫu nhiên để tránh trùng lặp
-                original_filename = secure_filename(file.filename)
-                extension = original_filename.rsplit('.', 1)[1].lower()
-                random_filename = f"{uuid.uuid4().hex}.{extension}"
-                
-                # Lưu file
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], random_filename)
-                file.save(file_path)
-                saved_files.append(file_path)
+                saved_files.append(io.BytesIO(upload_stream(file).getvalue()))
         
         if not saved_files:
             return jsonify({
@@ -142,24 +350,21 @@ def create_speaker():
                 'message': 'Không có file hợp lệ nào được gửi lên'
             }), 400
         
-        # Thêm người nói vào cơ sở dữ liệu
-        success = speaker_app.add_speaker(saved_files, speaker_name)
+        # Thêm người nói vào cơ sở dữ liệu trong tác vụ nền
+        job_id = jobs.submit('enroll_speaker', enroll_speaker, saved_files, speaker_name)
         
-        # Trả về kết quả
-        if success:
-            return jsonify({
-                'status': 'success',
-                'data': {
-                    'speaker_name': speaker_name,
-                    'file_count': len(saved_files)
-                },
-                'message': f'Đã tạo người nói {speaker_name} với {len(saved_files)} file âm thanh'
-            }), 201
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': 'Không thể tạo người nói trong cơ sở dữ liệu'
-            }), 500
+        # Trả về id tác vụ ngay, kết quả được tra cứu qua GET /jobs/<job_id>
+        response = jsonify({
+            'status': 'success',
+            'data': {
+                'job_id': job_id,
+                'speaker_name': speaker_name,
+                'file_count': len(saved_files)
+            },
+            'message': f'Đã nhận yêu cầu tạo người nói {speaker_name} với {len(saved_files)} file âm thanh'
+        })
+        response.headers['Location'] = f'/jobs/{job_id}'
+        return response, 202
             
     except Exception as e:
         return jsonify({
@@ -167,6 +372,15 @@ def create_speaker():
             'message': f'Lỗi khi tạo người nói: {str(e)}'
         }), 500
 
+def enroll_speaker(saved_files, speaker_name, progress):
+    """Tác vụ nền: trích xuất embeddings và thêm người nói vào cơ sở dữ liệu"""
+    if not speaker_app.add_speaker(saved_files, speaker_name, progress=progress):
+        raise RuntimeError('Không thể tạo người nói trong cơ sở dữ liệu')
+    return {
+        'speaker_name': speaker_name,
+        'file_count': len(saved_files)
+    }
+
 @app.route('/speakers/<speaker_name>', methods=['DELETE'])
 def delete_speaker(speaker_name):
     """Xóa người nói khỏi cơ sở dữ liệu"""
@@ -188,8 +402,25 @@ def delete_speaker(speaker_name):
             'message': f'Lỗi khi xóa người nói: {str(e)}'
         }), 500
 
+# ====================== JOBS ======================
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Lấy trạng thái, tiến độ và kết quả của tác vụ nền"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({
+            'status': 'error',
+            'message': f'Không tìm thấy tác vụ {job_id}'
+        }), 404
+    return jsonify({
+        'status': 'success',
+        'data': job,
+        'message': f'Tác vụ {job_id}: {job["status"]}'
+    }), 200
+
 # ====================== SPEAKER IDENTIFICATION ======================
 @app.route('/speakers/identify', methods=['POST'])
+@admission_controlled(inference_admission)
 def identify_speaker():
     """Nhận dạng người nói từ file âm thanh"""
     try:
@@ -207,29 +438,29 @@ def identify_speaker():
                 'message': 'File không hợp lệ'
             }), 400
         
-        # Lấy ngưỡng từ request (nếu có)
-        threshold = request.form.get('threshold', 0.6)
+        # Lấy ngưỡng và số kết quả xét từ request (nếu có), chỉ áp dụng cho request này
+        threshold = request.form.get('threshold', speaker_app.threshold)
         try:
             threshold = float(threshold)
         except:
-            threshold = 0.6
+            threshold = speaker_app.threshold
+        try:
+            top_k = max(1, int(request.form.get('top_k', 5)))
+        except:
+            top_k = 5
         
-        # Lưu file tạm thời
-        original_filename = secure_filename(file.filename)
-        extension = original_filename.rsplit('.', 1)[1].lower()
-        random_filename = f"{uuid.uuid4().hex}.{extension}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], random_filename)
-        file.save(file_path)
+        # Giải mã file trực tiếp trong bộ nhớ
+        try:
+            signal = speaker_app.embedder.load_signal(upload_stream(file))
+        except Exception as e:
+            return jsonify({
+                'status': 'error',
+                'message': f'Không thể đọc file âm thanh: {str(e)}'
+            }), 422
         
         # Nhận dạng người nói
-        speaker_app.threshold = threshold
-        name, similarity, is_known = speaker_app.identify_file(file_path)
-        
-        # Xóa file tạm
-        try:
-            os.remove(file_path)
-        except:
-            pass
+        name, similarity, is_known = speaker_app.identify_signal(signal, threshold=threshold, top_k=top_k,
+                                                                 deadline=g.deadline)
         
         # Trả về kết quả
         if name is None:
@@ -260,14 +491,277 @@ def identify_speaker():
                 'message': f'Người nói không xác định. Gần nhất: {name} (độ tương đồng: {similarity:.4f}, thấp hơn ngưỡng {threshold})'
             }), 200
             
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi nhận dạng người nói: {str(e)}'
+        }), 500
+
+def stream_window_params(default_window, default_hop):
+    """
+    Đọc window và hop (giây) từ query string của endpoint WebSocket
+    
+    Raises:
+        ValueError: Nếu không phải số, window không thuộc (0, STREAM_MAX_WINDOW]
+                    hoặc hop không thuộc (0, window]
+    """
+    window = float(request.args.get('window', default_window))
+    hop = float(request.args.get('hop', default_hop))
+    if not 0 < window <= STREAM_MAX_WINDOW:
+        raise ValueError(f'window phải lớn hơn 0 và không quá {STREAM_MAX_WINDOW} giây')
+    if not 0 < hop <= window:
+        raise ValueError('hop phải lớn hơn 0 và không quá window')
+    return window, hop
+
+@sock.route('/speakers/identify/stream')
+def identify_speaker_stream(ws):
+    """
+    Nhận dạng người nói trên luồng âm thanh qua WebSocket
+    
+    Client gửi các message nhị phân chứa PCM mono 16kHz (mặc định int16 little-endian),
+    server gửi lại kết quả JSON sau mỗi bước hop. Các tham số truyền qua query string:
+    threshold, top_k, window, hop (giây), format ("int16" hoặc "float32").
+    """
+    try:
+        decoder = PcmDecoder(request.args.get('format', 'int16'))
+        window, hop = stream_window_params(3.0, 0.5)
+        stream = StreamingIdentifier(
+            speaker_app,
+            window=window,
+            hop=hop,
+            threshold=float(request.args.get('threshold', speaker_app.threshold)),
+            top_k=max(1, int(request.args.get('top_k', 5)))
+        )
+    except ValueError as e:
+        ws.send(json.dumps({
+            'status': 'error',
+            'message': f'Tham số không hợp lệ: {str(e)}'
+        }, ensure_ascii=False))
+        return
+        
+    while True:
+        message = ws.receive()
+        if message is None:
+            break
+        if isinstance(message, str):
+            # Message văn bản "end" để kết thúc luồng
+            if message.strip() == 'end':
+                break
+            continue
+            
+        for result in stream.feed(decoder.decode(message)):
+            ws.send(json.dumps({
+                'status': 'success',
+                'data': result
+            }, ensure_ascii=False))
+
+@sock.route('/diarization/stream')
+def diarization_stream(ws):
+    """
+    Phân đoạn người nói trực tuyến ("ai đang nói") trên luồng âm thanh qua WebSocket
+    
+    Client gửi các message nhị phân chứa PCM mono 16kHz (mặc định int16 little-endian),
+    server gửi lại nhãn người nói của mỗi cửa sổ vừa hoàn thành kèm độ trễ xử lý. Khi
+    client gửi "end", server gửi thống kê của phiên rồi đóng kết nối. Các tham số truyền
+    qua query string: window, hop (giây), threshold, max_speakers, format.
+    """
+    try:
+        decoder = PcmDecoder(request.args.get('format', 'int16'))
+        window, hop = stream_window_params(1.5, 0.75)
+        diarizer = OnlineDiarizer(
+            speaker_app.embedder,
+            window=window,
+            hop=hop,
+            threshold=float(request.args.get('threshold', 0.4)),
+            max_speakers=max(1, int(request.args.get('max_speakers', 10)))
+        )
+    except ValueError as e:
+        ws.send(json.dumps({
+            'status': 'error',
+            'message': f'Tham số không hợp lệ: {str(e)}'
+        }, ensure_ascii=False))
+        return
+        
+    while True:
+        message = ws.receive()
+        if message is None:
+            return
+        if isinstance(message, str):
+            # Message văn bản "end" để kết thúc luồng
+            if message.strip() == 'end':
+                break
+            continue
+            
+        for result in diarizer.feed(decoder.decode(message)):
+            ws.send(json.dumps({
+                'status': 'success',
+                'data': result
+            }, ensure_ascii=False))
+            
+    ws.send(json.dumps({
+        'status': 'success',
+        'summary': diarizer.stats()
+    }, ensure_ascii=False))
+
+def iter_bulk_files(files, archive):
+    """
+    Liệt kê các file âm thanh của request nhận dạng hàng loạt
+    
+    Các file được đọc lần lượt khi cần, chỉ một file của archive nằm trong bộ nhớ mỗi lần
+    
+    Args:
+        files: List (tên file, stream) của các file gửi trực tiếp
+        archive: Stream chứa archive zip/tar (hoặc None)
+        
+    Yields:
+        Tuple (tên file, nội dung) - nội dung là None nếu file vượt quá BULK_MAX_FILE_SIZE
+    """
+    for name, stream in files:
+        yield name, stream.read()
+    
+    if archive is None:
+        return
+    stream = archive
+    stream.seek(0)
+    if zipfile.is_zipfile(stream):
+        stream.seek(0)
+        with zipfile.ZipFile(stream) as zip_file:
+            for info in zip_file.infolist():
+                if not info.is_dir() and allowed_file(info.filename):
+                    yield info.filename, zip_file.read(info) if info.file_size <= BULK_MAX_FILE_SIZE else None
+    else:
+        stream.seek(0)
+        with tarfile.open(fileobj=stream, mode='r:*') as tar_file:
+            for member in tar_file:
+                if member.isfile() and allowed_file(member.name):
+                    yield member.name, tar_file.extractfile(member).read() if member.size <= BULK_MAX_FILE_SIZE else None
+
+def identify_bulk_chunk(items, database, threshold, top_k):
+    """
+    Nhận dạng một nhóm file: giải mã song song, embed theo batch và tìm kiếm một lần
+    
+    Args:
+        items: List (tên file, nội dung) từ iter_bulk_files
+        database: Snapshot SpeakerDatabase dùng cho cả request
+        threshold: Ngưỡng độ tương đồng
+        top_k: Số kết quả gần nhất được xét
+    
+    Returns:
+        List dictionary kết quả theo thứ tự file
+    """
+    results = [{'file': name} for name, _ in items]
+    
+    # Giải mã song song
+    futures = {}
+    for i, (name, data) in enumerate(items):
+        if data is None:
+            results[i].update(status='error', message='File quá lớn')
+            continue
+        futures[i] = decode_pool.submit(speaker_app.embedder.load_signal, io.BytesIO(data))
+        
+    signals = []
+    rows = []
+    for i, future in futures.items():
+        try:
+            signals.append(future.result())
+            rows.append(i)
+        except Exception as e:
+            results[i].update(status='error', message=f'Không thể đọc file âm thanh: {str(e)}')
+            
+    if signals:
+        embeddings = speaker_app.embedder.embed_signals(signals)
+        for i, (name, similarity, is_known) in zip(rows, database.identify_speakers(embeddings, threshold, top_k)):
+            results[i].update(
+                status='success',
+                is_known=bool(is_known),
+                speaker_name=name,
+                similarity=float(similarity)
+            )
+    return results
+
+@app.route('/speakers/identify/batch', methods=['POST'])
+def identify_speakers_batch():
+    """
+    Nhận dạng người nói cho nhiều file âm thanh (files[] và/hoặc một archive zip/tar)
+    Kết quả được trả về dạng NDJSON, mỗi dòng một file, ngay khi từng nhóm file xử lý xong
+    """
+    try:
+        files = [file for file in request.files.getlist('files[]') if file and allowed_file(file.filename)]
+        archive = request.files.get('archive') or None
+        if not files and archive is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'Không có file nào được gửi lên'
+            }), 400
+            
+        threshold = request.form.get('threshold', speaker_app.threshold)
+        try:
+            threshold = float(threshold)
+        except:
+            threshold = speaker_app.threshold
+        try:
+            top_k = max(1, int(request.form.get('top_k', 5)))
+        except:
+            top_k = 5
+            
+        # Dùng một snapshot database cho cả request
+        database = speaker_app.database
+        if database is None or database.ntotal == 0:
+            return jsonify({
+                'status': 'error',
+                'message': 'Cơ sở dữ liệu trống, hãy thêm người nói trước'
+            }), 422
+            
+        if archive is not None and not (zipfile.is_zipfile(upload_stream(archive)) or tarfile.is_tarfile(upload_stream(archive))):
+            return jsonify({
+                'status': 'error',
+                'message': 'Archive phải là file zip hoặc tar'
+            }), 400
+            
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': f'Lỗi khi nhận dạng người nói: {str(e)}'
         }), 500
+        
+    # Các file được đọc dần trong lúc gửi response nên stream được tách khỏi request
+    # (request đóng các file upload trước khi response được gửi xong)
+    files = [(file.filename, detach_upload(file)) for file in files]
+    archive = detach_upload(archive) if archive is not None else None
+        
+    def generate():
+        chunk = []
+        try:
+            for item in iter_bulk_files(files, archive):
+                chunk.append(item)
+                if len(chunk) == BULK_CHUNK_SIZE:
+                    for result in identify_bulk_chunk(chunk, database, threshold, top_k):
+                        yield json.dumps(result, ensure_ascii=False) + '\n'
+                    chunk = []
+            if chunk:
+                for result in identify_bulk_chunk(chunk, database, threshold, top_k):
+                    yield json.dumps(result, ensure_ascii=False) + '\n'
+        except Exception as e:
+            # Response đã bắt đầu gửi nên lỗi được báo bằng một dòng riêng
+            yield json.dumps({
+                'status': 'error',
+                'message': f'Lỗi khi nhận dạng người nói: {str(e)}'
+            }, ensure_ascii=False) + '\n'
+        finally:
+            for _, stream in files:
+                stream.close()
+            if archive is not None:
+                archive.close()
+                
+    return Response(generate(), mimetype='application/x-ndjson')
 
 # ====================== SIMILARITY CHECK ======================
 @app.route('/similarity', methods=['POST'])
+@admission_controlled(inference_admission)
 def check_similarity():
     """Kiểm tra độ tương đồng giữa hai file âm thanh"""
     try:
@@ -287,26 +781,18 @@ def check_similarity():
                 'message': 'File không hợp lệ'
             }), 400
         
-        # Lưu các file tạm thời
-        file1_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}.wav")
-        file2_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}.wav")
-        file1.save(file1_path)
-        file2.save(file2_path)
-        
         # Khởi tạo ứng dụng nếu cần
         if speaker_app.embedder is None:
             speaker_app.initialize()
         
-        # Trích xuất embeddings
-        embedding1 = speaker_app.embedder.process_audio(file1_path)
-        embedding2 = speaker_app.embedder.process_audio(file2_path)
-        
-        # Xóa file tạm
+        # Giải mã trong bộ nhớ và trích xuất embeddings
         try:
-            os.remove(file1_path)
-            os.remove(file2_path)
-        except:
-            pass
+            embedding1 = speaker_app.embed_signal(speaker_app.embedder.load_signal(upload_stream(file1)), g.deadline)
+            embedding2 = speaker_app.embed_signal(speaker_app.embedder.load_signal(upload_stream(file2)), g.deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            embedding1 = embedding2 = None
         
         if embedding1 is None or embedding2 is None:
             return jsonify({
@@ -325,6 +811,8 @@ def check_similarity():
             'message': f'Độ tương đồng giữa hai file: {similarity:.4f}'
         }), 200
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -333,6 +821,7 @@ def check_similarity():
 
 # ====================== SPEECH TO TEXT ======================
 @app.route('/speech-to-text/files', methods=['POST'])
+@admission_controlled(stt_admission)
 def convert_file_to_text():
     """Nhận dạng văn bản từ file âm thanh"""
     try:
@@ -353,33 +842,32 @@ def convert_file_to_text():
         # Lấy ngôn ngữ (nếu có)
         language = request.form.get('language', 'vi-VN')
         
-        # Lưu file tạm thời
-        original_filename = secure_filename(file.filename)
-        extension = original_filename.rsplit('.', 1)[1].lower()
-        random_filename = f"{uuid.uuid4().hex}.{extension}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], random_filename)
-        file.save(file_path)
+        # Chia file dài theo khoảng lặng: true/false, mặc định tự chọn theo độ dài
+        long_form = request.form.get('long_form')
+        if long_form is not None:
+            long_form = long_form.lower() in ('1', 'true', 'yes')
         
         # Khởi tạo speech-to-text
-        stt = SpeechToText(language=language)
+        stt = SpeechToText(language=language, backend=STT_BACKEND, workers=STT_CHUNK_WORKERS)
         
-        # Nhận dạng văn bản
-        text, success = stt.recognize_from_file(file_path)
-        
-        # Xóa file tạm
-        try:
-            os.remove(file_path)
-        except:
-            pass
+        # Nhận dạng văn bản trực tiếp từ nội dung file trong bộ nhớ (bỏ qua nếu đã quá hạn)
+        check_deadline(g.deadline)
+        result = stt.recognize_from_file(upload_stream(file), long_form=long_form)
+        success = result['success']
+        text = result['data']['transcription']['text'] if success else result['message']
         
         # Trả về kết quả
         if success:
+            data = {
+                'text': text,
+                'language': language
+            }
+            # Các đoạn kèm thời điểm bắt đầu/kết thúc khi file được nhận dạng theo từng đoạn
+            if 'segments' in result['data']['transcription']:
+                data['segments'] = result['data']['transcription']['segments']
             return jsonify({
                 'status': 'success',
-                'data': {
-                    'text': text,
-                    'language': language
-                },
+                'data': data,
                 'message': 'Đã nhận dạng văn bản thành công'
             }), 200
         else:
@@ -388,12 +876,108 @@ def convert_file_to_text():
                 'message': text  # Lỗi được trả về trong text
             }), 422
             
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': f'Lỗi khi nhận dạng văn bản: {str(e)}'
         }), 500
 
+@app.route('/speakers/identify-and-transcribe', methods=['POST'])
+@admission_controlled(inference_admission)
+def identify_and_transcribe():
+    """Nhận dạng người nói và văn bản từ một file âm thanh (giải mã một lần)"""
+    try:
+        # Kiểm tra có file nào được gửi lên không
+        if 'file' not in request.files:
+            return jsonify({
+                'status': 'error',
+                'message': 'Không có file nào được gửi lên'
+            }), 400
+        
+        file = request.files['file']
+        if not file or not allowed_file(file.filename):
+            return jsonify({
+                'status': 'error',
+                'message': 'File không hợp lệ'
+            }), 400
+        
+        # Lấy ngưỡng, số kết quả xét và ngôn ngữ từ request (nếu có)
+        threshold = request.form.get('threshold', speaker_app.threshold)
+        try:
+            threshold = float(threshold)
+        except:
+            threshold = speaker_app.threshold
+        try:
+            top_k = max(1, int(request.form.get('top_k', 5)))
+        except:
+            top_k = 5
+        language = request.form.get('language', 'vi-VN')
+        
+        # Giải mã file một lần thành tín hiệu mono 16kHz dùng chung cho cả hai tác vụ
+        try:
+            signal = speaker_app.embedder.load_signal(upload_stream(file))
+        except Exception as e:
+            return jsonify({
+                'status': 'error',
+                'message': f'Không thể đọc file âm thanh: {str(e)}'
+            }), 422
+        
+        # Nhận dạng văn bản trên luồng khác trong khi nhận dạng người nói trên luồng này
+        with stt_admission.admit(g.deadline):
+            stt = SpeechToText(language=language, backend=STT_BACKEND, workers=STT_CHUNK_WORKERS)
+            stt_future = stt_pool.submit(stt.recognize_signal, signal.numpy(), speaker_app.embedder.sample_rate)
+            try:
+                name, similarity, is_known = speaker_app.identify_signal(signal, threshold=threshold, top_k=top_k,
+                                                                         deadline=g.deadline)
+                try:
+                    stt_result = stt_future.result(max(0.0, g.deadline - time.monotonic()))
+                except TimeoutError:
+                    raise DeadlineExceeded()
+            finally:
+                stt_future.cancel()
+        
+        speaker = None
+        if name is not None:
+            speaker = {
+                'is_known': bool(is_known),
+                'speaker_name' if is_known else 'closest_match': name,
+                'similarity': float(similarity),
+                'threshold': threshold
+            }
+        transcription = None
+        if stt_result['success']:
+            transcription = {
+                'text': stt_result['data']['transcription']['text'],
+                'language': language
+            }
+            
+        if speaker is None and transcription is None:
+            return jsonify({
+                'status': 'error',
+                'message': f'Không thể nhận dạng người nói và văn bản: {stt_result["message"]}'
+            }), 422
+        
+        # Trả về cả hai kết quả (phần không nhận dạng được là null)
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'speaker': speaker,
+                'transcription': transcription
+            },
+            'message': 'Đã nhận dạng người nói và văn bản' if speaker and transcription else
+                       ('Không thể nhận dạng người nói' if speaker is None else stt_result['message'])
+        }), 200
+        
+    except (DeadlineExceeded, Overloaded):
+        raise
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi nhận dạng người nói và văn bản: {str(e)}'
+        }), 500
+
 @app.route('/speech-to-text/recordings', methods=['POST'])
 def create_recording_and_convert():
     """Ghi âm trực tiếp và nhận dạng văn bản"""
@@ -417,7 +1001,7 @@ def create_recording_and_convert():
             }), 400
         
         # Khởi tạo speech-to-text
-        stt = SpeechToText(language=language)
+        stt = SpeechToText(language=language, backend=STT_BACKEND, workers=STT_CHUNK_WORKERS)
         
         # Ghi âm và nhận dạng
         text, success, temp_file = stt.record_and_recognize(record_seconds=duration)
@@ -438,9 +1022,7 @@ def create_recording_and_convert():
             # Nếu cần lưu embedding vào DB
             if data.get('speaker_name') and embedding is not None:
                 speaker_name = data['speaker_name']
-                speaker_app.database.add_embedding(speaker_name, embedding)
-                speaker_app.database.build_index()
-                speaker_app.database.save(speaker_app.database_dir)
+                speaker_app.add_speaker_embeddings(speaker_name, embedding)
                 response_data['embedding_saved'] = True
                 response_data['speaker_name'] = speaker_name
         
@@ -499,7 +1081,7 @@ def method_not_allowed(error):
 def request_entity_too_large(error):
     return jsonify({
         'status': 'error',
-        'message': 'File quá lớn (tối đa 16MB)'
+        'message': f'File quá lớn (tối đa {request.max_content_length // (1024 * 1024)}MB)'
     }), 413
 
 @app.errorhandler(500)
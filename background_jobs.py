@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class JobManager:
+    """
+    Chạy các tác vụ dài (như đăng ký người nói) trên nhóm luồng nền
+    Mỗi tác vụ có id để tra cứu trạng thái, tiến độ và kết quả. Nếu có state_dir, trạng
+    thái được ghi ra file <state_dir>/<id>.json sau mỗi thay đổi để mọi tiến trình dùng
+    chung thư mục (các worker của gunicorn) đều tra cứu được
+    """
+
+    def __init__(self, max_workers=1, max_finished=1000, state_dir=None):
+        """
+        Khởi tạo nhóm luồng nền
+
+        Args:
+            max_workers: Số tác vụ chạy đồng thời (ít luồng để không tranh CPU với nhận dạng)
+            max_finished: Số tác vụ đã kết thúc được giữ lại để tra cứu
+            state_dir: Thư mục lưu trạng thái tác vụ dùng chung giữa các tiến trình (None để
+                       chỉ giữ trong bộ nhớ)
+        """
+        self.max_finished = max_finished
+        self.state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, *args, **kwargs):
+        """
+        Đưa một tác vụ vào hàng đợi
+
+        Args:
+            kind: Loại tác vụ (ví dụ "enroll_speaker")
+            func: Hàm thực hiện tác vụ, được gọi với func(*args, progress=callback, **kwargs),
+                  callback(processed, total) cập nhật tiến độ; giá trị trả về là kết quả
+                  (dictionary), lỗi được ghi nhận khi hàm ném ngoại lệ
+
+        Returns:
+            Id của tác vụ
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "progress": {"processed": 0, "total": None},
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "pid": os.getpid()
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._save(job)
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job_id
+
+    def get(self, job_id):
+        """
+        Lấy trạng thái tác vụ
+
+        Args:
+            job_id: Id của tác vụ
+
+        Returns:
+            Bản sao dictionary mô tả tác vụ hoặc None nếu không tồn tại
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job, progress=dict(job["progress"]))
+        return self._load(job_id)
+
+    def _path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _save(self, job):
+        """Ghi trạng thái tác vụ ra file (gọi khi đang giữ self._lock)"""
+        if not self.state_dir:
+            return
+        path = self._path(job["id"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _load(self, job_id):
+        """Đọc trạng thái tác vụ do tiến trình khác tạo"""
+        if not self.state_dir or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if job["finished_at"] is None and not _process_alive(job.get("pid")):
+            # Tiến trình chạy tác vụ đã dừng trước khi tác vụ kết thúc
+            job.update(status="failed", error="Tiến trình xử lý tác vụ đã dừng")
+        return job
+
+    def _update(self, job, **fields):
+        with self._lock:
+            job.update(fields)
+            self._save(job)
+
+    def _run(self, job, func, args, kwargs):
+        self._update(job, status="running", started_at=time.time())
+
+        def progress(processed, total=None):
+            with self._lock:
+                job["progress"] = {"processed": processed, "total": total}
+                self._save(job)
+
+        try:
+            result = func(*args, progress=progress, **kwargs)
+        except Exception as e:
+            self._update(job, status="failed", error=str(e), finished_at=time.time())
+        else:
+            self._update(job, status="succeeded", result=result, finished_at=time.time())
+        self._prune()
+
+    def _prune(self):
+        """
+        Bỏ các tác vụ đã kết thúc cũ nhất khi vượt quá max_finished, cả trong bộ nhớ lẫn
+        trong state_dir
+        """
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job["finished_at"] is not None]
+            for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._jobs[job_id]
+        if self.state_dir:
+            self._prune_state_dir()
+
+    def _prune_state_dir(self):
+        """
+        Xóa file của các tác vụ đã kết thúc (hoặc có tiến trình chạy đã dừng) cũ nhất theo
+        thời gian sửa file khi vượt quá max_finished, gồm cả file do các worker đã dừng hay
+        khởi động lại để lại
+        """
+        expired = []
+        for name in os.listdir(self.state_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.state_dir, name)
+            try:
+                mtime = os.path.getmtime(path)
+                with open(path, 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if job.get("finished_at") is not None or not _process_alive(job.get("pid")):
+                expired.append((mtime, path))
+        expired.sort()
+        for _, path in expired[:max(0, len(expired) - self.max_finished)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Worker khác vừa xóa
+                pass
+
+    def shutdown(self, wait=True):
+        """Dừng nhận tác vụ mới và chờ các tác vụ đang chạy"""
+        self._executor.shutdown(wait=wait)
+
+def _process_alive(pid):
+    """Tiến trình pid còn chạy hay không"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Không có quyền gửi tín hiệu nhưng tiến trình vẫn tồn tại
+        return True
+    return True
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import torch
+from diarization import SpeakerDiarizer, CLUSTERING_METHODS, write_rttm, speaking_time
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".m4a", ".ogg")
+CHECKPOINT_FILENAME = "checkpoint.jsonl"
+
+# Trạng thái của tiến trình worker (model được tải một lần trong _init_worker)
+_worker = {}
+
+def list_audio_files(source):
+    """
+    Liệt kê các file cần phân đoạn
+
+    Args:
+        source: Thư mục (tìm đệ quy các file âm thanh) hoặc file manifest (mỗi dòng một
+                đường dẫn, đường dẫn tương đối tính từ thư mục chứa manifest, dòng bắt đầu
+                bằng # bị bỏ qua)
+
+    Returns:
+        List các tuple (khóa, đường dẫn); khóa là đường dẫn tương đối, duy nhất, dùng để
+        đặt tên file kết quả và ghi checkpoint
+    """
+    if os.path.isdir(source):
+        paths = [path for path in sorted(glob.glob(os.path.join(source, "**", "*"), recursive=True))
+                 if path.lower().endswith(AUDIO_EXTENSIONS)]
+        return [(os.path.relpath(path, source), path) for path in paths]
+
+    base = os.path.dirname(os.path.abspath(source))
+    files = []
+    with open(source, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                files.append((line, line if os.path.isabs(line) else os.path.join(base, line)))
+    return files
+
+def output_name(key):
+    """
+    Tên file kết quả (chưa có phần mở rộng của kết quả) ứng với khóa của một file âm thanh
+
+    Giữ nguyên phần mở rộng của file âm thanh (dir/x.wav và dir/x.flac là hai file khác
+    nhau) và mã hóa một-một: "_" thành "_u" rồi dấu phân cách thư mục thành "__", nên
+    a/b.wav và a__b.wav không trùng tên
+    """
+    return key.replace(os.sep, "/").replace("_", "_u").replace("/", "__")
+
+def load_checkpoint(output_dir):
+    """
+    Đọc checkpoint của các lần chạy trước
+
+    Returns:
+        Dictionary khóa -> bản ghi mới nhất {key, status, ...}
+    """
+    records = {}
+    path = os.path.join(output_dir, CHECKPOINT_FILENAME)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Dòng cuối có thể bị ghi dở khi tiến trình bị dừng đột ngột
+                    continue
+                records[record["key"]] = record
+    return records
+
+def _atomic_write(path, write):
+    """Ghi file tạm rồi đổi tên để không bao giờ để lại file kết quả ghi dở"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def _init_worker(options):
+    """Tải model một lần cho mỗi tiến trình worker"""
+    # Chia đều các nhân CPU cho các worker để PyTorch không tranh luồng
+    torch.set_num_threads(options["threads"])
+    if options["identify"]:
+        from speaker_recognition_app import SpeakerRecognitionApp
+        app = SpeakerRecognitionApp(database_dir=options["db_dir"], threshold=options["identify_threshold"],
+                                    cache_dir=None)
+        app.initialize()
+        _worker["app"] = app
+        embedder = app.embedder
+    else:
+        from speaker_embedder import SpeakerEmbedder
+        embedder = SpeakerEmbedder()
+    _worker["diarizer"] = SpeakerDiarizer(embedder, clustering=options["clustering"], threshold=options["threshold"],
+                                          window=options["window"], hop=options["hop"])
+    _worker["options"] = options
+
+def _diarize_file(key, audio_file, output_dir):
+    """
+    Phân đoạn một file trong tiến trình worker và ghi kết quả RTTM/JSON
+
+    Returns:
+        Bản ghi checkpoint của file
+    """
+    options = _worker["options"]
+    started = time.perf_counter()
+    diarize = dict(num_speakers=options["num_speakers"], min_speakers=options["min_speakers"],
+                   max_speakers=options["max_speakers"])
+    if options["identify"]:
+        result = _worker["app"].diarize_and_identify(audio_file, _worker["diarizer"], **diarize)
+        details = {"clusters": result["clusters"], "statistics": result["statistics"]}
+    else:
+        result = _worker["diarizer"].diarize(audio_file, **diarize)
+        details = {}
+    segments = result["segments"]
+
+    name = output_name(key)
+    rttm_path = os.path.join(output_dir, f"{name}.rttm")
+    json_path = os.path.join(output_dir, f"{name}.json")
+    _atomic_write(rttm_path, lambda f: write_rttm(segments, f, Path(audio_file).stem))
+    _atomic_write(json_path, lambda f: json.dump({
+        "file": audio_file,
+        "duration": result["duration"],
+        "segments": segments,
+        "speaking_time": speaking_time(segments),
+        "timings": result["timings"],
+        **details
+    }, f, ensure_ascii=False, indent=2))
+
+    return {
+        "key": key,
+        "status": "done",
+        "outputs": [os.path.basename(rttm_path), os.path.basename(json_path)],
+        "duration": result["duration"],
+        "wall_seconds": time.perf_counter() - started,
+        "worker": os.getpid()
+    }
+
+def run_batch(files, output_dir, workers, options, retry_failed=True):
+    """
+    Phân đoạn nhiều file trên một pool tiến trình, bỏ qua các file đã xong ở lần chạy trước
+
+    Mỗi file xong được ghi một dòng vào checkpoint.jsonl (flush và fsync ngay) sau khi
+    các file kết quả đã được ghi hoàn chỉnh, nên khi bị dừng giữa chừng lần chạy sau chỉ
+    làm lại các file chưa có trong checkpoint.
+
+    Args:
+        files: List (khóa, đường dẫn) từ list_audio_files
+        output_dir: Thư mục kết quả (chứa cả checkpoint)
+        workers: Số tiến trình worker
+        options: Cấu hình phân đoạn (xem main)
+        retry_failed: Chạy lại các file bị lỗi ở lần trước
+
+    Returns:
+        Dictionary thống kê: done, failed, skipped, duration (giây âm thanh), wall_seconds
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint = load_checkpoint(output_dir)
+    pending = []
+    skipped = 0
+    for key, path in files:
+        record = checkpoint.get(key)
+        if record and record["status"] == "done" and all(
+                os.path.exists(os.path.join(output_dir, output)) for output in record["outputs"]):
+            skipped += 1
+        elif record and record["status"] == "error" and not retry_failed:
+            skipped += 1
+        else:
+            pending.append((key, path))
+
+    # File dài chạy trước để các worker kết thúc gần cùng lúc
+    pending.sort(key=lambda item: os.path.getsize(item[1]) if os.path.exists(item[1]) else 0, reverse=True)
+    print(f"{len(pending)} file cần phân đoạn, {skipped} file đã xong từ lần chạy trước, {workers} worker")
+
+    stats = {"done": 0, "failed": 0, "skipped": skipped, "duration": 0.0, "wall_seconds": 0.0}
+    if not pending:
+        return stats
+    started = time.perf_counter()
+    with open(os.path.join(output_dir, CHECKPOINT_FILENAME), 'a', encoding='utf-8') as log, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,)) as pool:
+        futures = {pool.submit(_diarize_file, key, path, output_dir): key for key, path in pending}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                record = future.result()
+            except BrokenProcessPool:
+                # Worker bị dừng đột ngột (ví dụ hết bộ nhớ): các file còn lại chạy ở lần sau
+                print("Một tiến trình worker bị dừng đột ngột, chạy lại lệnh để tiếp tục")
+                break
+            except Exception as e:
+                record = {"key": key, "status": "error", "error": str(e)}
+            log.write(json.dumps(record, ensure_ascii=False) + "\n")
+            log.flush()
+            os.fsync(log.fileno())
+
+            if record["status"] == "done":
+                stats["done"] += 1
+                stats["duration"] += record["duration"]
+                print(f"[{stats['done'] + stats['failed']}/{len(pending)}] {key}: {record['duration']:.1f}s âm thanh, "
+                      f"{record['wall_seconds']:.1f}s")
+            else:
+                stats["failed"] += 1
+                print(f"[{stats['done'] + stats['failed']}/{len(pending)}] {key}: lỗi {record['error']}")
+    stats["wall_seconds"] = time.perf_counter() - started
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Phân đoạn người nói cho nhiều file trên nhiều tiến trình")
+    parser.add_argument("source", help="Thư mục chứa file âm thanh hoặc file manifest (mỗi dòng một đường dẫn)")
+    parser.add_argument("--output_dir", default="diarization_output", help="Thư mục kết quả và checkpoint")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Số tiến trình worker")
+    parser.add_argument("--threads", type=int, help="Số luồng PyTorch mỗi worker (mặc định: số nhân / số worker)")
+    parser.add_argument("--num_speakers", type=int, help="Số lượng người nói cố định (nếu biết trước)")
+    parser.add_argument("--min_speakers", type=int, default=1, help="Số người nói tối thiểu")
+    parser.add_argument("--max_speakers", type=int, default=10, help="Số người nói tối đa")
+    parser.add_argument("--clustering", default="agglomerative", choices=CLUSTERING_METHODS,
+                        help="Phương pháp phân cụm")
+    parser.add_argument("--threshold", type=float, default=0.4, help="Độ tương đồng tối thiểu để gộp hai cụm")
+    parser.add_argument("--window", type=float, default=1.5, help="Độ dài cửa sổ embedding (giây)")
+    parser.add_argument("--hop", type=float, default=0.75, help="Bước trượt cửa sổ (giây)")
+    parser.add_argument("--identify", action="store_true", help="Gán tên người nói đã đăng ký cho từng cụm")
+    parser.add_argument("--db_dir", default="speaker_db", help="Thư mục cơ sở dữ liệu người nói (với --identify)")
+    parser.add_argument("--identify_threshold", type=float, default=0.6,
+                        help="Ngưỡng độ tương đồng tối thiểu để xác định tên người nói (với --identify)")
+    parser.add_argument("--skip_failed", action="store_true", help="Không chạy lại các file bị lỗi ở lần trước")
+    args = parser.parse_args()
+
+    files = list_audio_files(args.source)
+    if not files:
+        print(f"Không tìm thấy file âm thanh nào trong {args.source}")
+        return
+    workers = max(1, min(args.workers, len(files)))
+    options = {
+        "threads": args.threads or max(1, (os.cpu_count() or 1) // workers),
+        "num_speakers": args.num_speakers,
+        "min_speakers": args.min_speakers,
+        "max_speakers": args.max_speakers,
+        "clustering": args.clustering,
+        "threshold": args.threshold,
+        "window": args.window,
+        "hop": args.hop,
+        "identify": args.identify,
+        "db_dir": args.db_dir,
+        "identify_threshold": args.identify_threshold
+    }
+
+    stats = run_batch(files, args.output_dir, workers, options, retry_failed=not args.skip_failed)
+    if stats["wall_seconds"]:
+        print(f"Xong {stats['done']} file ({stats['duration']:.1f}s âm thanh) trong {stats['wall_seconds']:.1f}s, "
+              f"RTF {stats['wall_seconds'] / max(stats['duration'], 1e-9):.3f}; lỗi {stats['failed']}, "
+              f"bỏ qua {stats['skipped']}")
+    if stats["failed"] or stats["done"] + stats["skipped"] + stats["failed"] < len(files):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError
+from admission_control import DeadlineExceeded
+
+class BatchScheduler:
+    """
+    Gom các yêu cầu trích xuất embedding đồng thời thành batch
+    Các yêu cầu đến trong một khoảng thời gian ngắn được đưa qua model trong
+    một lần gọi encode_batch có padding, mỗi yêu cầu nhận lại embedding của mình
+    """
+
+    def __init__(self, embedder, max_batch_size=16, max_wait=0.005):
+        """
+        Khởi tạo bộ gom batch và luồng xử lý nền
+
+        Args:
+            embedder: Đối tượng SpeakerEmbedder
+            max_batch_size: Số yêu cầu tối đa trong một batch
+            max_wait: Thời gian tối đa (giây) chờ thêm yêu cầu sau yêu cầu đầu tiên của batch
+        """
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0   # Số batch đã chạy
+        self.items = 0     # Số yêu cầu đã xử lý
+        self.expired = 0   # Số yêu cầu bị bỏ vì hết hạn trước khi chạy model
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, signal, deadline=None):
+        """
+        Gửi một tín hiệu để trích xuất embedding
+
+        Args:
+            signal: Tensor 1 chiều (mono, 16kHz), ví dụ kết quả của embedder.load_signal
+            deadline: Thời điểm hết hạn theo time.monotonic(); yêu cầu đã hết hạn khi
+                      batch của nó được gom sẽ bị bỏ, không chạy qua model
+
+        Returns:
+            Future trả về vector embedding (hoặc ném DeadlineExceeded, ValueError nếu tín hiệu rỗng)
+        """
+        future = Future()
+        if signal.shape[-1] == 0:
+            # Không đưa vào batch để không làm hỏng các yêu cầu khác cùng batch
+            future.set_exception(ValueError("Tín hiệu âm thanh rỗng"))
+            return future
+        self._queue.put((signal, future, deadline))
+        return future
+
+    def embed(self, signal, timeout=None, deadline=None):
+        """
+        Trích xuất embedding cho một tín hiệu (chờ đến khi batch chứa nó chạy xong)
+
+        Args:
+            signal: Tensor 1 chiều (mono, 16kHz)
+            timeout: Thời gian chờ tối đa (giây), None để chờ đến khi xong
+            deadline: Thời điểm hết hạn theo time.monotonic() (None nếu không có hạn)
+
+        Returns:
+            Vector embedding
+        """
+        future = self.submit(signal, deadline)
+        if deadline is not None:
+            remaining = max(0.0, deadline - time.monotonic())
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceeded()
+            raise
+
+    def pending(self):
+        """Số yêu cầu đang chờ trong hàng đợi"""
+        return self._queue.qsize()
+
+    def close(self):
+        """Dừng luồng xử lý sau khi xử lý hết các yêu cầu đang chờ"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        """Lấy yêu cầu đầu tiên rồi gom thêm cho đến khi đủ batch hoặc hết thời gian chờ"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Xử lý nốt batch hiện tại rồi mới dừng
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            # Bỏ qua các yêu cầu đã bị hủy hoặc đã hết hạn trong khi chờ
+            now = time.monotonic()
+            alive = []
+            for signal, future, deadline in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if deadline is not None and now >= deadline:
+                    self.expired += 1
+                    future.set_exception(DeadlineExceeded())
+                    continue
+                alive.append((signal, future))
+            batch = alive
+            if not batch:
+                continue
+
+            try:
+                embeddings = self.embedder.embed_signals([signal for signal, _ in batch], batch_size=self.max_batch_size)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import numpy as np
+import torch
+from scipy.cluster.hierarchy import linkage, fcluster
+from scipy.cluster.vq import kmeans2
+from scipy.optimize import linear_sum_assignment
+from voice_activity import speech_regions
+from metrics import STAGE_SECONDS
+
+# Các phương pháp phân cụm được hỗ trợ
+CLUSTERING_METHODS = ("agglomerative", "spectral")
+
+class SpeakerDiarizer:
+    """
+    Phân đoạn người nói (ai nói khi nào) chạy hoàn toàn trên CPU, không cần mạng
+    Tìm các đoạn có tiếng nói bằng webrtcvad, trích xuất embedding ECAPA của các cửa sổ
+    trượt trong mỗi đoạn theo batch rồi phân cụm các embedding thành người nói
+    """
+
+    def __init__(self, embedder, window=1.5, hop=0.75, clustering="agglomerative", threshold=0.4,
+                 vad_aggressiveness=2, min_silence=0.3, min_speech=0.25, batch_size=64):
+        """
+        Khởi tạo bộ phân đoạn
+
+        Args:
+            embedder: Đối tượng SpeakerEmbedder (model đã tải được dùng lại)
+            window: Độ dài cửa sổ trích xuất embedding (giây)
+            hop: Khoảng cách giữa hai cửa sổ liên tiếp (giây)
+            clustering: "agglomerative" hoặc "spectral"
+            threshold: Độ tương đồng cosine tối thiểu để gộp hai cụm (agglomerative,
+                       khi không biết trước số người nói)
+            vad_aggressiveness: Mức loại bỏ không phải tiếng nói của webrtcvad (0-3)
+            min_silence: Khoảng lặng ngắn hơn (giây) không tách đoạn nói
+            min_speech: Đoạn nói ngắn hơn (giây) bị bỏ
+            batch_size: Số cửa sổ trong một lần gọi encode_batch
+        """
+        if clustering not in CLUSTERING_METHODS:
+            raise ValueError(f"Phương pháp phân cụm không hợp lệ: {clustering}")
+        self.embedder = embedder
+        self.window = window
+        self.hop = hop
+        self.clustering = clustering
+        self.threshold = threshold
+        self.vad_aggressiveness = vad_aggressiveness
+        self.min_silence = min_silence
+        self.min_speech = min_speech
+        self.batch_size = batch_size
+
+    def diarize(self, audio, num_speakers=None, min_speakers=1, max_speakers=10):
+        """
+        Phân đoạn người nói cho một file âm thanh hoặc tín hiệu
+
+        Args:
+            audio: Đường dẫn/file-like object hoặc tensor 1 chiều (mono, 16kHz)
+            num_speakers: Số người nói nếu biết trước
+            min_speakers: Số người nói tối thiểu
+            max_speakers: Số người nói tối đa
+
+        Returns:
+            Dictionary gồm:
+                duration: Độ dài âm thanh (giây)
+                segments: List {start, end, speaker} theo thời gian, nhãn SPEAKER_00, SPEAKER_01, ...
+                windows: Mảng (N, 2) thời điểm bắt đầu/kết thúc của các cửa sổ
+                embeddings: Ma trận (N, D) embedding đã chuẩn hóa của các cửa sổ
+                labels: Mảng N chỉ số người nói (theo thứ tự nhãn) của các cửa sổ
+                timings: Thời gian (giây) của từng bước: decode, vad, embedding, clustering, total
+        """
+        timings = {}
+        started = time.perf_counter()
+
+        if isinstance(audio, torch.Tensor):
+            signal = audio
+        else:
+            signal = self.embedder.load_signal(audio)
+        timings["decode"] = time.perf_counter() - started
+        sample_rate = self.embedder.sample_rate
+        duration = len(signal) / sample_rate
+
+        # Tìm các đoạn có tiếng nói
+        step = time.perf_counter()
+        regions = speech_regions(signal.numpy(), sample_rate, self.vad_aggressiveness,
+                                 min_silence=self.min_silence, min_speech=self.min_speech)
+        timings["vad"] = time.perf_counter() - step
+        STAGE_SECONDS.observe(timings["vad"], stage="vad")
+
+        # Embedding của các cửa sổ trượt (không dùng cache: mỗi cửa sổ chỉ xuất hiện một lần)
+        step = time.perf_counter()
+        windows, owners = self._make_windows(regions)
+        if len(windows):
+            bounds = (windows * sample_rate).astype(int)
+            embeddings = self.embedder.embed_signals([signal[a:b] for a, b in bounds], batch_size=self.batch_size,
+                                                     use_cache=False)
+            embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        else:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+        timings["embedding"] = time.perf_counter() - step
+
+        # Phân cụm các cửa sổ thành người nói
+        step = time.perf_counter()
+        labels = self.cluster(embeddings, num_speakers, min_speakers, max_speakers)
+        timings["clustering"] = time.perf_counter() - step
+        STAGE_SECONDS.observe(timings["clustering"], stage="clustering")
+
+        segments = self._make_segments(regions, windows, owners, labels)
+        timings["total"] = time.perf_counter() - started
+        return {
+            "duration": duration,
+            "segments": segments,
+            "windows": windows,
+            "embeddings": embeddings,
+            "labels": labels,
+            "timings": timings
+        }
+
+    def _make_windows(self, regions):
+        """Các cửa sổ trượt trong từng đoạn nói (đoạn ngắn hơn cửa sổ là một cửa sổ)"""
+        windows = []
+        owners = []
+        for index, (start, end) in enumerate(regions):
+            if end - start <= self.window:
+                starts = [start]
+                length = end - start
+            else:
+                count = int(np.ceil((end - start - self.window) / self.hop)) + 1
+                starts = np.minimum(start + self.hop * np.arange(count), end - self.window)
+                length = self.window
+            for window_start in starts:
+                windows.append((window_start, window_start + length))
+                owners.append(index)
+        return np.array(windows, dtype=np.float64).reshape(-1, 2), np.array(owners, dtype=int)
+
+    def cluster(self, embeddings, num_speakers=None, min_speakers=1, max_speakers=10):
+        """
+        Phân cụm các embedding đã chuẩn hóa
+
+        Args:
+            embeddings: Ma trận (N, D)
+            num_speakers, min_speakers, max_speakers: Như diarize
+
+        Returns:
+            Mảng N chỉ số cụm, đánh số theo thứ tự xuất hiện đầu tiên
+        """
+        count = len(embeddings)
+        if count == 0:
+            return np.zeros(0, dtype=int)
+        if count == 1:
+            return np.zeros(1, dtype=int)
+        max_speakers = max(1, min(max_speakers, count))
+        min_speakers = max(1, min(min_speakers, max_speakers))
+        if num_speakers is not None:
+            num_speakers = max(1, min(num_speakers, count))
+
+        if self.clustering == "spectral":
+            labels = _spectral_clustering(embeddings, num_speakers, min_speakers, max_speakers)
+        else:
+            tree = linkage(embeddings, method="average", metric="cosine")
+            if num_speakers is not None:
+                labels = fcluster(tree, num_speakers, criterion="maxclust")
+            else:
+                labels = fcluster(tree, 1.0 - self.threshold, criterion="distance")
+                found = len(np.unique(labels))
+                if found > max_speakers:
+                    labels = fcluster(tree, max_speakers, criterion="maxclust")
+                elif found < min_speakers:
+                    labels = fcluster(tree, min_speakers, criterion="maxclust")
+
+        # Đánh số lại theo thứ tự xuất hiện
+        _, first = np.unique(labels, return_index=True)
+        order = {labels[i]: rank for rank, i in enumerate(sorted(first))}
+        return np.array([order[label] for label in labels], dtype=int)
+
+    def _make_segments(self, regions, windows, owners, labels):
+        """
+        Ghép nhãn của các cửa sổ thành các đoạn người nói
+        Phần chồng lấn giữa hai cửa sổ liên tiếp được chia tại điểm giữa tâm hai cửa sổ
+        """
+        segments = []
+        centers = windows.mean(axis=1) if len(windows) else np.zeros(0)
+        for index, (region_start, region_end) in enumerate(regions):
+            members = np.flatnonzero(owners == index)
+            for position, i in enumerate(members):
+                start = region_start if position == 0 else (centers[members[position - 1]] + centers[i]) / 2
+                end = region_end if position == len(members) - 1 else (centers[i] + centers[members[position + 1]]) / 2
+                speaker = f"SPEAKER_{labels[i]:02d}"
+                if segments and segments[-1]["speaker"] == speaker and abs(segments[-1]["end"] - start) < 1e-6:
+                    segments[-1]["end"] = end
+                else:
+                    segments.append({"start": float(start), "end": float(end), "speaker": speaker})
+        return segments
+
+def _spectral_clustering(embeddings, num_speakers, min_speakers, max_speakers, pruning=0.2):
+    """
+    Phân cụm phổ trên ma trận tương đồng cosine
+
+    Mỗi hàng của ma trận tương đồng chỉ giữ tỉ lệ pruning các giá trị lớn nhất để bỏ
+    nhiễu; số cụm (nếu không biết trước) được chọn theo khoảng cách lớn nhất giữa các
+    trị riêng liên tiếp của Laplacian chuẩn hóa.
+    """
+    count = len(embeddings)
+    affinity = np.clip(embeddings @ embeddings.T, 0.0, None)
+    keep = max(1, int(np.ceil(pruning * count)))
+    threshold = np.sort(affinity, axis=1)[:, -keep][:, None]
+    affinity = np.where(affinity >= threshold, affinity, 0.0)
+    affinity = (affinity + affinity.T) / 2
+
+    degree = affinity.sum(axis=1)
+    scale = 1.0 / np.sqrt(np.maximum(degree, 1e-12))
+    laplacian = np.eye(count) - scale[:, None] * affinity * scale[None, :]
+    eigenvalues, eigenvectors = np.linalg.eigh(laplacian)
+
+    if num_speakers is None:
+        max_speakers = max(1, min(max_speakers, count))
+        min_speakers = max(1, min(min_speakers, max_speakers))
+        gaps = np.diff(eigenvalues[:max_speakers + 1])[min_speakers - 1:max_speakers]
+        # Không còn khoảng nào để so sánh khi min_speakers bằng số cửa sổ
+        num_speakers = int(np.argmax(gaps)) + min_speakers if len(gaps) else min_speakers
+    if num_speakers == 1:
+        return np.zeros(count, dtype=int)
+
+    features = eigenvectors[:, :num_speakers]
+    features = features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+    _, labels = kmeans2(features, num_speakers, minit="++", seed=0)
+    return labels
+
+def cluster_centroids(embeddings, labels, windows=None):
+    """
+    Embedding đại diện (centroid) cho mỗi cụm người nói
+
+    Args:
+        embeddings: Ma trận (N, D) embedding đã chuẩn hóa của các cửa sổ
+        labels: Mảng N chỉ số cụm (0..K-1)
+        windows: Mảng (N, 2) thời điểm của các cửa sổ; nếu có, cửa sổ ngắn (cuối đoạn nói)
+                 có trọng số nhỏ hơn theo độ dài
+
+    Returns:
+        Ma trận (K, D) các centroid đã chuẩn hóa, hàng k ứng với cụm k
+    """
+    if len(labels) == 0:
+        return np.empty((0, embeddings.shape[1] if embeddings.ndim == 2 else 0), dtype=np.float32)
+    count = int(labels.max()) + 1
+    weights = np.ones(len(labels)) if windows is None else windows[:, 1] - windows[:, 0]
+    centroids = np.zeros((count, embeddings.shape[1]), dtype=np.float64)
+    np.add.at(centroids, labels, embeddings * weights[:, None])
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+def identify_clusters(result, database, threshold=0.6, top_k=5):
+    """
+    Gán tên người nói đã đăng ký cho các cụm của một kết quả diarize
+
+    Mỗi cụm được đại diện bởi một centroid, tất cả centroid được nhận dạng trong một
+    lần tìm kiếm Faiss nên không cần embed lại từng đoạn nói. Cụm có độ tương đồng
+    dưới ngưỡng được đánh dấu là không xác định với nhãn UNKNOWN_XX (cùng số với SPEAKER_XX).
+
+    Args:
+        result: Kết quả của SpeakerDiarizer.diarize
+        database: SpeakerDatabase (một snapshot, không bị thay đổi)
+        threshold: Ngưỡng độ tương đồng tối thiểu để xác định là cùng người nói
+        top_k: Số embeddings gần nhất dùng để tính độ tương đồng trung bình
+
+    Returns:
+        Tuple (clusters, segments):
+            clusters: Dictionary nhãn SPEAKER_XX -> {name, similarity, is_known, closest}
+            segments: List {start, end, speaker, label, is_known} với speaker là tên
+                      người nói nếu nhận dạng được, ngược lại là UNKNOWN_XX; các đoạn
+                      liền nhau cùng người nói được gộp
+    """
+    centroids = cluster_centroids(result["embeddings"], result["labels"], result["windows"])
+    if len(centroids) and database is not None and database.ntotal:
+        matches = database.identify_speakers(centroids, threshold, top_k)
+    else:
+        matches = [(None, 0.0, False)] * len(centroids)
+
+    clusters = {}
+    for index, (name, similarity, is_known) in enumerate(matches):
+        clusters[f"SPEAKER_{index:02d}"] = {
+            "name": name if is_known else None,
+            "similarity": similarity,
+            "is_known": is_known,
+            "closest": name
+        }
+
+    # Hai cụm có thể cùng được gán một người nói, khi đó các đoạn liền nhau được gộp
+    segments = []
+    for segment in result["segments"]:
+        cluster = clusters[segment["speaker"]]
+        speaker = cluster["name"] if cluster["is_known"] else segment["speaker"].replace("SPEAKER_", "UNKNOWN_")
+        if segments and segments[-1]["speaker"] == speaker and abs(segments[-1]["end"] - segment["start"]) < 1e-6:
+            segments[-1]["end"] = segment["end"]
+        else:
+            segments.append({"start": segment["start"], "end": segment["end"], "speaker": speaker,
+                             "label": segment["speaker"], "is_known": cluster["is_known"]})
+    return clusters, segments
+
+def meeting_statistics(segments, duration):
+    """
+    Thống kê thời gian nói của cuộc họp (chỉ dựa trên các đoạn, không cần embedding)
+
+    Args:
+        segments: List {start, end, speaker}
+        duration: Độ dài bản ghi (giây)
+
+    Returns:
+        Dictionary gồm duration, speech (tổng thời gian có tiếng nói), speakers:
+        speaker -> {seconds, share (tỉ lệ trên tổng thời gian nói), turns (số lượt nói),
+        longest_turn, mean_turn}
+    """
+    # Một lượt nói gồm các đoạn liên tiếp của cùng một người nói
+    turns = []
+    for segment in segments:
+        length = segment["end"] - segment["start"]
+        if turns and turns[-1][0] == segment["speaker"]:
+            turns[-1][1] += length
+        else:
+            turns.append([segment["speaker"], length])
+
+    speakers = {}
+    for speaker, length in turns:
+        stats = speakers.setdefault(speaker, {"seconds": 0.0, "turns": 0, "longest_turn": 0.0})
+        stats["seconds"] += length
+        stats["turns"] += 1
+        stats["longest_turn"] = max(stats["longest_turn"], length)
+
+    speech = sum(stats["seconds"] for stats in speakers.values())
+    for stats in speakers.values():
+        stats["share"] = stats["seconds"] / speech if speech else 0.0
+        stats["mean_turn"] = stats["seconds"] / stats["turns"]
+    return {
+        "duration": duration,
+        "speech": speech,
+        "speakers": dict(sorted(speakers.items(), key=lambda item: -item[1]["seconds"]))
+    }
+
+def speaking_time(segments):
+    """
+    Tổng thời gian nói của từng người nói
+
+    Args:
+        segments: List {start, end, speaker}
+
+    Returns:
+        Dictionary speaker -> số giây, sắp xếp giảm dần
+    """
+    totals = {}
+    for segment in segments:
+        totals[segment["speaker"]] = totals.get(segment["speaker"], 0.0) + segment["end"] - segment["start"]
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+def _speaker_frames(segments, speakers, count, resolution):
+    """Ma trận bool (số frame, số người nói): người nói nào đang nói trong từng frame"""
+    frames = np.zeros((count, len(speakers)), dtype=bool)
+    for segment in segments:
+        start = int(round(segment["start"] / resolution))
+        end = int(round(segment["end"] / resolution))
+        frames[start:end, speakers.index(segment["speaker"])] = True
+    return frames
+
+def diarization_error_rate(reference, hypothesis, collar=0.0, resolution=0.01):
+    """
+    Tỉ lệ lỗi phân đoạn người nói (DER) và các thành phần của nó
+
+    Thời gian được chia thành các frame độ dài resolution. Nhãn của hệ thống được ánh xạ
+    một-một với nhãn chuẩn sao cho tổng thời gian trùng khớp lớn nhất (thuật toán Hungary).
+    Trong mỗi frame với R người nói chuẩn, H người nói của hệ thống và C cặp khớp nhau:
+    missed = max(0, R - H), false alarm = max(0, H - R), confusion = min(R, H) - C.
+    DER = (missed + false alarm + confusion) / tổng thời gian nói chuẩn (tính cả chồng lấn).
+
+    Args:
+        reference: List {start, end, speaker} chuẩn (ví dụ từ read_rttm)
+        hypothesis: List {start, end, speaker} của hệ thống
+        collar: Bỏ qua khoảng (giây) trước và sau mỗi ranh giới của đoạn chuẩn
+        resolution: Độ dài frame (giây)
+
+    Returns:
+        Dictionary gồm reference (giây nói chuẩn), missed, false_alarm, confusion (giây),
+        der và mapping (nhãn hệ thống -> nhãn chuẩn)
+    """
+    end = max([segment["end"] for segment in list(reference) + list(hypothesis)], default=0.0)
+    count = int(np.ceil(end / resolution)) + 1
+    reference_speakers = sorted({segment["speaker"] for segment in reference})
+    hypothesis_speakers = sorted({segment["speaker"] for segment in hypothesis})
+    ref = _speaker_frames(reference, reference_speakers, count, resolution)
+    hyp = _speaker_frames(hypothesis, hypothesis_speakers, count, resolution)
+
+    # Bỏ các frame quanh ranh giới của đoạn chuẩn
+    if collar > 0:
+        keep = np.ones(count, dtype=bool)
+        width = int(round(collar / resolution))
+        for segment in reference:
+            for boundary in (segment["start"], segment["end"]):
+                frame = int(round(boundary / resolution))
+                keep[max(0, frame - width):frame + width] = False
+        ref, hyp = ref[keep], hyp[keep]
+
+    # Ánh xạ nhãn tối ưu theo thời gian trùng khớp
+    overlap = ref.T.astype(np.int64) @ hyp.astype(np.int64)
+    rows, columns = linear_sum_assignment(-overlap) if overlap.size else ([], [])
+    correct = np.zeros(len(ref), dtype=np.int64)
+    for row, column in zip(rows, columns):
+        correct += ref[:, row] & hyp[:, column]
+
+    ref_count = ref.sum(axis=1)
+    hyp_count = hyp.sum(axis=1)
+    total = ref_count.sum() * resolution
+    missed = np.maximum(ref_count - hyp_count, 0).sum() * resolution
+    false_alarm = np.maximum(hyp_count - ref_count, 0).sum() * resolution
+    confusion = (np.minimum(ref_count, hyp_count) - correct).sum() * resolution
+    return {
+        "reference": float(total),
+        "missed": float(missed),
+        "false_alarm": float(false_alarm),
+        "confusion": float(confusion),
+        "der": float((missed + false_alarm + confusion) / total) if total else 0.0,
+        "mapping": {hypothesis_speakers[column]: reference_speakers[row] for row, column in zip(rows, columns)
+                    if overlap[row, column] > 0}
+    }
+
+def write_rttm(segments, file, uri):
+    """
+    Ghi kết quả phân đoạn theo định dạng RTTM
+
+    Args:
+        segments: List {start, end, speaker}
+        file: File đã mở để ghi (text)
+        uri: Tên bản ghi (thường là tên file không có phần mở rộng)
+    """
+    for segment in segments:
+        # Trường tên người nói trong RTTM không được chứa khoảng trắng
+        speaker = "_".join(str(segment["speaker"]).split())
+        file.write(f"SPEAKER {uri} 1 {segment['start']:.3f} {segment['end'] - segment['start']:.3f} "
+                   f"<NA> <NA> {speaker} <NA> <NA>\n")
+
+def read_rttm(path):
+    """
+    Đọc file RTTM
+
+    Args:
+        path: Đường dẫn đến file RTTM
+
+    Returns:
+        Dictionary uri -> list {start, end, speaker} sắp xếp theo thời gian
+    """
+    recordings = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 8 or fields[0] != "SPEAKER":
+                continue
+            start, duration = float(fields[3]), float(fields[4])
+            recordings.setdefault(fields[1], []).append({"start": start, "end": start + duration, "speaker": fields[7]})
+    for segments in recordings.values():
+        segments.sort(key=lambda segment: segment["start"])
+    return recordings
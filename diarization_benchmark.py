@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import glob
+import platform
+import argparse
+import itertools
+from datetime import datetime
+from pathlib import Path
+from diarization import SpeakerDiarizer, CLUSTERING_METHODS, read_rttm, diarization_error_rate
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".m4a", ".ogg")
+
+def peak_rss_mb():
+    """Bộ nhớ thường trú cao nhất của tiến trình từ lần đặt lại gần nhất (MB), None nếu không đo được"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def reset_peak_rss():
+    """
+    Đặt lại mốc bộ nhớ thường trú cao nhất của tiến trình (Linux, /proc/self/clear_refs)
+
+    Returns:
+        True nếu đặt lại được; nếu không, peak_rss_mb là mốc cao nhất từ lúc tiến trình
+        bắt đầu (gồm cả model và các file/cấu hình đã chạy trước)
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def format_rtf(rtf):
+    """RTF để in ra (n/a khi không tính được vì thời lượng bằng 0)"""
+    return "n/a" if rtf is None else f"{rtf:.3f}"
+
+def find_pairs(inputs, rttm_dir=None):
+    """
+    Ghép các file âm thanh với file RTTM chuẩn cùng tên
+
+    Args:
+        inputs: Danh sách file âm thanh hoặc thư mục chứa file âm thanh
+        rttm_dir: Thư mục chứa file RTTM (None để tìm cạnh file âm thanh)
+
+    Returns:
+        List các tuple (file âm thanh, file RTTM) theo thứ tự tên file
+    """
+    audio_files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            audio_files.extend(file for file in sorted(glob.glob(os.path.join(path, "*")))
+                               if file.lower().endswith(AUDIO_EXTENSIONS))
+        else:
+            audio_files.append(path)
+
+    pairs = []
+    for audio_file in audio_files:
+        stem = Path(audio_file).stem
+        rttm = os.path.join(rttm_dir or os.path.dirname(audio_file), f"{stem}.rttm")
+        if os.path.exists(rttm):
+            pairs.append((audio_file, rttm))
+        else:
+            print(f"Bỏ qua {audio_file}: không có file RTTM chuẩn {rttm}")
+    return pairs
+
+def make_configs(args):
+    """Tất cả tổ hợp cấu hình cần đo (mỗi tùy chọn có thể nhận nhiều giá trị)"""
+    if args.backend == "pyannote":
+        return [{}]
+    keys = ("clustering", "threshold", "window", "hop")
+    return [dict(zip(keys, values)) for values in itertools.product(*(getattr(args, key) for key in keys))]
+
+def run_file(audio_file, rttm_file, diarize, collar):
+    """Chạy một file và so sánh với RTTM chuẩn"""
+    per_file = reset_peak_rss()
+    started = time.perf_counter()
+    result = diarize(audio_file)
+    wall = time.perf_counter() - started
+
+    references = read_rttm(rttm_file)
+    reference = references.get(Path(audio_file).stem)
+    if reference is None:
+        # File RTTM chỉ chứa một bản ghi với tên khác
+        reference = [segment for segments in references.values() for segment in segments]
+    errors = diarization_error_rate(reference, result["segments"], collar=collar)
+
+    return {
+        "file": audio_file,
+        "reference_rttm": rttm_file,
+        "duration": result["duration"],
+        "wall_seconds": wall,
+        "rtf": wall / result["duration"] if result["duration"] else None,
+        "timings": result.get("timings", {}),
+        "speakers": len({segment["speaker"] for segment in result["segments"]}),
+        "reference_speakers": len({segment["speaker"] for segment in reference}),
+        "peak_rss_mb": peak_rss_mb(),
+        # "file": mốc cao nhất trong lúc chạy file này; "process": từ lúc tiến trình bắt đầu
+        "peak_rss_scope": "file" if per_file else "process",
+        **errors
+    }
+
+def summarize(files):
+    """Tổng hợp các file của một cấu hình (DER tính trên tổng thời gian, không lấy trung bình)"""
+    duration = sum(item["duration"] for item in files)
+    wall = sum(item["wall_seconds"] for item in files)
+    reference = sum(item["reference"] for item in files)
+    errors = {key: sum(item[key] for item in files) for key in ("missed", "false_alarm", "confusion")}
+    timings = {}
+    for item in files:
+        for stage, seconds in item["timings"].items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+    # Mốc bộ nhớ cao nhất của cấu hình là mốc lớn nhất của các file khi đo được theo từng file
+    per_config = all(item["peak_rss_scope"] == "file" for item in files)
+    return {
+        "files": len(files),
+        "duration": duration,
+        "wall_seconds": wall,
+        "rtf": wall / duration if duration else None,
+        "reference": reference,
+        **errors,
+        "der": sum(errors.values()) / reference if reference else 0.0,
+        "timings": timings,
+        "peak_rss_mb": max(item["peak_rss_mb"] or 0 for item in files) if per_config else peak_rss_mb(),
+        "peak_rss_scope": "config" if per_config else "process"
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo độ chính xác (DER) và tốc độ của phân đoạn người nói")
+    parser.add_argument("inputs", nargs="*", default=["meeting_voice"],
+                        help="File âm thanh hoặc thư mục (mặc định meeting_voice); mỗi file cần RTTM chuẩn cùng tên")
+    parser.add_argument("--rttm_dir", help="Thư mục chứa RTTM chuẩn (mặc định cạnh file âm thanh)")
+    parser.add_argument("--backend", default="native", choices=["native", "pyannote"], help="Backend phân đoạn")
+    parser.add_argument("--clustering", nargs="+", default=["agglomerative"], choices=CLUSTERING_METHODS,
+                        help="Phương pháp phân cụm (có thể truyền nhiều giá trị để so sánh)")
+    parser.add_argument("--threshold", nargs="+", type=float, default=[0.4], help="Ngưỡng gộp cụm")
+    parser.add_argument("--window", nargs="+", type=float, default=[1.5], help="Độ dài cửa sổ embedding (giây)")
+    parser.add_argument("--hop", nargs="+", type=float, default=[0.75], help="Bước trượt cửa sổ (giây)")
+    parser.add_argument("--oracle_speakers", action="store_true",
+                        help="Truyền số người nói của RTTM chuẩn cho backend (đo riêng chất lượng phân cụm)")
+    parser.add_argument("--collar", type=float, default=0.0, help="Bỏ qua khoảng (giây) quanh ranh giới đoạn chuẩn")
+    parser.add_argument("--output", help="File JSON kết quả (mặc định benchmark_results/diarization_<thời gian>.json)")
+    args = parser.parse_args()
+
+    pairs = find_pairs(args.inputs, args.rttm_dir)
+    if not pairs:
+        print("Không có cặp âm thanh/RTTM nào để đo")
+        return
+
+    # Tải model một lần cho tất cả cấu hình
+    started = time.perf_counter()
+    if args.backend == "pyannote":
+        from diarization_speaker import load_pyannote_pipeline, diarize_with_pyannote
+        pipeline = load_pyannote_pipeline()
+    else:
+        from speaker_embedder import SpeakerEmbedder
+        embedder = SpeakerEmbedder()
+    load_seconds = time.perf_counter() - started
+    print(f"Tải model: {load_seconds:.2f}s, {len(pairs)} file")
+
+    runs = []
+    for config in make_configs(args):
+        files = []
+        for audio_file, rttm_file in pairs:
+            num_speakers = None
+            if args.oracle_speakers:
+                num_speakers = len({segment["speaker"] for segments in read_rttm(rttm_file).values()
+                                    for segment in segments})
+            if args.backend == "pyannote":
+                def diarize(path):
+                    import soundfile as sf
+                    segments = diarize_with_pyannote(path, num_speakers, pipeline=pipeline)
+                    return {"segments": segments, "duration": sf.info(path).duration}
+            else:
+                diarizer = SpeakerDiarizer(embedder, **config)
+                def diarize(path):
+                    return diarizer.diarize(path, num_speakers=num_speakers)
+            item = run_file(audio_file, rttm_file, diarize, args.collar)
+            files.append(item)
+            print(f"  {audio_file}: DER {item['der']:.2%} (missed {item['missed']:.2f}s, "
+                  f"false alarm {item['false_alarm']:.2f}s, confusion {item['confusion']:.2f}s), "
+                  f"{item['wall_seconds']:.2f}s, RTF {format_rtf(item['rtf'])}")
+
+        summary = summarize(files)
+        runs.append({"config": config, "summary": summary, "files": files})
+        label = ", ".join(f"{key}={value}" for key, value in config.items()) or args.backend
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in summary["timings"].items())
+        cumulative = " (cả tiến trình)" if summary["peak_rss_scope"] == "process" else ""
+        print(f"[{label}] DER {summary['der']:.2%}, RTF {format_rtf(summary['rtf'])}, "
+              f"peak RSS {summary['peak_rss_mb'] or 0:.0f} MB{cumulative}; {stages}")
+
+    output = args.output or os.path.join(
+        "benchmark_results", f"diarization_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "backend": args.backend,
+            "collar": args.collar,
+            "oracle_speakers": args.oracle_speakers,
+            "model_load_seconds": load_seconds,
+            "host": {"platform": platform.platform(), "python": platform.python_version(),
+                     "cpu_count": os.cpu_count()},
+            "runs": runs
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Đã lưu {output}")
+
+if __name__ == "__main__":
+    main()
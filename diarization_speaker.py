@@ -1,15 +1,189 @@
-from pyannote.audio import Pipeline
-from dotenv import load_dotenv
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
 import os
-load_dotenv()
-token = os.getenv("hugging_face")
-pipeline = Pipeline.from_pretrained(
-  "pyannote/speaker-diarization-3.1",
-  use_auth_token=token)
-
-# run the pipeline on an audio file
-diarization = pipeline("meeting_voice/voice_meeting_v1.wav")
-
-# dump the diarization output to disk using RTTM format
-with open("meeting_voice/voice_meeting_v1.rttm", "w") as rttm:
-    diarization.write_rttm(rttm)
\ No newline at end of file
+import json
+import time
+import argparse
+from pathlib import Path
+from diarization import SpeakerDiarizer, CLUSTERING_METHODS, speaking_time, write_rttm
+
+def load_pyannote_pipeline():
+    """Tải pyannote/speaker-diarization-3.1 (cần token Hugging Face và mạng)"""
+    from pyannote.audio import Pipeline
+    from dotenv import load_dotenv
+    load_dotenv()
+    return Pipeline.from_pretrained("pyannote/speaker-diarization-3.1", use_auth_token=os.getenv("hugging_face"))
+
+def diarize_with_pyannote(audio_file, num_speakers=None, min_speakers=None, max_speakers=None, pipeline=None):
+    """
+    Phân đoạn bằng pyannote/speaker-diarization-3.1
+
+    Args:
+        pipeline: Pipeline đã tải (None để tải mới)
+
+    Returns:
+        List {start, end, speaker}
+    """
+    if pipeline is None:
+        pipeline = load_pyannote_pipeline()
+    options = {key: value for key, value in (("num_speakers", num_speakers), ("min_speakers", min_speakers),
+                                             ("max_speakers", max_speakers)) if value is not None}
+    diarization = pipeline(audio_file, **options)
+    return [{"start": turn.start, "end": turn.end, "speaker": speaker}
+            for turn, _, speaker in diarization.itertracks(yield_label=True)]
+
+def save_results(segments, audio_file, output_dir, formats, details=None):
+    """
+    Ghi kết quả theo các định dạng json, rttm, txt vào output_dir
+    details: Các trường thêm vào file JSON (ví dụ clusters, statistics khi nhận dạng tên)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    uri = Path(audio_file).stem
+    paths = []
+    if "rttm" in formats:
+        path = os.path.join(output_dir, f"{uri}.rttm")
+        with open(path, "w", encoding="utf-8") as f:
+            write_rttm(segments, f, uri)
+        paths.append(path)
+    if "json" in formats:
+        path = os.path.join(output_dir, f"{uri}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            data = {"file": str(audio_file), "segments": segments, "speaking_time": speaking_time(segments)}
+            data.update(details or {})
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        paths.append(path)
+    if "txt" in formats:
+        path = os.path.join(output_dir, f"{uri}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            for segment in segments:
+                f.write(f"{segment['start']:.2f}\t{segment['end']:.2f}\t{segment['speaker']}\n")
+        paths.append(path)
+    return paths
+
+def visualize(segments, audio_file, output_dir):
+    """Vẽ biểu đồ thời gian nói của từng người nói"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    speakers = sorted({segment["speaker"] for segment in segments})
+    fig, ax = plt.subplots(figsize=(12, 1 + 0.5 * len(speakers)))
+    for row, speaker in enumerate(speakers):
+        spans = [(s["start"], s["end"] - s["start"]) for s in segments if s["speaker"] == speaker]
+        ax.broken_barh(spans, (row - 0.4, 0.8))
+    ax.set_yticks(range(len(speakers)))
+    ax.set_yticklabels(speakers)
+    ax.set_xlabel("Thời gian (giây)")
+    path = os.path.join(output_dir, f"{Path(audio_file).stem}.png")
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+def extract_speakers(segments, audio_file, output_dir):
+    """Ghép các đoạn nói của từng người nói thành một file WAV riêng (giữ tần số lấy mẫu gốc)"""
+    import numpy as np
+    import soundfile as sf
+
+    paths = []
+    samples, sample_rate = sf.read(audio_file, dtype="float32", always_2d=True)
+    samples = samples.mean(axis=1)
+    for speaker in sorted({segment["speaker"] for segment in segments}):
+        parts = [samples[int(s["start"] * sample_rate):int(s["end"] * sample_rate)]
+                 for s in segments if s["speaker"] == speaker]
+        path = os.path.join(output_dir, f"{Path(audio_file).stem}_{speaker}.wav")
+        sf.write(path, np.concatenate(parts), sample_rate)
+        paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Phân đoạn người nói (ai nói khi nào) trong file âm thanh")
+    parser.add_argument("audio_file", help="Đường dẫn đến file âm thanh")
+    parser.add_argument("--num_speakers", type=int, help="Số lượng người nói cố định (nếu biết trước)")
+    parser.add_argument("--min_speakers", type=int, help="Số người nói tối thiểu")
+    parser.add_argument("--max_speakers", type=int, help="Số người nói tối đa")
+    parser.add_argument("--backend", default="native", choices=["native", "pyannote"],
+                        help="native: VAD + ECAPA + phân cụm, chạy offline trên CPU; pyannote: cần token Hugging Face")
+    parser.add_argument("--clustering", default="agglomerative", choices=CLUSTERING_METHODS, help="Phương pháp phân cụm")
+    parser.add_argument("--threshold", type=float, default=0.4,
+                        help="Độ tương đồng tối thiểu để gộp hai cụm (agglomerative)")
+    parser.add_argument("--window", type=float, default=1.5, help="Độ dài cửa sổ embedding (giây)")
+    parser.add_argument("--hop", type=float, default=0.75, help="Bước trượt cửa sổ (giây)")
+    parser.add_argument("--identify", action="store_true",
+                        help="Gán tên người nói đã đăng ký trong cơ sở dữ liệu cho từng cụm (chỉ backend native)")
+    parser.add_argument("--db_dir", default="speaker_db", help="Thư mục cơ sở dữ liệu người nói (với --identify)")
+    parser.add_argument("--identify_threshold", type=float, default=0.6,
+                        help="Ngưỡng độ tương đồng tối thiểu để xác định tên người nói (với --identify)")
+    parser.add_argument("--visualize", action="store_true", help="Tạo biểu đồ trực quan kết quả phân đoạn")
+    parser.add_argument("--extract", action="store_true", help="Tạo các file âm thanh riêng biệt cho từng người nói")
+    parser.add_argument("--output_dir", default="diarization_output", help="Thư mục đầu ra cho kết quả")
+    parser.add_argument("--format", default="all", choices=["json", "rttm", "txt", "all"],
+                        help="Định dạng file kết quả")
+    args = parser.parse_args()
+
+    formats = ("json", "rttm", "txt") if args.format == "all" else (args.format,)
+    if args.identify and args.backend != "native":
+        parser.error("--identify chỉ hỗ trợ backend native")
+    details = None
+    started = time.perf_counter()
+
+    if args.backend == "pyannote":
+        segments = diarize_with_pyannote(args.audio_file, args.num_speakers, args.min_speakers, args.max_speakers)
+        import soundfile as sf
+        duration = sf.info(args.audio_file).duration
+        elapsed = time.perf_counter() - started
+    else:
+        from speaker_embedder import SpeakerEmbedder
+        if args.identify:
+            from speaker_recognition_app import SpeakerRecognitionApp
+            app = SpeakerRecognitionApp(database_dir=args.db_dir, threshold=args.identify_threshold)
+            app.initialize()
+            embedder = app.embedder
+        else:
+            embedder = SpeakerEmbedder()
+        load_seconds = time.perf_counter() - started
+        diarizer = SpeakerDiarizer(embedder, window=args.window, hop=args.hop, clustering=args.clustering,
+                                   threshold=args.threshold)
+        options = dict(num_speakers=args.num_speakers, min_speakers=args.min_speakers or 1,
+                       max_speakers=args.max_speakers or 10)
+        if args.identify:
+            result = app.diarize_and_identify(args.audio_file, diarizer, **options)
+            details = {"clusters": result["clusters"], "statistics": result["statistics"]}
+        else:
+            result = diarizer.diarize(args.audio_file, **options)
+        segments, duration = result["segments"], result["duration"]
+        elapsed = result["timings"]["total"]  # Không tính thời gian tải model
+        timings = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result["timings"].items())
+        print(f"Tải model: {load_seconds:.2f}s; {timings}")
+
+    for segment in segments:
+        print(f"[{segment['start']:8.2f} - {segment['end']:8.2f}] {segment['speaker']}")
+    if details:
+        print("Người nói của từng cụm:")
+        for label, cluster in details["clusters"].items():
+            if cluster["is_known"]:
+                print(f"  {label}: {cluster['name']} (độ tương đồng: {cluster['similarity']:.4f})")
+            else:
+                closest = f", gần nhất: {cluster['closest']} ({cluster['similarity']:.4f})" if cluster["closest"] else ""
+                print(f"  {label}: không xác định{closest}")
+        print("Thống kê thời gian nói:")
+        for speaker, stats in details["statistics"]["speakers"].items():
+            print(f"  {speaker}: {stats['seconds']:.1f} giây ({stats['share']:.0%}), {stats['turns']} lượt, "
+                  f"lượt dài nhất {stats['longest_turn']:.1f} giây")
+    else:
+        print("Thời gian nói:")
+        for speaker, seconds in speaking_time(segments).items():
+            print(f"  {speaker}: {seconds:.1f} giây")
+    print(f"Thời lượng âm thanh {duration:.1f}s, thời gian xử lý {elapsed:.2f}s, RTF {elapsed / max(duration, 1e-9):.3f}")
+
+    for path in save_results(segments, args.audio_file, args.output_dir, formats, details):
+        print(f"Đã lưu {path}")
+    if args.visualize:
+        print(f"Đã lưu {visualize(segments, args.audio_file, args.output_dir)}")
+    if args.extract:
+        for path in extract_speakers(segments, args.audio_file, args.output_dir):
+            print(f"Đã lưu {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+
+class EmbeddingCache:
+    """
+    Cache embeddings theo nội dung âm thanh đã giải mã
+    Gồm hai tầng: LRU trong bộ nhớ và các file .npy trên đĩa
+    Khóa là hash của tín hiệu (sau khi chuyển mono/resample) cộng với model id
+    Embeddings trả về là mảng chỉ đọc dùng chung với cache
+    """
+
+    # Khi tầng đĩa vượt max_disk_items, các file ít dùng nhất bị xóa cho đến còn tỉ lệ này
+    DISK_PRUNE_RATIO = 0.9
+
+    def __init__(self, cache_dir="embedding_cache", model_id="", max_items=4096, max_disk_items=100000):
+        """
+        Khởi tạo cache
+
+        Args:
+            cache_dir: Thư mục lưu tầng cache trên đĩa (None để tắt tầng đĩa)
+            model_id: Định danh model, embeddings của model khác sẽ không bị dùng lại
+            max_items: Số embeddings tối đa giữ trong bộ nhớ
+            max_disk_items: Số file embeddings tối đa trên đĩa (xóa theo thời gian dùng gần nhất)
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.model_id = model_id
+        self.max_items = max_items
+        self.max_disk_items = max_disk_items
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_count = None  # Số file trên đĩa (ước lượng, đếm lại khi dọn)
+
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def make_key(self, signal, sample_rate):
+        """
+        Tạo khóa cache từ tín hiệu âm thanh
+
+        Args:
+            signal: Tensor hoặc numpy array chứa tín hiệu
+            sample_rate: Tần số lấy mẫu của tín hiệu
+
+        Returns:
+            Chuỗi hex định danh nội dung
+        """
+        if hasattr(signal, "detach"):
+            signal = signal.detach().cpu().numpy()
+        data = np.ascontiguousarray(signal, dtype=np.float32)
+
+        hasher = hashlib.blake2b(digest_size=20)
+        hasher.update(self.model_id.encode("utf-8"))
+        hasher.update(str(sample_rate).encode("utf-8"))
+        hasher.update(data.tobytes())
+        return hasher.hexdigest()
+
+    def _disk_path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.npy"
+
+    def get(self, key):
+        """
+        Lấy embedding theo khóa
+
+        Args:
+            key: Khóa cache
+
+        Returns:
+            Vector embedding (chỉ đọc) hoặc None nếu không có trong cache
+        """
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return embedding
+
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            if path.exists():
+                try:
+                    embedding = np.load(path)
+                except Exception as e:
+                    print(f"Lỗi khi đọc cache {path}: {e}")
+                    embedding = None
+                if embedding is not None:
+                    # Cập nhật thời gian dùng gần nhất cho việc dọn tầng đĩa
+                    try:
+                        os.utime(path)
+                    except OSError:
+                        pass
+                    embedding.setflags(write=False)
+                    with self._lock:
+                        self._remember(key, embedding)
+                        self.hits += 1
+                    return embedding
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, embedding):
+        """
+        Lưu embedding vào cache
+
+        Args:
+            key: Khóa cache
+            embedding: Vector embedding
+        """
+        # Sao chép để cache không dùng chung bộ nhớ với mảng của người gọi
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        with self._lock:
+            self._remember(key, embedding)
+
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            if path.exists():
+                return
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Ghi file tạm rồi đổi tên để tránh file hỏng khi nhiều tiến trình cùng ghi
+            tmp_path = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, embedding)
+            os.replace(tmp_path, path)
+
+            with self._lock:
+                if self._disk_count is None:
+                    self._disk_count = sum(1 for _ in self._disk_files())
+                else:
+                    self._disk_count += 1
+                prune = self._disk_count > self.max_disk_items
+                if prune:
+                    # Đánh dấu để các luồng khác không dọn cùng lúc
+                    self._disk_count = 0
+            if prune:
+                self._prune_disk()
+
+    def _disk_files(self):
+        """Liệt kê các file embeddings trên đĩa (os.DirEntry)"""
+        for subdir in os.scandir(self.cache_dir):
+            if subdir.is_dir():
+                for entry in os.scandir(subdir.path):
+                    if entry.name.endswith(".npy"):
+                        yield entry
+
+    def _prune_disk(self):
+        """
+        Xóa các file ít dùng nhất (theo mtime) cho đến khi còn DISK_PRUNE_RATIO * max_disk_items
+        Các tiến trình khác có thể đang dọn cùng thư mục nên file đã mất được bỏ qua
+        """
+        files = []
+        for entry in self._disk_files():
+            try:
+                files.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+        keep = int(self.max_disk_items * self.DISK_PRUNE_RATIO)
+        files.sort()
+        removed = 0
+        for _, path in files[:max(0, len(files) - keep)]:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._disk_count += len(files) - removed
+
+    def _remember(self, key, embedding):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        """Xóa toàn bộ cache trong bộ nhớ (tầng đĩa được giữ nguyên)"""
+        with self._lock:
+            self._memory.clear()
+
+    def __len__(self):
+        return len(self._memory)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+from pathlib import Path
+
+class EnrollmentManifest:
+    """
+    Manifest các file âm thanh đã được đưa vào cơ sở dữ liệu
+    Lưu đường dẫn, kích thước, mtime và hash nội dung của từng file
+    để lệnh prepare chỉ embed lại những file mới hoặc đã thay đổi
+    """
+
+    FILENAME = "manifest.json"
+
+    def __init__(self, path):
+        """
+        Khởi tạo manifest
+
+        Args:
+            path: Đường dẫn đến file manifest
+        """
+        self.path = Path(path)
+        self.audio_dir = None
+        self.files = {}  # Đường dẫn tương đối -> {speaker, size, mtime, sha1}
+
+    @classmethod
+    def load(cls, database_dir):
+        """
+        Tải manifest từ thư mục cơ sở dữ liệu
+
+        Args:
+            database_dir: Thư mục cơ sở dữ liệu
+
+        Returns:
+            Đối tượng EnrollmentManifest (rỗng nếu chưa có file)
+        """
+        manifest = cls(os.path.join(database_dir, cls.FILENAME))
+        if manifest.path.exists():
+            with open(manifest.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            manifest.audio_dir = data.get("audio_dir")
+            manifest.files = data.get("files", {})
+        return manifest
+
+    def save(self):
+        """Lưu manifest (ghi file tạm rồi đổi tên)"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"audio_dir": self.audio_dir, "files": self.files}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def hash_file(path, chunk_size=1 << 20):
+        """
+        Tính hash SHA-1 nội dung file
+
+        Args:
+            path: Đường dẫn đến file
+            chunk_size: Kích thước mỗi lần đọc
+
+        Returns:
+            Chuỗi hex
+        """
+        hasher = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def scan(self, audio_dir, known_sources=None):
+        """
+        So sánh thư mục âm thanh với manifest
+
+        Args:
+            audio_dir: Thư mục chứa các thư mục người nói
+            known_sources: Tập các nguồn đang có trong cơ sở dữ liệu; file có trong
+                           manifest nhưng không có trong cơ sở dữ liệu được coi là mới
+
+        Returns:
+            Tuple (changed, deleted, current)
+            - changed: list (đường dẫn tương đối, entry) của file mới hoặc đã thay đổi
+            - deleted: list đường dẫn tương đối của file đã bị xóa
+            - current: dictionary entry của tất cả file hiện có
+        """
+        audio_path = Path(audio_dir)
+        changed = []
+        current = {}
+
+        speaker_dirs = sorted(d for d in audio_path.iterdir() if d.is_dir()) if audio_path.exists() else []
+        for speaker_dir in speaker_dirs:
+            for audio_file in sorted(speaker_dir.glob("*.wav")):
+                rel_path = audio_file.relative_to(audio_path).as_posix()
+                stat = audio_file.stat()
+                old = self.files.get(rel_path)
+                entry = {
+                    "speaker": speaker_dir.name,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                }
+
+                # Kích thước và mtime không đổi thì không cần đọc lại file
+                if old and old["size"] == entry["size"] and old["mtime"] == entry["mtime"]:
+                    entry["sha1"] = old["sha1"]
+                else:
+                    entry["sha1"] = self.hash_file(audio_file)
+
+                current[rel_path] = entry
+                is_known = known_sources is None or rel_path in known_sources
+                if not old or old["sha1"] != entry["sha1"] or old["speaker"] != entry["speaker"] or not is_known:
+                    changed.append((rel_path, entry))
+
+        deleted = [rel_path for rel_path in self.files if rel_path not in current]
+        return changed, deleted, current
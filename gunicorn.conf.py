@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Cấu hình chạy API với nhiều tiến trình worker (pre-fork):
+#   gunicorn -c gunicorn.conf.py api:app
+#
+# Model được tải một lần trong tiến trình chính (preload_app) rồi các worker được
+# fork ra dùng chung bộ nhớ model theo copy-on-write. Các worker đồng bộ cơ sở
+# dữ liệu qua thư mục speaker_db: ghi tuần tự nhờ khóa thư mục, worker khác tải
+# lại database khi phát hiện thay đổi (xem api.watch_database). Các luồng nền chỉ
+# được tạo trong worker (post_fork), tiến trình chính không chạy chúng.
+
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WORKERS", 2))
+# Mỗi worker xử lý request trên nhiều luồng (cần cho WebSocket và bộ gom batch)
+worker_class = "gthread"
+threads = int(os.environ.get("THREADS", 16))
+preload_app = True
+timeout = 120
+
+def post_fork(server, worker):
+    # Chia đều các nhân CPU cho các worker để PyTorch không tranh luồng; số worker lấy
+    # từ cấu hình đang chạy để tính cả -w/--workers và GUNICORN_CMD_ARGS
+    import torch
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // server.cfg.workers))
+
+    # Tiến trình con sau fork chỉ có luồng đã gọi fork: tạo bộ gom batch, các nhóm luồng
+    # và luồng theo dõi cơ sở dữ liệu riêng cho worker này
+    import api
+    api.start_worker_services()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Các chỉ số vận hành (counter, gauge, histogram) xuất ra theo định dạng văn bản của Prometheus
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# Tất cả các chỉ số đã đăng ký, theo thứ tự xuất ra
+REGISTRY = []
+
+# Các mốc (giây) mặc định của histogram độ trễ
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+class _Metric:
+    """Lớp cơ sở: giá trị được lưu theo bộ giá trị nhãn"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        lines = self._header()
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    """Giá trị chỉ tăng"""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """Giá trị tăng giảm tùy ý"""
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        """Tăng gauge trong khi khối lệnh đang chạy"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(_Metric):
+    """Phân bố giá trị (thường là độ trễ) theo các mốc cố định"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Đo thời gian chạy của khối lệnh"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        with self._lock:
+            values = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        lines = self._header()
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Callback(_Metric):
+    """Giá trị được đọc lúc xuất chỉ số (ví dụ kích thước index)"""
+
+    def __init__(self, name, documentation, func, type="gauge"):
+        """
+        Args:
+            name: Tên chỉ số
+            documentation: Mô tả
+            func: Hàm không tham số trả về giá trị (None để bỏ qua)
+            type: "gauge" hoặc "counter"
+        """
+        super().__init__(name, documentation)
+        self.func = func
+        self.type = type
+
+    def render(self):
+        try:
+            value = self.func()
+        except Exception:
+            value = None
+        if value is None:
+            return []
+        return self._header() + [f"{self.name} {_format_value(value)}"]
+
+def render():
+    """
+    Xuất tất cả chỉ số theo định dạng văn bản của Prometheus
+
+    Returns:
+        Chuỗi văn bản (content type: text/plain; version=0.0.4)
+    """
+    lines = []
+    for metric in list(REGISTRY):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def _reset_locks():
+    """Tạo lại khóa trong tiến trình con sau fork (khóa có thể đang bị luồng của tiến trình cha giữ)"""
+    for metric in REGISTRY:
+        metric._lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks)
+
+# Độ trễ của từng bước xử lý: decode, resample, forward, search, save, wal_append
+STAGE_SECONDS = Histogram("speaker_stage_duration_seconds", "Thời gian xử lý của từng bước", ("stage",))
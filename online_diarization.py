@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+from collections import deque
+import numpy as np
+import torch
+from scipy.optimize import linear_sum_assignment
+from voice_activity import speech_frames
+from diarization import SpeakerDiarizer
+from metrics import STAGE_SECONDS
+
+class OnlineDiarizer:
+    """
+    Phân đoạn người nói trực tuyến trên luồng âm thanh 16kHz đến liên tục ("ai đang nói")
+
+    Cứ sau mỗi bước hop, cửa sổ gần nhất được kiểm tra bằng VAD; cửa sổ có tiếng nói
+    được trích xuất embedding đúng một lần rồi gán ngay cho centroid người nói gần nhất
+    (hoặc tạo người nói mới). Định kỳ, các embedding gần đây được phân cụm lại để sửa
+    các centroid; số người nói giữ nguyên nhãn nhờ ghép cụm mới với centroid cũ.
+
+    Bộ nhớ không tăng theo thời gian phiên: bộ đệm âm thanh, lịch sử embedding dùng để
+    phân cụm lại và số centroid đều có kích thước tối đa cố định. Thời gian xử lý mỗi lần
+    feed bị chặn vì mỗi lần chỉ embed tối đa max_windows cửa sổ (một lần gọi model) và
+    phân cụm lại chỉ chạy trên tối đa history embedding.
+    """
+
+    def __init__(self, embedder, window=1.5, hop=0.75, threshold=0.4, max_speakers=10, history=512,
+                 recluster_interval=40, max_windows=8, min_speech_ratio=0.5, vad_aggressiveness=2,
+                 centroid_memory=100):
+        """
+        Khởi tạo bộ phân đoạn trực tuyến
+
+        Args:
+            embedder: Đối tượng SpeakerEmbedder (model đã tải được dùng lại)
+            window: Độ dài cửa sổ trích xuất embedding (giây)
+            hop: Khoảng cách giữa hai cửa sổ liên tiếp (giây)
+            threshold: Độ tương đồng cosine tối thiểu với centroid để gán vào người nói đã có
+            max_speakers: Số người nói tối đa được theo dõi
+            history: Số embedding gần nhất được giữ để phân cụm lại
+            recluster_interval: Số cửa sổ có tiếng nói giữa hai lần phân cụm lại (0 để tắt)
+            max_windows: Số cửa sổ tối đa được embed trong một lần feed; nếu một lần feed
+                         vượt qua nhiều mốc hơn, các cửa sổ cũ nhất bị bỏ qua
+            min_speech_ratio: Tỉ lệ frame có tiếng nói tối thiểu để cửa sổ được embed
+            vad_aggressiveness: Mức loại bỏ không phải tiếng nói của webrtcvad (0-3)
+            centroid_memory: Số cửa sổ tối đa được tính trong trung bình của centroid
+                             (trung bình trượt, người nói thay đổi giọng dần vẫn theo được)
+        """
+        if not (0 < window < np.inf and 0 < hop < np.inf):
+            raise ValueError("window và hop phải là số dương hữu hạn")
+        self.embedder = embedder
+        self.sample_rate = embedder.sample_rate
+        self.window_samples = max(1, int(window * self.sample_rate))
+        self.hop_samples = max(1, int(hop * self.sample_rate))
+        self.threshold = threshold
+        self.max_speakers = max_speakers
+        self.recluster_interval = recluster_interval
+        self.max_windows = max(1, max_windows)
+        self.min_speech_ratio = min_speech_ratio
+        self.vad_aggressiveness = vad_aggressiveness
+        self.centroid_memory = centroid_memory
+        self._clusterer = SpeakerDiarizer(embedder, window=window, hop=hop, threshold=threshold)
+
+        # Bộ đệm âm thanh đủ cho max_windows cửa sổ liên tiếp; cửa sổ cuối cùng có thể kết
+        # thúc sớm hơn vị trí hiện tại tới gần một hop nên cần thêm một hop
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._buffer_samples = self.window_samples + self.max_windows * self.hop_samples
+        self._total = 0                       # Tổng số mẫu đã nhận
+        self._next_end = self.window_samples  # Vị trí kết thúc của cửa sổ tiếp theo
+
+        # VAD theo frame 30ms, giữ cờ của các frame trong bộ đệm
+        self._frame_samples = self.sample_rate * 30 // 1000
+        self._vad_rest = np.zeros(0, dtype=np.float32)
+        self._flags = deque(maxlen=self._buffer_samples // self._frame_samples + 1)
+        self._frames = 0                      # Tổng số frame VAD đã xử lý
+
+        # Trạng thái phân cụm
+        self._centroids = np.zeros((0, 0), dtype=np.float32)  # (K, D) đã chuẩn hóa
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._history = deque(maxlen=history)  # (embedding, speaker) của các cửa sổ gần nhất
+        self._since_recluster = 0
+
+        # Thống kê
+        self.windows = 0       # Số cửa sổ đã xét
+        self.embedded = 0      # Số cửa sổ đã embed
+        self.skipped = 0       # Số cửa sổ bị bỏ qua để giữ độ trễ
+        self.reclusters = 0    # Số lần phân cụm lại
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self._latency_sum = 0.0
+        self._feeds = 0
+
+    @property
+    def num_speakers(self):
+        """Số người nói đã phát hiện"""
+        return len(self._counts)
+
+    def feed(self, samples):
+        """
+        Đưa thêm mẫu âm thanh vào luồng
+
+        Args:
+            samples: Mảng float32 mono 16kHz
+
+        Returns:
+            List kết quả của các cửa sổ vừa hoàn thành theo thứ tự thời gian, mỗi kết quả gồm
+            start, end (giây), speaker (SPEAKER_XX hoặc None nếu không có tiếng nói),
+            similarity, is_speech, latency_ms (thời gian xử lý lần feed này)
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        if len(samples) == 0:
+            return []
+        started = time.perf_counter()
+
+        self._buffer = np.concatenate([self._buffer, samples])[-self._buffer_samples:]
+        self._total += len(samples)
+        self._update_vad(samples)
+
+        # Các cửa sổ kết thúc trong phần âm thanh vừa nhận (chỉ giữ max_windows cửa sổ mới nhất)
+        ends = []
+        while self._next_end <= self._total:
+            ends.append(self._next_end)
+            self._next_end += self.hop_samples
+        if len(ends) > self.max_windows:
+            self.skipped += len(ends) - self.max_windows
+            ends = ends[-self.max_windows:]
+        if not ends:
+            return []
+
+        results = self._process(ends)
+
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage="online_diarization")
+        self.last_latency = elapsed
+        self.max_latency = max(self.max_latency, elapsed)
+        self._latency_sum += elapsed
+        self._feeds += 1
+        for result in results:
+            result["latency_ms"] = elapsed * 1000
+        return results
+
+    def _update_vad(self, samples):
+        """Phân loại các frame đã đủ mẫu"""
+        samples = np.concatenate([self._vad_rest, samples])
+        count = len(samples) // self._frame_samples
+        self._vad_rest = samples[count * self._frame_samples:]
+        if count:
+            flags = speech_frames(samples[:count * self._frame_samples], self.sample_rate, self.vad_aggressiveness)
+            self._flags.extend(flags.tolist())
+            self._frames += count
+
+    def _speech_ratio(self, end):
+        """Tỉ lệ frame có tiếng nói trong cửa sổ kết thúc tại mẫu end"""
+        first = max(0, self._frames - len(self._flags))
+        lo = max((end - self.window_samples) // self._frame_samples, first)
+        hi = min(end // self._frame_samples, self._frames)
+        if hi <= lo:
+            return 0.0
+        flags = list(self._flags)[lo - first:hi - first]
+        return sum(flags) / len(flags)
+
+    def _process(self, ends):
+        """Embed các cửa sổ có tiếng nói trong một batch và gán người nói"""
+        offset = self._total - len(self._buffer)
+        results = []
+        speech = []
+        for end in ends:
+            result = {
+                "start": (end - self.window_samples) / self.sample_rate,
+                "end": end / self.sample_rate,
+                "speaker": None,
+                "similarity": 0.0,
+                "is_speech": self._speech_ratio(end) >= self.min_speech_ratio
+            }
+            results.append(result)
+            if result["is_speech"]:
+                speech.append((result, end - offset))
+        self.windows += len(ends)
+        if not speech:
+            return results
+
+        # Mỗi cửa sổ chỉ được embed một lần, không qua cache
+        signals = [torch.from_numpy(self._buffer[end - self.window_samples:end].copy()) for _, end in speech]
+        embeddings = self.embedder.embed_signals(signals, batch_size=len(signals), use_cache=False)
+        embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        self.embedded += len(signals)
+
+        for (result, _), embedding in zip(speech, embeddings):
+            speaker, similarity = self._assign(embedding)
+            result["speaker"] = f"SPEAKER_{speaker:02d}"
+            result["similarity"] = similarity
+            self._history.append((embedding, speaker))
+            self._since_recluster += 1
+
+        if self.recluster_interval and self._since_recluster >= self.recluster_interval:
+            self.recluster()
+        return results
+
+    def _assign(self, embedding):
+        """Gán một embedding cho người nói gần nhất hoặc tạo người nói mới"""
+        if len(self._counts):
+            similarities = self._centroids @ embedding
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+        else:
+            best, similarity = -1, 0.0
+
+        if best < 0 or (similarity < self.threshold and len(self._counts) < self.max_speakers):
+            self._centroids = np.vstack([self._centroids.reshape(-1, len(embedding)), embedding[None, :]])
+            self._counts = np.append(self._counts, 1)
+            return len(self._counts) - 1, 1.0
+
+        # Cập nhật centroid theo trung bình trượt
+        self._counts[best] = min(self._counts[best] + 1, self.centroid_memory)
+        centroid = self._centroids[best] + (embedding - self._centroids[best]) / self._counts[best]
+        self._centroids[best] = centroid / max(np.linalg.norm(centroid), 1e-12)
+        return best, similarity
+
+    def recluster(self):
+        """
+        Phân cụm lại các embedding gần đây để sửa centroid
+
+        Cụm mới được ghép với người nói đã có theo độ tương đồng lớn nhất (thuật toán
+        Hungary) để giữ nguyên nhãn; cụm không ghép được thành người nói mới nếu còn chỗ.
+        Người nói không xuất hiện trong lịch sử gần đây giữ nguyên centroid. Nhãn của các
+        cửa sổ đã trả về không bị thay đổi.
+        """
+        self._since_recluster = 0
+        if len(self._history) < 2:
+            return
+        started = time.perf_counter()
+        embeddings = np.stack([embedding for embedding, _ in self._history])
+        labels = self._clusterer.cluster(embeddings, max_speakers=self.max_speakers)
+        count = int(labels.max()) + 1
+        centroids = np.zeros((count, embeddings.shape[1]), dtype=np.float64)
+        np.add.at(centroids, labels, embeddings)
+        sizes = np.bincount(labels, minlength=count)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        rows, columns = linear_sum_assignment(-(centroids @ self._centroids.T))
+        speakers = np.full(count, -1)
+        for row, column in zip(rows, columns):
+            if centroids[row] @ self._centroids[column] >= self.threshold:
+                speakers[row] = column
+        update = speakers >= 0
+        for row in np.flatnonzero(speakers < 0):
+            if len(self._counts) < self.max_speakers:
+                self._centroids = np.vstack([self._centroids, centroids[row][None, :].astype(np.float32)])
+                self._counts = np.append(self._counts, 0)
+                speakers[row] = len(self._counts) - 1
+                update[row] = True
+            else:
+                # Hết chỗ: gộp vào người nói gần nhất, không thay centroid của người đó
+                speakers[row] = int(np.argmax(self._centroids @ centroids[row]))
+        for row in np.flatnonzero(update):
+            speaker = speakers[row]
+            self._centroids[speaker] = centroids[row]
+            self._counts[speaker] = min(max(self._counts[speaker], sizes[row]), self.centroid_memory)
+
+        # Lịch sử mang nhãn mới để lần phân cụm sau ghép nhất quán
+        self._history = deque(((embedding, int(speakers[label])) for (embedding, _), label in zip(self._history, labels)),
+                              maxlen=self._history.maxlen)
+        self.reclusters += 1
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="clustering")
+
+    def stats(self):
+        """Thống kê của phiên: số cửa sổ, số người nói, độ trễ mỗi lần feed (ms)"""
+        return {
+            "duration": self._total / self.sample_rate,
+            "windows": self.windows,
+            "embedded": self.embedded,
+            "skipped": self.skipped,
+            "speakers": self.num_speakers,
+            "reclusters": self.reclusters,
+            "history": len(self._history),
+            "last_latency_ms": self.last_latency * 1000,
+            "max_latency_ms": self.max_latency * 1000,
+            "mean_latency_ms": self._latency_sum / self._feeds * 1000 if self._feeds else 0.0
+        }
+
+if __name__ == "__main__":
+    import argparse
+    from speaker_embedder import SpeakerEmbedder
+
+    parser = argparse.ArgumentParser(description="Mô phỏng phân đoạn người nói trực tuyến trên một file âm thanh")
+    parser.add_argument("audio_file", help="Đường dẫn đến file âm thanh")
+    parser.add_argument("--chunk", type=float, default=0.5, help="Độ dài mỗi đoạn âm thanh đưa vào (giây)")
+    parser.add_argument("--threshold", type=float, default=0.4, help="Độ tương đồng tối thiểu để gán vào người nói đã có")
+    parser.add_argument("--max_speakers", type=int, default=10, help="Số người nói tối đa")
+    args = parser.parse_args()
+
+    embedder = SpeakerEmbedder()
+    diarizer = OnlineDiarizer(embedder, threshold=args.threshold, max_speakers=args.max_speakers)
+    signal = embedder.load_signal(args.audio_file).numpy()
+    step = max(1, int(args.chunk * embedder.sample_rate))
+    current = None
+    for start in range(0, len(signal), step):
+        for result in diarizer.feed(signal[start:start + step]):
+            if result["speaker"] != current:
+                current = result["speaker"]
+                print(f"[{result['end']:8.2f}] {current or '(im lặng)'} (độ trễ {result['latency_ms']:.1f} ms)")
+    for key, value in diarizer.stats().items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
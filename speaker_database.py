@@ -2,11 +2,72 @@
 # -*- coding: utf-8 -*-
 
 import os
+import copy
+import time
+import threading
 import numpy as np
 import faiss
 import json
 from pathlib import Path
+from contextlib import contextmanager
 from scipy.spatial.distance import cosine
+from write_ahead_log import WriteAheadLog
+from metrics import STAGE_SECONDS
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có khóa giữa các tiến trình
+    fcntl = None
+
+# Các loại Faiss index được hỗ trợ
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+# Nhật ký các thao tác ghi sau snapshot gần nhất
+WAL_FILENAME = "wal.log"
+# File khóa để các tiến trình lần lượt ghi vào cùng một thư mục cơ sở dữ liệu
+LOCK_FILENAME = "db.lock"
+
+class _IndexLock:
+    """
+    Khóa đọc/ghi cho Faiss index dùng chung giữa các bản sao của cơ sở dữ liệu
+    
+    Nhiều luồng tìm kiếm được chạy đồng thời; luồng thêm vectors chờ các lượt tìm kiếm
+    đang chạy kết thúc và chặn các lượt tìm kiếm mới cho đến khi thêm xong.
+    """
+    
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+        
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+                    
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
 
 class SpeakerDatabase:
     """
@@ -15,39 +76,338 @@ class SpeakerDatabase:
     Hỗ trợ nhiều embeddings cho mỗi người nói
     """
     
-    def __init__(self):
-        """Khởi tạo cơ sở dữ liệu trống"""
-        self.embeddings = {}  # Dictionary lưu trữ list embeddings theo tên
-        self.names = []       # Danh sách tên người nói theo thứ tự trong index
+    # Ngưỡng số vectors cho chính sách chọn index tự động
+    AUTO_IVF_FLAT_MIN = 20000
+    AUTO_IVF_PQ_MIN = 500000
+    # Số vectors tối thiểu để huấn luyện centroids IVF (ít hơn thì tạm dùng flat)
+    IVF_MIN_TRAIN = {"ivf_flat": 1000, "ivf_pq": 10000}
+    # Kích thước nhật ký để commit() ghi snapshot mới và làm rỗng nhật ký
+    CHECKPOINT_BYTES = 64 << 20
+    # Tỉ lệ vectors đã xóa (còn nằm trong HNSW, bị lọc khi tìm kiếm) để xây dựng lại index
+    HNSW_MAX_DELETED_RATIO = 0.2
+    
+    def __init__(self, index_type="auto", nprobe=16):
+        """
+        Khởi tạo cơ sở dữ liệu trống
+        
+        Args:
+            index_type: Loại Faiss index ("flat", "ivf_flat", "hnsw", "ivf_pq")
+                        hoặc "auto" để chọn theo số lượng vectors
+            nprobe: Số cluster được duyệt khi tìm kiếm với index IVF
+        """
+        assert index_type == "auto" or index_type in INDEX_TYPES, f"Loại index không hợp lệ: {index_type}"
+        
+        self.names = []       # Bảng tên người nói, speaker id là vị trí trong bảng
         self.dimension = 0    # Chiều của embedding vectors
-        self.index = None     # Faiss index
-        self.embedding_to_name = []  # Map từ index trong Faiss đến tên người nói
+        self.index = None     # Faiss index, id của vector là id ổn định của embedding
+        self.next_id = 0      # Id sẽ cấp cho embedding tiếp theo
+        self.index_type = index_type      # Loại index được cấu hình
+        self.active_index_type = None     # Loại index đang được sử dụng
+        self.nprobe = nprobe
+        self.trained_count = 0            # Số vectors lúc huấn luyện index IVF
+        
+        # Kho lưu trữ liền mạch: hàng thứ i của các mảng dưới đây mô tả cùng một embedding
+        # Các hàng luôn được sắp xếp theo id tăng dần nên tra id -> hàng bằng searchsorted
+        self._vectors = np.empty((0, 0), dtype=np.float32)  # Ma trận embeddings đã chuẩn hóa
+        self._ids = np.empty(0, dtype=np.int64)             # Id ổn định của từng hàng
+        self._speaker_ids = np.empty(0, dtype=np.int32)     # Vị trí tên người nói trong self.names
+        self._sources = []                                  # File nguồn của từng hàng (hoặc None)
+        self._count = 0                                     # Số hàng đang sử dụng
+        
+        # Các bản sao (copy) dùng chung kho lưu trữ và index, chỉ nối thêm hàng sau _count;
+        # _tail[0] là số hàng đã ghi của kho dùng chung, bản sao chỉ được ghi tiếp khi
+        # _count của nó bằng _tail[0] (nếu không sẽ cấp phát kho riêng)
+        self._tail = [0]
+        self._index_lock = _IndexLock()  # Tìm kiếm đọc đồng thời, thêm vào index dùng chung thì độc quyền
+        # Id lớn nhất đã cấp + 1 của tất cả bản sao dùng chung index: id của bản sao bị bỏ
+        # (ghi lỗi) vẫn có thể còn trong index nên không bao giờ được cấp lại
+        self._id_tail = [0]
+        self._shared_adds = []  # (index, ids) đã thêm vào index có thể dùng chung, xóa khi discard()
+        
+        # HNSW không hỗ trợ xóa: id đã xóa được giữ trong index và lọc bằng IDSelector khi
+        # tìm kiếm, index chỉ được xây dựng lại khi số id đã xóa vượt HNSW_MAX_DELETED_RATIO
+        self._deleted = np.empty(0, dtype=np.int64)  # Id đã xóa còn trong index (đã sắp xếp)
+        self._search_params = None                   # SearchParameters lọc các id đã xóa
+        
+        # Khi tải bằng memory mapping, các mảng và index chỉ đọc được dùng chung page cache
+        # giữa các tiến trình; lần ghi đầu tiên sẽ sao chép chúng vào bộ nhớ riêng
+        self._mapped = False
+        self._index_mapped = False
+        self._sources_path = None  # File sources.json chưa đọc (đọc khi cần)
+        
+        # Nhật ký ghi trước của thư mục cơ sở dữ liệu (gắn khi save/load)
+        self._wal = None
+        
+    @property
+    def ntotal(self):
+        """Số embeddings trong cơ sở dữ liệu"""
+        return self._count
         
-    def add_embedding(self, name, embedding):
+    @property
+    def vectors(self):
+        """View (không sao chép) của ma trận embeddings đang sử dụng"""
+        return self._vectors[:self._count]
+        
+    @property
+    def ids(self):
+        """View của mảng id ổn định"""
+        return self._ids[:self._count]
+        
+    @property
+    def speaker_ids(self):
+        """View của mảng speaker id"""
+        return self._speaker_ids[:self._count]
+        
+    def speaker_rows(self, name):
+        """
+        Lấy chỉ số các hàng thuộc về một người nói
+        
+        Args:
+            name: Tên người nói
+            
+        Returns:
+            Mảng chỉ số hàng (rỗng nếu không có người nói)
+        """
+        if name not in self.names:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.speaker_ids == self.names.index(name))
+        
+    def get_speaker_embeddings(self, name):
+        """
+        Lấy ma trận embeddings của một người nói
+        
+        Args:
+            name: Tên người nói
+            
+        Returns:
+            Ma trận numpy [số embeddings, dimension]
+        """
+        return self.vectors[self.speaker_rows(name)]
+        
+    def _get_sources(self):
+        """Lấy danh sách file nguồn, đọc từ đĩa ở lần dùng đầu tiên"""
+        if self._sources is None:
+            if self._sources_path and os.path.exists(self._sources_path):
+                with open(self._sources_path, 'r', encoding='utf-8') as f:
+                    self._sources = json.load(f)
+            else:
+                self._sources = [None] * self._count
+        return self._sources
+        
+    def _ensure_writable(self):
+        """Sao chép dữ liệu memory-mapped vào bộ nhớ riêng trước khi sửa đổi"""
+        self._get_sources()
+        if not self._mapped:
+            return
+            
+        self._vectors = np.array(self._vectors, dtype=np.float32)
+        self._ids = np.array(self._ids, dtype=np.int64)
+        self._speaker_ids = np.array(self._speaker_ids, dtype=np.int32)
+        self._tail = [self._count]
+        self._mapped = False
+        
+        if not self._index_mapped:
+            return
+        self._index_mapped = False
+        
+        # Index memory-mapped không cho phép thêm/xóa; tạo index mới trong bộ nhớ
+        # thay vì sửa index cũ vì index cũ có thể đang được dùng chung với bản sao khác
+        if self.active_index_type in ("ivf_flat", "ivf_pq"):
+            self.index = self._copy_ivf_index(self.index)
+        else:
+            # Index flat có dữ liệu trùng với kho embeddings, tạo lại từ kho
+            self.index = self._create_index("flat")
+            self.index.add_with_ids(self.vectors, self.ids)
+            
+    @staticmethod
+    def _copy_ivf_index(mapped_index):
+        """Chép index IVF memory-mapped vào bộ nhớ, giữ nguyên centroids đã huấn luyện"""
+        quantizer = faiss.clone_index(mapped_index.quantizer)
+        if isinstance(mapped_index, faiss.IndexIVFPQ):
+            index = faiss.IndexIVFPQ(quantizer, mapped_index.d, mapped_index.nlist,
+                                     mapped_index.pq.M, mapped_index.pq.nbits, mapped_index.metric_type)
+            faiss.copy_array_to_vector(faiss.vector_to_array(mapped_index.pq.centroids), index.pq.centroids)
+            index.by_residual = mapped_index.by_residual
+        else:
+            index = faiss.IndexIVFFlat(quantizer, mapped_index.d, mapped_index.nlist, mapped_index.metric_type)
+        quantizer.this.disown()
+        index.own_fields = True
+        index.is_trained = True
+        index.nprobe = mapped_index.nprobe
+        
+        # Chép inverted lists vào bộ nhớ
+        mapped_lists = mapped_index.invlists
+        invlists = faiss.ArrayInvertedLists(mapped_index.nlist, mapped_index.code_size)
+        for list_no in range(mapped_index.nlist):
+            list_size = mapped_lists.list_size(list_no)
+            if list_size:
+                invlists.add_entries(list_no, list_size, mapped_lists.get_ids(list_no), mapped_lists.get_codes(list_no))
+        index.replace_invlists(invlists, True)
+        invlists.this.disown()
+        index.ntotal = mapped_index.ntotal
+        if isinstance(index, faiss.IndexIVFPQ):
+            index.precompute_table()
+        return index
+        
+    def copy(self):
+        """
+        Tạo bản sao để sửa đổi (copy-on-write)
+        
+        Các thao tác ghi được thực hiện trên bản sao rồi mới thay thế bản gốc, nên các
+        luồng đang tìm kiếm trên bản gốc không bao giờ thấy dữ liệu đang sửa dở.
+        Bản sao không chép kho lưu trữ và index: thêm embeddings chỉ ghi vào các hàng sau
+        _count của bản gốc (bản gốc không nhìn thấy) và thêm vào index dùng chung dưới
+        khóa độc quyền ngắn, bản gốc bỏ qua các id không có trong kho của nó. Xóa
+        embeddings thì dồn hàng vào kho mới và sao chép index, nên chi phí mỗi lần thêm
+        chỉ phụ thuộc số embeddings được thêm (và bảng tên, danh sách file nguồn).
+        Bản sao không được dùng (ghi lỗi) cần gọi discard().
+        
+        Returns:
+            Đối tượng SpeakerDatabase mới
+        """
+        db = copy.copy(self)
+        db.names = list(self.names)
+        if self._sources is not None:
+            db._sources = list(self._sources)
+        db._shared_adds = []
+        return db
+        
+    def discard(self):
+        """
+        Bỏ bản sao chưa được dùng thay bản gốc (ví dụ update hoặc commit bị lỗi)
+        
+        Xóa các vectors bản sao đã thêm vào index dùng chung. HNSW không hỗ trợ xóa, các
+        vectors đó được giữ lại nhưng không bản sao nào nhìn thấy vì id của chúng không
+        có trong kho và không được cấp lại.
+        """
+        for index, ids in self._shared_adds:
+            with self._index_lock.write():
+                try:
+                    index.remove_ids(ids)
+                except RuntimeError:
+                    pass  # HNSW
+        self._shared_adds = []
+        
+    def _reserve(self, extra):
+        """
+        Đảm bảo kho lưu trữ đủ chỗ cho thêm extra hàng (tăng gấp đôi khi đầy)
+        
+        Kho dùng chung với bản sao khác đã ghi thêm hàng sau _count thì được cấp phát lại
+        để không ghi đè các hàng đó.
+        """
+        needed = self._count + extra
+        capacity = self._vectors.shape[0]
+        if needed <= capacity and self._vectors.shape[1] == self.dimension and self._tail[0] == self._count:
+            # Bỏ phần thừa của lần ghi bị lỗi trước đó (nếu có)
+            del self._sources[self._count:]
+            return
+            
+        new_capacity = max(needed, capacity * 2, 64)
+        vectors = np.empty((new_capacity, self.dimension), dtype=np.float32)
+        ids = np.empty(new_capacity, dtype=np.int64)
+        speaker_ids = np.empty(new_capacity, dtype=np.int32)
+        if self._count:
+            vectors[:self._count] = self._vectors[:self._count]
+        ids[:self._count] = self._ids[:self._count]
+        speaker_ids[:self._count] = self._speaker_ids[:self._count]
+        self._vectors, self._ids, self._speaker_ids = vectors, ids, speaker_ids
+        self._sources = self._sources[:self._count]
+        self._tail = [self._count]
+        
+    def add_embedding(self, name, embedding, source=None):
         """
         Thêm một embedding mới vào cơ sở dữ liệu
         
         Args:
             name: Tên người nói
             embedding: Vector embedding (numpy array)
+            source: Định danh file nguồn của embedding (None nếu không theo dõi)
+            
+        Returns:
+            Id ổn định của embedding trong index
         """
-        # Chuẩn hóa embedding để sử dụng với Inner Product (cosine similarity)
-        normalized_embedding = embedding / np.linalg.norm(embedding)
+        return int(self.add_batch(name, np.asarray(embedding).reshape(1, -1), [source])[0])
         
-        # Khởi tạo list embeddings cho người nói mới nếu chưa có
-        if name not in self.embeddings:
-            self.embeddings[name] = []
-            self.names.append(name)
+    def add_batch(self, name, embeddings, sources=None):
+        """
+        Thêm nhiều embeddings của cùng một người nói
+        
+        Args:
+            name: Tên người nói
+            embeddings: Ma trận numpy [n, dimension] hoặc list vectors
+            sources: List định danh file nguồn tương ứng (None nếu không theo dõi)
             
-        # Lưu embedding vào list của người nói
-        self.embeddings[name].append(normalized_embedding)
+        Returns:
+            Mảng id ổn định của các embeddings vừa thêm
+        """
+        new_ids = self._apply_add(name, embeddings, sources)
+        
+        # Ghi vào nhật ký các vectors đã chuẩn hóa đúng như trong kho
+        n = len(new_ids)
+        self._log({
+            "op": "add",
+            "name": name,
+            "ids": new_ids.tolist(),
+            "sources": self._sources[self._count - n:self._count],
+            "dimension": self.dimension
+        }, self._vectors[self._count - n:self._count].tobytes())
+        
+        return new_ids
         
+    def _apply_add(self, name, embeddings, sources=None, ids=None):
+        """Thêm embeddings vào kho và index (không ghi nhật ký)"""
+        self._ensure_writable()
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+        n = embeddings.shape[0]
+        if sources is None:
+            sources = [None] * n
+            
         # Cập nhật chiều nếu chưa có
         if self.dimension == 0:
-            self.dimension = embedding.shape[0]
+            self.dimension = embeddings.shape[1]
             
         # Verify dimension
-        assert embedding.shape[0] == self.dimension, f"Chiều của embedding ({embedding.shape[0]}) không khớp với chiều hiện tại ({self.dimension})"
+        assert embeddings.shape[1] == self.dimension, f"Chiều của embedding ({embeddings.shape[1]}) không khớp với chiều hiện tại ({self.dimension})"
+        
+        # Thêm tên vào bảng nếu là người nói mới
+        if name not in self.names:
+            self.names.append(name)
+        speaker_id = self.names.index(name)
+        
+        # Cấp id ổn định cho các embeddings (khi đọc lại nhật ký thì dùng id đã ghi)
+        if ids is None:
+            first_id = max(self.next_id, self._id_tail[0])
+            new_ids = np.arange(first_id, first_id + n, dtype=np.int64)
+        else:
+            new_ids = np.asarray(ids, dtype=np.int64)
+        self.next_id = max(self.next_id, int(new_ids[-1]) + 1)
+        self._id_tail[0] = max(self._id_tail[0], self.next_id)
+        
+        # Chuẩn hóa và ghi thẳng vào kho lưu trữ (Inner Product = cosine similarity)
+        self._reserve(n)
+        start, end = self._count, self._count + n
+        rows = self._vectors[start:end]
+        rows[:] = embeddings
+        if ids is None:
+            # Vectors trong nhật ký đã được chuẩn hóa, không chuẩn hóa lại để khớp từng bit
+            rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+        self._ids[start:end] = new_ids
+        self._speaker_ids[start:end] = speaker_id
+        self._sources.extend(sources)
+        self._count = end
+        self._tail[0] = end
+        
+        # Thêm trực tiếp vào index, chỉ xây dựng lại khi cần đổi loại index
+        if self.index is None or self._needs_rebuild():
+            self.build_index()
+        else:
+            with self._index_lock.write():
+                self.index.add_with_ids(rows, new_ids)
+            self._shared_adds.append((self.index, new_ids))
+        
+        return new_ids
             
     def add_embeddings(self, embeddings_dict):
         """
@@ -57,36 +417,217 @@ class SpeakerDatabase:
             embeddings_dict: Dictionary ánh xạ từ tên đến list embeddings
         """
         for name, embeddings in embeddings_dict.items():
-            if isinstance(embeddings, list):
-                for embedding in embeddings:
-                    self.add_embedding(name, embedding)
-            else:
-                self.add_embedding(name, embeddings)
+            self.add_batch(name, embeddings)
             
-    def build_index(self):
-        """Xây dựng Faiss index từ các embeddings đã thêm vào"""
-        if not self.embeddings:
-            print("Không có embeddings nào để xây dựng index")
+    def remove_speaker(self, name):
+        """
+        Xóa toàn bộ embeddings của một người nói khỏi cơ sở dữ liệu và index
+        
+        Args:
+            name: Tên người nói
+            
+        Returns:
+            Có xóa được hay không
+        """
+        if not self._apply_remove_speaker(name):
+            return False
+            
+        self._log({"op": "remove_speaker", "name": name})
+        return True
+        
+    def _apply_remove_speaker(self, name):
+        """Xóa người nói khỏi kho và index (không ghi nhật ký)"""
+        if name not in self.names:
             return False
             
-        # Tạo list phẳng của tất cả embeddings và map tương ứng
-        all_embeddings = []
-        self.embedding_to_name = []
+        self._ensure_writable()
+        speaker_id = self.names.index(name)
+        self._remove_rows(self.speaker_ids == speaker_id)
+        
+        # Xóa tên khỏi bảng và dịch các speaker id phía sau (kho đã được dồn sang mảng mới)
+        del self.names[speaker_id]
+        speaker_ids = self.speaker_ids
+        speaker_ids[speaker_ids > speaker_id] -= 1
+        return True
+        
+    def remove_source(self, source):
+        """
+        Xóa các embeddings được tạo từ một file nguồn khỏi cơ sở dữ liệu và index
+        Người nói không còn embedding nào sẽ bị xóa khỏi cơ sở dữ liệu
+        
+        Args:
+            source: Định danh file nguồn
+            
+        Returns:
+            Số embeddings đã xóa
+        """
+        removed = self._apply_remove_source(source)
+        if removed:
+            self._log({"op": "remove_source", "source": source})
+        return removed
+        
+    def _apply_remove_source(self, source):
+        """Xóa embeddings theo file nguồn khỏi kho và index (không ghi nhật ký)"""
+        self._ensure_writable()
+        mask = np.fromiter((s == source for s in self._sources), dtype=bool, count=self._count)
+        removed = int(mask.sum())
+        if removed == 0:
+            return 0
+            
+        affected = set(self.speaker_ids[mask].tolist())
+        self._remove_rows(mask)
+        
+        # Xóa những người nói không còn embedding nào
+        remaining = set(self.speaker_ids.tolist())
+        for speaker_id in sorted(affected - remaining, reverse=True):
+            self._apply_remove_speaker(self.names[speaker_id])
+            
+        return removed
+        
+    def _remove_rows(self, mask):
+        """
+        Xóa các hàng được đánh dấu khỏi kho lưu trữ và xóa id tương ứng khỏi index
+        
+        Kho và index có thể đang được dùng chung với bản gốc nên các hàng còn lại được dồn
+        sang mảng mới và index được sao chép trước khi xóa (kể cả khi mask rỗng, để
+        người gọi được sửa kho tại chỗ).
+        """
+        # HNSW không hỗ trợ xóa nên chỉ đánh dấu id đã xóa, các loại khác xóa trực tiếp theo id
+        hnsw = self.active_index_type == "hnsw"
+        if self.index is not None and hnsw and mask.any():
+            self._mark_deleted(self.ids[mask])
+        elif self.index is not None and mask.any():
+            with self._index_lock.read():
+                index = faiss.clone_index(self.index)
+            index.remove_ids(self.ids[mask])
+            self.index = index
+            
+        # Dồn các hàng còn lại sang kho mới, giữ nguyên thứ tự id
+        keep = np.flatnonzero(~mask)
+        n = len(keep)
+        self._vectors = self.vectors[keep]
+        self._ids = self.ids[keep]
+        self._speaker_ids = self.speaker_ids[keep]
+        self._sources = [self._sources[i] for i in keep]
+        self._count = n
+        self._tail = [n]
         
-        for name, embeddings in self.embeddings.items():
-            all_embeddings.extend(embeddings)
-            self.embedding_to_name.extend([name] * len(embeddings))
+        # Xây dựng lại khi các id đã xóa chiếm quá nhiều chỗ trong đồ thị HNSW
+        if self.index is not None and hnsw and len(self._deleted) > self.HNSW_MAX_DELETED_RATIO * max(n, 1):
+            self.build_index()
             
-        # Chuyển thành ma trận numpy
-        embeddings_matrix = np.vstack(all_embeddings)
+    def _mark_deleted(self, ids):
+        """Đánh dấu các id đã xóa nhưng vẫn còn trong index (mảng mới, bản gốc không bị ảnh hưởng)"""
+        self._deleted = np.union1d(self._deleted, ids)
+        batch = faiss.IDSelectorBatch(self._deleted)
+        params = faiss.SearchParameters(sel=faiss.IDSelectorNot(batch))
+        params.batch = batch  # Giữ tham chiếu Python để selector không bị giải phóng
+        self._search_params = params
+        
+    def get_sources(self):
+        """Trả về tập các file nguồn đang có trong cơ sở dữ liệu"""
+        return {s for s in self._get_sources()[:self._count] if s is not None}
+        
+    @classmethod
+    def select_index_type(cls, count):
+        """
+        Chính sách chọn loại index tự động theo số lượng vectors
+        
+        Args:
+            count: Số vectors trong cơ sở dữ liệu
+            
+        Returns:
+            Tên loại index
+        """
+        if count < cls.AUTO_IVF_FLAT_MIN:
+            return "flat"
+        if count < cls.AUTO_IVF_PQ_MIN:
+            return "ivf_flat"
+        return "ivf_pq"
         
-        # Tạo Faiss index (Inner Product cho cosine similarity)
-        self.index = faiss.IndexFlatIP(self.dimension)
+    def _resolve_index_type(self, count):
+        """Loại index sẽ dùng cho count vectors (IVF chưa đủ dữ liệu huấn luyện thì dùng flat)"""
+        index_type = self.select_index_type(count) if self.index_type == "auto" else self.index_type
+        if count < self.IVF_MIN_TRAIN.get(index_type, 0):
+            return "flat"
+        return index_type
         
-        # Thêm vectors vào index
-        self.index.add(embeddings_matrix.astype(np.float32))
+    def _needs_rebuild(self):
+        """Kiểm tra index hiện tại có cần xây dựng lại sau khi thêm vectors không"""
+        if self._resolve_index_type(self._count) != self.active_index_type:
+            return True
+        # Số cluster IVF được chọn theo số vectors lúc huấn luyện, huấn luyện lại khi dữ liệu tăng 4 lần
+        return self.active_index_type in ("ivf_flat", "ivf_pq") and self._count > 4 * self.trained_count
         
-        print(f"Đã xây dựng Faiss index với {len(all_embeddings)} vectors từ {len(self.embeddings)} người nói")
+    def _create_index(self, index_type, train_vectors=None):
+        """
+        Tạo Faiss index rỗng hỗ trợ thêm theo id (Inner Product cho cosine similarity)
+        
+        Args:
+            index_type: Loại index
+            train_vectors: Vectors dùng để huấn luyện index IVF
+            
+        Returns:
+            Faiss index
+        """
+        d = self.dimension
+        if index_type == "flat":
+            # IndexIDMap2 để giữ id ổn định
+            return faiss.IndexIDMap2(faiss.IndexFlatIP(d))
+            
+        if index_type == "hnsw":
+            hnsw = faiss.IndexHNSWFlat(d, 32, faiss.METRIC_INNER_PRODUCT)
+            hnsw.hnsw.efConstruction = 80
+            hnsw.hnsw.efSearch = 64
+            return faiss.IndexIDMap2(hnsw)
+            
+        # IVF: số cluster ~ 4 * sqrt(n), mỗi cluster cần ít nhất ~39 điểm để huấn luyện
+        n_train = len(train_vectors)
+        nlist = max(1, min(int(4 * np.sqrt(n_train)), n_train // 39))
+        quantizer = faiss.IndexFlatIP(d)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            # Mỗi sub-quantizer mã hóa 4 chiều bằng 8 bit
+            m = next(m for m in (48, 32, 24, 16, 8, 4, 2, 1) if d % m == 0 and d // m >= 4 or m == 1)
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+        index.train(train_vectors)
+        index.nprobe = min(self.nprobe, nlist)
+        return index
+        
+    def build_index(self):
+        """
+        Xây dựng lại toàn bộ Faiss index từ kho embeddings
+        Dùng khi tải dữ liệu cũ, index bị mất hoặc khi cần đổi loại index,
+        các thao tác thêm/xóa thông thường cập nhật index trực tiếp
+        """
+        if self._count == 0:
+            print("Không có embeddings nào để xây dựng index")
+            self._deleted = np.empty(0, dtype=np.int64)
+            self._search_params = None
+            self.index = None
+            self.active_index_type = None
+            return False
+            
+        index_type = self._resolve_index_type(self._count)
+        
+        # Huấn luyện IVF trên một mẫu ngẫu nhiên tối đa 100k vectors
+        train_vectors = None
+        if index_type in ("ivf_flat", "ivf_pq"):
+            sample_size = min(self._count, 100000)
+            sample = np.random.default_rng(0).choice(self._count, size=sample_size, replace=False)
+            train_vectors = self.vectors[np.sort(sample)]
+            self.trained_count = self._count
+            
+        # Kho lưu trữ đã là ma trận float32 liền mạch, thêm thẳng vào index
+        self.index = self._create_index(index_type, train_vectors)
+        self.index.add_with_ids(self.vectors, self.ids)
+        self.active_index_type = index_type
+        self._index_mapped = False
+        self._deleted = np.empty(0, dtype=np.int64)
+        self._search_params = None
+        
+        print(f"Đã xây dựng Faiss index {index_type} với {self._count} vectors từ {len(self.names)} người nói")
         return True
         
     def search(self, query_embedding, top_k=1):
@@ -112,13 +653,39 @@ class SpeakerDatabase:
         # Chuẩn hóa query embedding
         query_embedding_norm = query_embedding / np.linalg.norm(query_embedding)
             
+        if self.index.ntotal == 0:
+            return [], []
+            
         # Tìm kiếm kNN trên Faiss index
-        similarities, indices = self.index.search(query_embedding_norm.astype(np.float32), k=min(top_k, len(self.embedding_to_name)))
+        k = min(top_k, self._count)
+        with STAGE_SECONDS.time(stage="search"), self._index_lock.read():
+            similarities, ids = self.index.search(query_embedding_norm.astype(np.float32), k=self._search_k(k),
+                                                  params=self._search_params)
+        
+        # Ánh xạ id sang tên người nói (các hàng được sắp xếp theo id, bỏ các ô trống -1 của Faiss)
+        valid = (ids[0] >= 0) & self._valid_hits(ids, k)[0]
+        rows = np.searchsorted(self.ids, ids[0][valid])
+        result_names = [self.names[speaker_id] for speaker_id in self.speaker_ids[rows]]
         
-        # Ánh xạ indices sang tên người nói
-        result_names = [self.embedding_to_name[i] for i in indices[0]]
+        return result_names, similarities[0][valid]
         
-        return result_names, similarities[0]
+    def _search_k(self, k):
+        """Số kết quả cần lấy từ index (gọi khi giữ khóa đọc) để còn đủ k kết quả của bản sao này"""
+        # Index dùng chung có thể chứa các vectors do bản sao mới hơn thêm vào
+        # (các id đã xóa bị lọc trong Faiss nên không cần lấy thêm)
+        return min(k + max(self.index.ntotal - self._count - len(self._deleted), 0), self.index.ntotal)
+        
+    def _valid_hits(self, ids, k):
+        """
+        Mặt nạ k kết quả đầu tiên của mỗi truy vấn có id nằm trong kho của bản sao này
+        (index dùng chung có thể chứa vectors của bản sao mới hơn hoặc bản sao đã bỏ)
+        """
+        own = self.ids
+        if len(own) == 0:
+            return np.zeros(ids.shape, dtype=bool)
+        rows = np.minimum(np.searchsorted(own, ids), len(own) - 1)
+        valid = own[rows] == ids
+        return valid & (np.cumsum(valid, axis=1) <= k)
         
     def calculate_cosine_similarity(self, embedding1, embedding2):
         """
@@ -132,7 +699,7 @@ class SpeakerDatabase:
         """
         return 1 - cosine(embedding1, embedding2)
         
-    def identify_speaker(self, query_embedding, threshold=0.6):
+    def identify_speaker(self, query_embedding, threshold=0.6, top_k=5):
         """
         Nhận dạng người nói dựa trên embedding
         
@@ -140,79 +707,213 @@ class SpeakerDatabase:
             query_embedding: Vector embedding truy vấn
             threshold: Ngưỡng độ tương đồng tối thiểu để xác định là cùng người nói
                        (cosine similarity, 0.6 là ngưỡng hợp lý để bắt đầu)
+            top_k: Số embeddings gần nhất dùng để tính độ tương đồng trung bình
                        
         Returns:
             Tuple (tên người nói gần nhất, độ tương đồng trung bình, is_known_speaker)
         """
-        # Chuẩn hóa query embedding
-        query_embedding = query_embedding / np.linalg.norm(query_embedding)
+        return self.identify_speakers(np.asarray(query_embedding).reshape(1, -1), threshold, top_k)[0]
         
-        # Tìm top 5 kết quả gần nhất
-        names, similarities = self.search(query_embedding, top_k=5)
+    def identify_speakers(self, query_embeddings, threshold=0.6, top_k=5):
+        """
+        Nhận dạng người nói cho nhiều embeddings cùng lúc
+        
+        Tất cả truy vấn được tìm kiếm trong một lần gọi Faiss. Với mỗi truy vấn,
+        độ tương đồng của top_k kết quả được lấy trung bình theo từng người nói
+        bằng phép gộp theo đoạn (bincount) trên cặp (truy vấn, speaker id),
+        người nói có trung bình cao nhất được chọn.
         
-        if not names:
-            return None, 0.0, False
+        Args:
+            query_embeddings: Ma trận embeddings truy vấn [n, dimension]
+            threshold: Ngưỡng độ tương đồng tối thiểu để xác định là cùng người nói
+            top_k: Số embeddings gần nhất dùng để tính độ tương đồng trung bình
             
-        # Tính độ tương đồng trung bình cho mỗi người nói
-        speaker_similarities = {}
-        for name, sim in zip(names, similarities):
-            if name not in speaker_similarities:
-                speaker_similarities[name] = []
-            speaker_similarities[name].append(sim)
+        Returns:
+            List các tuple (tên người nói gần nhất, độ tương đồng trung bình, is_known_speaker)
+            theo thứ tự truy vấn
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        n_queries = queries.shape[0]
+        
+        if self.index is None:
+            print("Chưa xây dựng index, đang xây dựng...")
+            self.build_index()
+        if n_queries == 0 or self.index is None or self.index.ntotal == 0:
+            return [(None, 0.0, False)] * n_queries
             
-        # Tìm người nói có độ tương đồng trung bình cao nhất
-        best_speaker = None
-        best_avg_sim = 0.0
+        # Chuẩn hóa và tìm kiếm tất cả truy vấn trong một lần gọi
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        k = min(top_k, self._count)
+        with STAGE_SECONDS.time(stage="search"), self._index_lock.read():
+            similarities, ids = self.index.search(queries, self._search_k(k), params=self._search_params)
+        
+        # Ánh xạ id -> speaker id (bỏ các ô trống -1 của Faiss)
+        valid = ((ids >= 0) & self._valid_hits(ids, k)).ravel()
+        rows = np.searchsorted(self.ids, ids.ravel()[valid])
+        speaker_ids = self.speaker_ids[rows].astype(np.int64)
+        query_ids = np.repeat(np.arange(n_queries), ids.shape[1])[valid]
         
-        for name, sims in speaker_similarities.items():
-            avg_sim = sum(sims) / len(sims)
-            if avg_sim > best_avg_sim:
-                best_speaker = name
-                best_avg_sim = avg_sim
+        # Gộp theo đoạn: trung bình độ tương đồng cho mỗi cặp (truy vấn, người nói)
+        n_speakers = len(self.names)
+        keys, inverse = np.unique(query_ids * n_speakers + speaker_ids, return_inverse=True)
+        sums = np.bincount(inverse, weights=similarities.ravel()[valid])
+        counts = np.bincount(inverse)
+        means = sums / counts
+        key_queries = keys // n_speakers
+        key_speakers = keys % n_speakers
         
-        # Kiểm tra ngưỡng
-        is_known_speaker = best_avg_sim >= threshold
+        # Chọn cặp có trung bình cao nhất cho mỗi truy vấn
+        order = np.lexsort((-means, key_queries))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = key_queries[order][1:] != key_queries[order][:-1]
+        best = order[first]
+        
+        best_speakers = np.full(n_queries, -1, dtype=np.int64)
+        best_similarities = np.zeros(n_queries, dtype=np.float64)
+        positive = means[best] > 0.0
+        best_speakers[key_queries[best][positive]] = key_speakers[best][positive]
+        best_similarities[key_queries[best][positive]] = means[best][positive]
+        
+        return [
+            (self.names[speaker_id], float(similarity), bool(similarity >= threshold))
+            if speaker_id >= 0 else (None, 0.0, False)
+            for speaker_id, similarity in zip(best_speakers, best_similarities)
+        ]
+        
+    def _log(self, record, data=b""):
+        """Ghi thao tác vào nhật ký nếu cơ sở dữ liệu đang gắn với một thư mục"""
+        if self._wal is not None:
+            with STAGE_SECONDS.time(stage="wal_append"):
+                self._wal.append(record, data)
             
-        return best_speaker, best_avg_sim, is_known_speaker
+    def _replay(self, records):
+        """Áp dụng lại các thao tác đọc từ nhật ký"""
+        for _, record, data in records:
+            op = record["op"]
+            if op == "add":
+                ids = record["ids"]
+                vectors = np.frombuffer(data, dtype=np.float32).reshape(len(ids), record["dimension"])
+                self._apply_add(record["name"], vectors, record["sources"], ids=ids)
+            elif op == "remove_speaker":
+                self._apply_remove_speaker(record["name"])
+            elif op == "remove_source":
+                self._apply_remove_source(record["source"])
+                
+    def commit(self, directory):
+        """
+        Đảm bảo các thay đổi đã được lưu bền vững vào thư mục
+        
+        Nếu cơ sở dữ liệu đang ghi nhật ký vào thư mục này thì các thay đổi đã nằm
+        trong wal.log, chỉ ghi snapshot mới (và làm rỗng nhật ký) khi nhật ký quá lớn.
+        Ngược lại ghi toàn bộ snapshot như save().
         
+        Args:
+            directory: Thư mục cơ sở dữ liệu
+        """
+        if self._wal is None or self._wal.path != os.path.join(directory, WAL_FILENAME):
+            self.save(directory)
+        elif self._wal.size() > self.CHECKPOINT_BYTES:
+            self.save(directory)
+            
     def save(self, directory):
         """
-        Lưu cơ sở dữ liệu vào thư mục
+        Ghi snapshot đầy đủ của cơ sở dữ liệu vào thư mục
+        
+        Các file của snapshot mang số thế hệ (vectors.<gen>.npy, ...) và chỉ có hiệu lực
+        khi metadata.json trỏ tới chúng; metadata.json được đổi tên sau cùng nên nếu tiến
+        trình dừng giữa chừng thì snapshot cũ vẫn nguyên vẹn. Sau đó nhật ký được làm rỗng
+        và các thay đổi tiếp theo được ghi nối vào wal.log.
         
         Args:
             directory: Thư mục đích
         """
+        started = time.perf_counter()
+        
         # Tạo thư mục nếu chưa tồn tại
         os.makedirs(directory, exist_ok=True)
         
-        # Lưu embeddings thành file numpy
-        embeddings_path = os.path.join(directory, "embeddings.npz")
-        np.savez(embeddings_path, **{name: np.array(embeddings) for name, embeddings in self.embeddings.items()})
-        
-        # Lưu metadata
-        metadata = {
-            "names": self.names,
-            "dimension": self.dimension,
-            "embedding_to_name": self.embedding_to_name
-        }
         metadata_path = os.path.join(directory, "metadata.json")
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        old_metadata = {}
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                old_metadata = json.load(f)
+                
+        # Gắn nhật ký của thư mục đích; số thứ tự tiếp tục từ bản ghi cuối cùng đã có
+        wal_path = os.path.join(directory, WAL_FILENAME)
+        if self._wal is None or self._wal.path != wal_path:
+            if self._wal is not None:
+                self._wal.close()
+            self._wal = WriteAheadLog(wal_path)
+            self._wal.replay(old_metadata.get("wal_seq", 0))
             
+        generation = old_metadata.get("generation", 0) + 1
+        files = {
+            "vectors": f"vectors.{generation}.npy",
+            "ids": f"ids.{generation}.npy",
+            "speaker_ids": f"speaker_ids.{generation}.npy",
+            "sources": f"sources.{generation}.json",
+            "index": f"faiss_index.{generation}.bin" if self.index is not None else None
+        }
+        
+        # Lưu các mảng của kho lưu trữ
+        _atomic_save_npy(os.path.join(directory, files["vectors"]), self.vectors)
+        _atomic_save_npy(os.path.join(directory, files["ids"]), self.ids)
+        _atomic_save_npy(os.path.join(directory, files["speaker_ids"]), self.speaker_ids)
+        _atomic_write_json(os.path.join(directory, files["sources"]), self._get_sources())
+        
         # Lưu Faiss index nếu đã xây dựng
         if self.index is not None:
-            index_path = os.path.join(directory, "faiss_index.bin")
-            faiss.write_index(self.index, index_path)
+            index_path = os.path.join(directory, files["index"])
+            tmp_path = f"{index_path}.tmp"
+            faiss.write_index(self.index, tmp_path)
+            _fsync_file(tmp_path)
+            os.replace(tmp_path, index_path)
             
+        # Lưu metadata (nhỏ, không phụ thuộc số lượng embeddings) - thời điểm snapshot có hiệu lực
+        metadata = {
+            "storage": "npy",
+            "generation": generation,
+            "files": files,
+            "wal_seq": self._wal.last_seq,
+            "names": self.names,
+            "dimension": self.dimension,
+            "count": self._count,
+            "next_id": self.next_id,
+            "index_type": self.index_type,
+            "active_index_type": self.active_index_type,
+            "trained_count": self.trained_count,
+            "nprobe": self.nprobe
+        }
+        _atomic_write_json(metadata_path, metadata)
+        _fsync_dir(directory)
+        
+        # Các thao tác trong nhật ký đã nằm trong snapshot
+        self._wal.reset()
+        
+        # Xóa file của snapshot cũ và file định dạng cũ nếu còn (các tiến trình đang
+        # map file cũ vẫn đọc được cho đến khi đóng)
+        stale = set(_snapshot_files(old_metadata).values()) | {"embeddings.npz"}
+        for filename in stale - set(files.values()):
+            path = os.path.join(directory, filename) if filename else None
+            if path and os.path.exists(path):
+                os.remove(path)
+                
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="save")
         print(f"Đã lưu cơ sở dữ liệu vào {directory}")
         
     @classmethod
-    def load(cls, directory):
+    def load(cls, directory, mmap=True, index_type=None):
         """
         Tải cơ sở dữ liệu từ thư mục
         
+        Snapshot được tải trước, sau đó các thao tác trong wal.log chưa có trong
+        snapshot được áp dụng lại; bản ghi ghi dở ở cuối nhật ký bị bỏ qua.
+        
         Args:
             directory: Thư mục chứa dữ liệu
+            mmap: Mở các mảng và index bằng memory mapping (thời gian tải không
+                  phụ thuộc kích thước cơ sở dữ liệu, các tiến trình dùng chung page cache)
+            index_type: Đổi loại index đã lưu (None để giữ nguyên), index sẽ được xây dựng lại
             
         Returns:
             Đối tượng SpeakerDatabase đã tải
@@ -220,37 +921,187 @@ class SpeakerDatabase:
         # Khởi tạo đối tượng mới
         db = cls()
         
-        # Đường dẫn đến các file
-        embeddings_path = os.path.join(directory, "embeddings.npz")
+        # Tải metadata
         metadata_path = os.path.join(directory, "metadata.json")
-        index_path = os.path.join(directory, "faiss_index.bin")
+        if not os.path.exists(metadata_path):
+            print(f"Không tìm thấy file dữ liệu cần thiết trong {directory}")
+            return None
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+            
+        # Đường dẫn đến các file
+        files = _snapshot_files(metadata)
+        vectors_path = os.path.join(directory, files["vectors"])
+        legacy_path = os.path.join(directory, "embeddings.npz")
+        index_path = os.path.join(directory, files["index"]) if files["index"] else None
         
         # Kiểm tra xem các file cần thiết có tồn tại không
-        if not os.path.exists(embeddings_path) or not os.path.exists(metadata_path):
+        if not (os.path.exists(vectors_path) or os.path.exists(legacy_path)):
             print(f"Không tìm thấy file dữ liệu cần thiết trong {directory}")
             return None
             
-        # Tải embeddings
-        embeddings_data = np.load(embeddings_path)
-        db.embeddings = {name: list(embeddings_data[name]) for name in embeddings_data.files}
+        db.dimension = metadata["dimension"]
+        db.index_type = metadata.get("index_type", "auto")
+        db.active_index_type = metadata.get("active_index_type", "flat")
+        db.trained_count = metadata.get("trained_count", 0)
+        db.nprobe = metadata.get("nprobe", db.nprobe)
         
-        # Tải metadata
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
+        if metadata.get("storage") == "npy":
+            # Mảng rỗng không map được
+            mmap = mmap and metadata.get("count", 1) > 0
+            mmap_mode = 'r' if mmap else None
             db.names = metadata["names"]
-            db.dimension = metadata["dimension"]
-            db.embedding_to_name = metadata.get("embedding_to_name", [])
+            db._vectors = np.load(vectors_path, mmap_mode=mmap_mode)
+            db._ids = np.load(os.path.join(directory, files["ids"]), mmap_mode=mmap_mode)
+            db._speaker_ids = np.load(os.path.join(directory, files["speaker_ids"]), mmap_mode=mmap_mode)
+            db._count = len(db._ids)
+            db._sources = None
+            db._sources_path = os.path.join(directory, files["sources"])
+            db._mapped = mmap
+            db.next_id = metadata.get("next_id", db._count)
             
-        # Tải Faiss index nếu có
-        if os.path.exists(index_path):
-            db.index = faiss.read_index(index_path)
+            # Tải Faiss index nếu có (HNSW cần đồ thị trong bộ nhớ nên không map)
+            if index_path and os.path.exists(index_path) and (index_type is None or index_type == db.index_type):
+                if not mmap or db.active_index_type == "hnsw":
+                    db.index = faiss.read_index(index_path)
+                    if db.active_index_type == "hnsw":
+                        # Index HNSW được lưu cùng các id đã xóa chưa được xây dựng lại
+                        deleted = np.setdiff1d(faiss.vector_to_array(db.index.id_map), db.ids)
+                        if len(deleted):
+                            db._mark_deleted(deleted)
+                elif db.active_index_type == "flat":
+                    db.index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC)
+                    db._index_mapped = True
+                else:
+                    db.index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+                    db._index_mapped = True
+            else:
+                db.index_type = index_type or db.index_type
+                db.build_index()
+                
+            # Áp dụng lại các thao tác ghi sau snapshot
+            db._wal = WriteAheadLog(os.path.join(directory, WAL_FILENAME))
+            records = db._wal.replay(metadata.get("wal_seq", 0))
+            if records:
+                db._replay(records)
+                print(f"Đã áp dụng lại {len(records)} thao tác từ nhật ký")
         else:
-            # Xây dựng lại index nếu không tìm thấy file
-            db.build_index()
+            # Định dạng cũ không có nhật ký, lần commit đầu tiên sẽ ghi snapshot mới
+            db.index_type = index_type or db.index_type
+            db._load_legacy(legacy_path, metadata)
             
-        print(f"Đã tải cơ sở dữ liệu từ {directory} với {sum(len(embeddings) for embeddings in db.embeddings.values())} embeddings từ {len(db.embeddings)} người nói")
+        print(f"Đã tải cơ sở dữ liệu từ {directory} với {db.ntotal} embeddings từ {len(db.names)} người nói")
         return db
         
+    def _load_legacy(self, embeddings_path, metadata):
+        """Tải cơ sở dữ liệu lưu bằng embeddings.npz (các định dạng cũ) vào kho lưu trữ mới"""
+        embeddings_data = np.load(embeddings_path)
+        if metadata.get("storage") == "matrix":
+            # Ma trận liền mạch trong file npz
+            self.names = metadata["names"]
+            self._vectors = np.ascontiguousarray(embeddings_data["vectors"], dtype=np.float32)
+            self._ids = embeddings_data["ids"].astype(np.int64)
+            self._speaker_ids = embeddings_data["speaker_ids"].astype(np.int32)
+            self._sources = metadata.get("sources", [None] * len(self._ids))
+            self._count = len(self._ids)
+            self.next_id = metadata.get("next_id", self._count)
+            self.build_index()
+        else:
+            # Mỗi người nói một mảng trong file npz
+            sources = metadata.get("sources", {})
+            for name in metadata["names"]:
+                if name in embeddings_data.files:
+                    embeddings = embeddings_data[name]
+                    self.add_batch(name, embeddings, sources.get(name, [None] * len(embeddings)))
+        
+@contextmanager
+def lock_directory(directory):
+    """
+    Khóa độc quyền thư mục cơ sở dữ liệu giữa các tiến trình (flock)
+
+    Các tiến trình ghi (và tiến trình tải lại, vì đọc nhật ký có thể cắt phần ghi dở)
+    giữ khóa này để không ai đọc hoặc ghi wal.log khi tiến trình khác đang ghi.
+    Trên hệ điều hành không có fcntl khóa không có tác dụng.
+
+    Args:
+        directory: Thư mục cơ sở dữ liệu (được tạo nếu chưa có)
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILENAME), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def directory_version(directory):
+    """
+    Phiên bản hiện tại của cơ sở dữ liệu trên đĩa, thay đổi sau mỗi lần ghi
+
+    Mỗi thao tác ghi nối thêm bản ghi vào wal.log (kích thước tăng), mỗi snapshot
+    mới thay metadata.json bằng file khác; chỉ cần stat hai file nên có thể gọi
+    thường xuyên để phát hiện thay đổi của tiến trình khác.
+
+    Args:
+        directory: Thư mục cơ sở dữ liệu
+
+    Returns:
+        Tuple so sánh được (None nếu chưa có cơ sở dữ liệu)
+    """
+    try:
+        metadata = os.stat(os.path.join(directory, "metadata.json"))
+    except FileNotFoundError:
+        return None
+    try:
+        wal_size = os.stat(os.path.join(directory, WAL_FILENAME)).st_size
+    except FileNotFoundError:
+        wal_size = 0
+    return (metadata.st_ino, metadata.st_mtime_ns, metadata.st_size, wal_size)
+
+def _snapshot_files(metadata):
+    """Tên các file của snapshot mà metadata trỏ tới (định dạng trước khi có số thế hệ dùng tên cố định)"""
+    return metadata.get("files") or {
+        "vectors": "vectors.npy",
+        "ids": "ids.npy",
+        "speaker_ids": "speaker_ids.npy",
+        "sources": "sources.json",
+        "index": "faiss_index.bin"
+    }
+    
+def _fsync_file(path):
+    """Đẩy nội dung file xuống đĩa"""
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+        
+def _fsync_dir(directory):
+    """Đẩy các thao tác đổi tên trong thư mục xuống đĩa"""
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+            
+def _atomic_save_npy(path, array):
+    """Ghi mảng numpy ra file tạm rồi đổi tên thành path"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    
+def _atomic_write_json(path, data):
+    """Ghi JSON ra file tạm rồi đổi tên thành path"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+        
 # Test function
 if __name__ == "__main__":
     from speaker_embedder import load_embeddings
@@ -2,11 +2,13 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
 import numpy as np
 from pathlib import Path
 import torch
 import torchaudio
 from speechbrain.inference import EncoderClassifier
+from metrics import STAGE_SECONDS
 
 class SpeakerEmbedder:
     """
@@ -14,19 +16,78 @@ class SpeakerEmbedder:
     sử dụng SpeechBrain để trích xuất đặc trưng giọng nói
     """
     
-    def __init__(self, model_name="speechbrain/spkrec-ecapa-voxceleb"):
+    def __init__(self, model_name="speechbrain/spkrec-ecapa-voxceleb", batch_size=16, max_batch_duration=120.0,
+                 cache=None):
         """
         Khởi tạo embedder với model SpeechBrain
         
         Args:
             model_name: Tên model SpeechBrain để sử dụng
+            batch_size: Số file tối đa trong một lần gọi encode_batch
+            max_batch_duration: Tổng thời lượng tối đa (giây) của một batch sau khi padding
+            cache: EmbeddingCache tùy chọn để bỏ qua model với âm thanh đã xử lý
         """
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        started = time.perf_counter()
         self.model = EncoderClassifier.from_hparams(
             source=model_name,
             savedir="pretrained_models/spkrec-ecapa-voxceleb",
             run_opts={"device": self.device}
         )
+        self.load_seconds = time.perf_counter() - started  # Thời gian tải model
+        self.sample_rate = 16000  # ECAPA-TDNN được huấn luyện với âm thanh 16kHz
+        self.batch_size = batch_size
+        self.max_batch_duration = max_batch_duration
+        self._resamplers = {}
+        self.model_id = model_name
+        self.cache = cache
+        
+    def load_signal(self, audio_path):
+        """
+        Đọc file âm thanh thành tín hiệu mono 16kHz
+        
+        Args:
+            audio_path: Đường dẫn đến file âm thanh hoặc file-like object (ví dụ io.BytesIO
+                        chứa nội dung file upload, được giải mã trực tiếp trong bộ nhớ)
+            
+        Returns:
+            Tensor 1 chiều chứa tín hiệu âm thanh
+        """
+        with STAGE_SECONDS.time(stage="decode"):
+            signal, fs = torchaudio.load(audio_path)
+        return self.prepare_signal(signal, fs)
+        
+    def prepare_signal(self, signal, fs):
+        """
+        Chuyển tín hiệu về mono và tần số lấy mẫu của model
+        
+        Args:
+            signal: Tensor âm thanh dạng [channels, samples] hoặc [samples]
+            fs: Tần số lấy mẫu của tín hiệu
+            
+        Returns:
+            Tensor 1 chiều chứa tín hiệu âm thanh
+            
+        Raises:
+            ValueError: Nếu tín hiệu không có mẫu nào
+        """
+        if signal.dim() == 1:
+            signal = signal.unsqueeze(0)
+        if signal.shape[-1] == 0:
+            raise ValueError("File âm thanh không có mẫu nào")
+            
+        # Đảm bảo âm thanh là mono
+        if signal.shape[0] > 1:
+            signal = torch.mean(signal, dim=0, keepdim=True)
+            
+        # Resample về 16kHz, các file trong cùng batch phải cùng tần số lấy mẫu
+        if fs != self.sample_rate:
+            if fs not in self._resamplers:
+                self._resamplers[fs] = torchaudio.transforms.Resample(fs, self.sample_rate)
+            with STAGE_SECONDS.time(stage="resample"):
+                signal = self._resamplers[fs](signal)
+            
+        return signal.squeeze(0)
         
     def process_audio(self, audio_path):
         """
@@ -38,16 +99,109 @@ class SpeakerEmbedder:
         Returns:
             Vector embedding của giọng nói
         """
-        # Load và xử lý âm thanh
-        signal, fs = torchaudio.load(audio_path)
+        signal = self.load_signal(audio_path)
+        return self.embed_signals([signal])[0]
         
-        # Đảm bảo âm thanh là mono
-        if signal.shape[0] > 1:
-            signal = torch.mean(signal, dim=0, keepdim=True)
+    def embed_signals(self, signals, batch_size=None, max_batch_duration=None, use_cache=True):
+        """
+        Trích xuất embeddings cho nhiều tín hiệu bằng các lần gọi encode_batch có padding
+        
+        Các tín hiệu được sắp xếp theo độ dài để giảm phần padding, sau đó được
+        gom thành batch sao cho số phần tử không vượt quá batch_size và tổng
+        thời lượng sau padding không vượt quá max_batch_duration.
+        Nếu có cache, chỉ những tín hiệu chưa có trong cache mới đi qua model.
+        
+        Args:
+            signals: List các tensor 1 chiều (mono, 16kHz)
+            batch_size: Số tín hiệu tối đa mỗi batch (mặc định: self.batch_size)
+            max_batch_duration: Thời lượng tối đa sau padding (giây) của mỗi batch
+            use_cache: Dùng cache (tắt với các đoạn ngắn chỉ dùng một lần như cửa sổ diarization)
+            
+        Returns:
+            Ma trận numpy [len(signals), dimension] theo đúng thứ tự đầu vào
+            
+        Raises:
+            ValueError: Nếu có tín hiệu rỗng (không có mẫu nào)
+        """
+        empty = [i for i, signal in enumerate(signals) if signal.shape[-1] == 0]
+        if empty:
+            raise ValueError(f"Tín hiệu âm thanh rỗng ở vị trí {empty}")
+            
+        cache = self.cache if use_cache else None
+        batch_size = batch_size or self.batch_size
+        max_batch_duration = max_batch_duration or self.max_batch_duration
+        max_batch_samples = int(max_batch_duration * self.sample_rate)
+        
+        embeddings = [None] * len(signals)
+        
+        # Tra cache trước, chỉ embed những tín hiệu chưa có
+        keys = [None] * len(signals)
+        if cache is not None:
+            for i, signal in enumerate(signals):
+                keys[i] = cache.make_key(signal, self.sample_rate)
+                embeddings[i] = cache.get(keys[i])
+        pending = [i for i in range(len(signals)) if embeddings[i] is None]
+        
+        lengths = [int(signal.shape[-1]) for signal in signals]
+        order = sorted(pending, key=lambda i: lengths[i], reverse=True)
+        
+        # Gom batch: phần tử đầu tiên của mỗi batch là dài nhất
+        batches = []
+        current = []
+        for i in order:
+            if current and (len(current) >= batch_size or (len(current) + 1) * lengths[current[0]] > max_batch_samples):
+                batches.append(current)
+                current = []
+            current.append(i)
+        if current:
+            batches.append(current)
+            
+        for batch in batches:
+            max_len = lengths[batch[0]]
+            wavs = torch.zeros(len(batch), max_len)
+            for row, i in enumerate(batch):
+                wavs[row, :lengths[i]] = signals[i]
+            wav_lens = torch.tensor([lengths[i] / max_len for i in batch])
             
-        # Tạo embedding
-        embedding = self.model.encode_batch(signal)
-        return embedding.squeeze().cpu().numpy()
+            with torch.no_grad(), STAGE_SECONDS.time(stage="forward"):
+                batch_embeddings = self.model.encode_batch(wavs, wav_lens)
+            batch_embeddings = batch_embeddings.squeeze(1).cpu().numpy()
+            
+            for row, i in enumerate(batch):
+                embeddings[i] = batch_embeddings[row]
+                if cache is not None:
+                    cache.put(keys[i], batch_embeddings[row])
+                
+        if not embeddings:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(embeddings).astype(np.float32)
+        
+    def process_audio_batch(self, audio_paths, batch_size=None, max_batch_duration=None):
+        """
+        Trích xuất embeddings cho nhiều file âm thanh theo batch
+        
+        Args:
+            audio_paths: List đường dẫn đến các file âm thanh (hoặc file-like object)
+            batch_size: Số file tối đa mỗi batch (mặc định: self.batch_size)
+            max_batch_duration: Thời lượng tối đa sau padding (giây) của mỗi batch
+            
+        Returns:
+            Tuple (ma trận embeddings, list đường dẫn tương ứng với từng hàng)
+            File không đọc được sẽ bị bỏ qua
+        """
+        signals = []
+        loaded_paths = []
+        for audio_path in audio_paths:
+            try:
+                signals.append(self.load_signal(audio_path if hasattr(audio_path, "read") else str(audio_path)))
+                loaded_paths.append(audio_path)
+            except Exception as e:
+                print(f"Lỗi khi đọc {audio_path}: {e}")
+                
+        if not signals:
+            return np.empty((0, 0), dtype=np.float32), []
+            
+        return self.embed_signals(signals, batch_size, max_batch_duration), loaded_paths
         
     def process_speaker_directory(self, speaker_dir):
         """
@@ -68,13 +222,10 @@ class SpeakerEmbedder:
             
         print(f"Đang xử lý {len(audio_files)} file âm thanh cho {Path(speaker_dir).name}")
         
-        for audio_file in audio_files:
-            try:
-                embedding = self.process_audio(str(audio_file))
-                embeddings.append(embedding)
-                print(f"Đã xử lý {audio_file.name}")
-            except Exception as e:
-                print(f"Lỗi khi xử lý {audio_file.name}: {e}")
+        embeddings_matrix, loaded_files = self.process_audio_batch(audio_files)
+        for audio_file, embedding in zip(loaded_files, embeddings_matrix):
+            embeddings.append(embedding)
+            print(f"Đã xử lý {audio_file.name}")
                 
         return embeddings
         
@@ -106,13 +257,25 @@ class SpeakerEmbedder:
             
         print(f"Tìm thấy {len(speaker_dirs)} người nói")
         
+        # Gom tất cả các file của mọi người nói để embed theo batch một lần
+        audio_files = []
+        file_speakers = {}
         for speaker_dir in speaker_dirs:
-            speaker_name = speaker_dir.name
-            embeddings = self.process_speaker_directory(speaker_dir)
+            speaker_files = list(speaker_dir.glob("*.wav"))
+            if not speaker_files:
+                print(f"Không tìm thấy file âm thanh trong {speaker_dir}")
+                continue
+            print(f"Đang xử lý {len(speaker_files)} file âm thanh cho {speaker_dir.name}")
+            for audio_file in speaker_files:
+                audio_files.append(audio_file)
+                file_speakers[audio_file] = speaker_dir.name
+                
+        embeddings_matrix, loaded_files = self.process_audio_batch(audio_files)
+        for audio_file, embedding in zip(loaded_files, embeddings_matrix):
+            speakers_embeddings.setdefault(file_speakers[audio_file], []).append(embedding)
             
-            if embeddings:
-                speakers_embeddings[speaker_name] = embeddings
-                print(f"Đã tạo {len(embeddings)} embeddings cho {speaker_name}")
+        for speaker_name, embeddings in speakers_embeddings.items():
+            print(f"Đã tạo {len(embeddings)} embeddings cho {speaker_name}")
                 
         return speakers_embeddings
 
@@ -2,39 +2,58 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
 import argparse
+import threading
 import numpy as np
 import glob
 from pathlib import Path
 from speaker_embedder import SpeakerEmbedder, save_embeddings, load_embeddings
-from speaker_database import SpeakerDatabase
+from speaker_database import SpeakerDatabase, INDEX_TYPES, lock_directory, directory_version
+from embedding_cache import EmbeddingCache
+from enrollment_manifest import EnrollmentManifest
+from admission_control import check_deadline
+from diarization import SpeakerDiarizer, identify_clusters, meeting_statistics
 
 class SpeakerRecognitionApp:
     """Ứng dụng nhận dạng người nói"""
     
-    def __init__(self, database_dir="speaker_db", threshold=0.6):
+    def __init__(self, database_dir="speaker_db", threshold=0.6, cache_dir="embedding_cache"):
         """
         Khởi tạo ứng dụng
         
         Args:
             database_dir: Thư mục chứa cơ sở dữ liệu
             threshold: Ngưỡng độ tương đồng tối thiểu để xác định cùng người nói (0.6 là hợp lý để bắt đầu)
+            cache_dir: Thư mục cache embeddings trên đĩa (None để chỉ cache trong bộ nhớ)
         """
         self.database_dir = database_dir
         self.threshold = threshold
+        self.cache_dir = cache_dir
         self.embedder = None
         self.database = None
+        self.scheduler = None  # BatchScheduler gom các yêu cầu embed đồng thời (dùng trong API)
+        
+        # Luồng ghi sửa đổi bản sao của database rồi thay thế tham chiếu self.database,
+        # luồng đọc chỉ lấy tham chiếu hiện tại nên không bao giờ bị chặn
+        self._write_lock = threading.Lock()
+        # Phiên bản thư mục cơ sở dữ liệu ứng với self.database (để phát hiện thay đổi
+        # do tiến trình khác ghi)
+        self._db_version = None
         
     def initialize(self):
         """Khởi tạo embedder và database"""
         print("Đang khởi tạo speaker recognition...")
         
-        # Khởi tạo embedder
+        # Khởi tạo embedder với cache theo nội dung âm thanh
         self.embedder = SpeakerEmbedder()
+        self.embedder.cache = EmbeddingCache(self.cache_dir, model_id=self.embedder.model_id)
         
         # Tải hoặc tạo cơ sở dữ liệu
         if os.path.exists(self.database_dir):
-            self.database = SpeakerDatabase.load(self.database_dir)
+            with lock_directory(self.database_dir):
+                self._db_version = directory_version(self.database_dir)
+                self.database = SpeakerDatabase.load(self.database_dir)
             if self.database is None:
                 self.database = SpeakerDatabase()
         else:
@@ -42,12 +61,16 @@ class SpeakerRecognitionApp:
             
         print("Đã khởi tạo xong speaker recognition")
         
-    def prepare_database(self, audio_dir="audio"):
+    def prepare_database(self, audio_dir="audio", full=False):
         """
         Chuẩn bị cơ sở dữ liệu từ thư mục chứa file âm thanh
         
+        Chỉ những file mới hoặc đã thay đổi so với manifest trong thư mục cơ sở dữ liệu
+        mới được embed lại, embeddings của các file đã bị xóa sẽ bị loại bỏ.
+        
         Args:
             audio_dir: Thư mục chứa file âm thanh
+            full: Xây dựng lại toàn bộ cơ sở dữ liệu từ đầu
         """
         print(f"Đang chuẩn bị cơ sở dữ liệu từ thư mục {audio_dir}...")
         
@@ -55,32 +78,83 @@ class SpeakerRecognitionApp:
         if self.embedder is None:
             self.initialize()
             
-        # Trích xuất embeddings
-        embeddings = self.embedder.process_all_speakers(audio_dir)
+        with self._write_lock, lock_directory(self.database_dir):
+            self._refresh_database()
+            return self._prepare_database(audio_dir, full)
+            
+    def _prepare_database(self, audio_dir, full):
+        """Cập nhật bản sao database theo thư mục âm thanh (gọi khi đang giữ khóa ghi)"""
+        manifest = EnrollmentManifest.load(self.database_dir)
+        
+        # Không có manifest (hoặc đổi thư mục nguồn) thì không biết embedding nào thuộc file nào
+        if full or not manifest.files or manifest.audio_dir != str(audio_dir):
+            # Giữ cấu hình index của cơ sở dữ liệu hiện tại khi xây dựng lại
+            database = SpeakerDatabase(index_type=self.database.index_type, nprobe=self.database.nprobe)
+            manifest.files = {}
+        else:
+            database = self.database.copy()
+        manifest.audio_dir = str(audio_dir)
+            
+        changed, deleted, current = manifest.scan(audio_dir, database.get_sources())
         
-        if not embeddings:
+        if not current:
             print(f"Không tìm thấy file âm thanh nào trong thư mục {audio_dir}")
             return False
             
-        # Tạo cơ sở dữ liệu
-        self.database = SpeakerDatabase()
-        self.database.add_embeddings(embeddings)
-        
-        # Xây dựng index
-        self.database.build_index()
-        
-        # Lưu cơ sở dữ liệu
-        self.database.save(self.database_dir)
+        # Ghi lại kích thước/mtime mới của các file không đổi nội dung để lần sau không
+        # phải hash lại (file thay đổi chỉ được ghi khi đã embed thành công)
+        changed_entries = dict(changed)
+        for rel_path, entry in current.items():
+            if rel_path not in changed_entries:
+                manifest.files[rel_path] = entry
+            
+        if not changed and not deleted:
+            manifest.save()
+            print("Cơ sở dữ liệu đã cập nhật, không có file nào thay đổi")
+            return True
+            
+        print(f"Có {len(changed)} file mới/thay đổi và {len(deleted)} file đã bị xóa")
+        
+        # Loại bỏ embeddings của các file đã xóa hoặc đã thay đổi (xóa theo id trong index)
+        for rel_path in deleted:
+            database.remove_source(rel_path)
+            del manifest.files[rel_path]
+        for rel_path, _ in changed:
+            database.remove_source(rel_path)
+            manifest.files.pop(rel_path, None)
+            
+        # Trích xuất embeddings cho các file mới/thay đổi theo batch
+        audio_path = Path(audio_dir)
+        embeddings, loaded_paths = self.embedder.process_audio_batch(
+            [audio_path / rel_path for rel_path, _ in changed]
+        )
+        # Gom theo người nói để mỗi người nói chỉ tốn một bản ghi nhật ký
+        rows_by_speaker = {}
+        for row, file_path in enumerate(loaded_paths):
+            rel_path = file_path.relative_to(audio_path).as_posix()
+            entry = changed_entries[rel_path]
+            rows_by_speaker.setdefault(entry["speaker"], []).append((row, rel_path))
+            manifest.files[rel_path] = entry
+        for speaker, rows in rows_by_speaker.items():
+            database.add_batch(speaker, embeddings[[row for row, _ in rows]], [rel_path for _, rel_path in rows])
+            
+        # Lưu cơ sở dữ liệu rồi mới lưu manifest, sau đó mới thay thế database đang dùng
+        database.commit(self.database_dir)
+        manifest.save()
+        self._db_version = directory_version(self.database_dir)
+        self.database = database
         
-        print(f"Đã chuẩn bị xong cơ sở dữ liệu với {len(embeddings)} người nói")
+        print(f"Đã chuẩn bị xong cơ sở dữ liệu với {len(database.names)} người nói")
         return True
         
-    def identify_file(self, audio_file):
+    def identify_file(self, audio_file, threshold=None, top_k=5):
         """
         Nhận dạng người nói từ file âm thanh
         
         Args:
             audio_file: Đường dẫn đến file âm thanh
+            threshold: Ngưỡng độ tương đồng cho lần nhận dạng này (None để dùng self.threshold)
+            top_k: Số kết quả gần nhất được xét
             
         Returns:
             Tuple (tên người nói, độ tương đồng, is_known)
@@ -89,8 +163,11 @@ class SpeakerRecognitionApp:
         if self.embedder is None or self.database is None:
             self.initialize()
             
+        # Dùng một snapshot database cho cả lần nhận dạng
+        database = self.database
+        
         # Nếu database vẫn None, có thể cần chuẩn bị trước
-        if self.database is None or not self.database.embeddings:
+        if database is None or database.ntotal == 0:
             print("Cơ sở dữ liệu trống, hãy chuẩn bị cơ sở dữ liệu trước")
             return None, 0.0, False
             
@@ -101,25 +178,167 @@ class SpeakerRecognitionApp:
             
         print(f"Đang nhận dạng người nói từ file {audio_file}...")
         
+        return self.identify_signal(self.embedder.load_signal(audio_file), threshold, top_k)
+        
+    def identify_signal(self, signal, threshold=None, top_k=5, deadline=None):
+        """
+        Nhận dạng người nói từ tín hiệu đã giải mã
+        
+        Args:
+            signal: Tensor 1 chiều (mono, 16kHz)
+            threshold: Ngưỡng độ tương đồng cho lần nhận dạng này (None để dùng self.threshold)
+            top_k: Số kết quả gần nhất được xét
+            deadline: Thời điểm hết hạn theo time.monotonic(), quá hạn thì ném
+                      DeadlineExceeded thay vì chạy model (None nếu không có hạn)
+            
+        Returns:
+            Tuple (tên người nói, độ tương đồng, is_known)
+        """
+        # Đảm bảo embedder và database đã được khởi tạo
+        if self.embedder is None or self.database is None:
+            self.initialize()
+            
+        # Dùng một snapshot database cho cả lần nhận dạng
+        database = self.database
+        if database is None or database.ntotal == 0:
+            print("Cơ sở dữ liệu trống, hãy chuẩn bị cơ sở dữ liệu trước")
+            return None, 0.0, False
+            
         # Trích xuất embedding
-        embedding = self.embedder.process_audio(audio_file)
+        embedding = self.embed_signal(signal, deadline)
         
         if embedding is None:
-            print(f"Không thể trích xuất embedding từ file {audio_file}")
+            print("Không thể trích xuất embedding từ tín hiệu")
             return None, 0.0, False
             
         # Nhận dạng người nói
-        name, similarity, is_known = self.database.identify_speaker(embedding, self.threshold)
+        if threshold is None:
+            threshold = self.threshold
+        name, similarity, is_known = database.identify_speaker(embedding, threshold, top_k)
         
         return name, similarity, is_known
         
-    def add_speaker(self, audio_files, speaker_name):
+    def embed_file(self, audio_file):
+        """
+        Trích xuất embedding của một file âm thanh
+        Nếu có bộ gom batch, việc đọc file chạy trên luồng gọi còn model chạy
+        chung batch với các yêu cầu đồng thời khác
+        
+        Args:
+            audio_file: Đường dẫn đến file âm thanh
+            
+        Returns:
+            Vector embedding
+        """
+        return self.embed_signal(self.embedder.load_signal(audio_file))
+        
+    def embed_signal(self, signal, deadline=None):
+        """
+        Trích xuất embedding của một tín hiệu mono 16kHz (qua bộ gom batch nếu có)
+        
+        Args:
+            signal: Tensor 1 chiều chứa tín hiệu âm thanh
+            deadline: Thời điểm hết hạn theo time.monotonic() (None nếu không có hạn)
+            
+        Returns:
+            Vector embedding
+        """
+        if self.scheduler is None:
+            check_deadline(deadline)
+            return self.embedder.embed_signals([signal])[0]
+        return self.scheduler.embed(signal, deadline=deadline)
+        
+    def identify_files(self, audio_files, threshold=None, top_k=5):
+        """
+        Nhận dạng người nói cho nhiều file âm thanh
+        Các file được embed theo batch và tìm kiếm trong một lần gọi Faiss
+        
+        Args:
+            audio_files: Danh sách đường dẫn đến các file âm thanh
+            threshold: Ngưỡng độ tương đồng cho lần nhận dạng này (None để dùng self.threshold)
+            top_k: Số kết quả gần nhất được xét
+            
+        Returns:
+            List các tuple (tên người nói, độ tương đồng, is_known) theo thứ tự file
+        """
+        # Đảm bảo embedder và database đã được khởi tạo
+        if self.embedder is None or self.database is None:
+            self.initialize()
+            
+        database = self.database
+        if database is None or database.ntotal == 0:
+            print("Cơ sở dữ liệu trống, hãy chuẩn bị cơ sở dữ liệu trước")
+            return [(None, 0.0, False)] * len(audio_files)
+            
+        existing_files = [f for f in audio_files if os.path.exists(f)]
+        for audio_file in audio_files:
+            if audio_file not in existing_files:
+                print(f"File âm thanh {audio_file} không tồn tại")
+                
+        print(f"Đang nhận dạng người nói từ {len(existing_files)} file...")
+        
+        # Trích xuất embeddings theo batch và nhận dạng cùng lúc
+        embeddings, loaded_files = self.embedder.process_audio_batch(existing_files)
+        results = {}
+        if loaded_files:
+            if threshold is None:
+                threshold = self.threshold
+            results = dict(zip(loaded_files, database.identify_speakers(embeddings, threshold, top_k)))
+        
+        return [results.get(audio_file, (None, 0.0, False)) for audio_file in audio_files]
+        
+    def diarize_and_identify(self, audio, diarizer=None, num_speakers=None, min_speakers=1, max_speakers=10,
+                             threshold=None, top_k=5):
+        """
+        Phân tích cuộc họp: phân đoạn người nói rồi gán tên người nói đã đăng ký cho từng cụm
+        Mỗi cụm chỉ được nhận dạng một lần qua centroid của các cửa sổ thuộc cụm
+        
+        Args:
+            audio: Đường dẫn/file-like object hoặc tensor 1 chiều (mono, 16kHz)
+            diarizer: SpeakerDiarizer dùng chung embedder của ứng dụng (None để dùng cấu hình mặc định)
+            num_speakers, min_speakers, max_speakers: Như SpeakerDiarizer.diarize
+            threshold: Ngưỡng độ tương đồng cho lần nhận dạng này (None để dùng self.threshold)
+            top_k: Số kết quả gần nhất được xét
+            
+        Returns:
+            Dictionary gồm duration, segments (speaker là tên hoặc nhãn cụm không xác định),
+            clusters, statistics (xem meeting_statistics) và timings
+        """
+        # Đảm bảo embedder và database đã được khởi tạo
+        if self.embedder is None or self.database is None:
+            self.initialize()
+            
+        # Dùng một snapshot database cho cả lần phân tích
+        database = self.database
+        if diarizer is None:
+            diarizer = SpeakerDiarizer(self.embedder)
+        if threshold is None:
+            threshold = self.threshold
+            
+        result = diarizer.diarize(audio, num_speakers, min_speakers, max_speakers)
+        timings = result["timings"]
+        started = time.perf_counter()
+        clusters, segments = identify_clusters(result, database, threshold, top_k)
+        timings["identification"] = time.perf_counter() - started
+        timings["total"] += timings["identification"]
+        
+        return {
+            "duration": result["duration"],
+            "segments": segments,
+            "clusters": clusters,
+            "statistics": meeting_statistics(segments, result["duration"]),
+            "timings": timings
+        }
+        
+    def add_speaker(self, audio_files, speaker_name, progress=None):
         """
         Thêm người nói mới vào cơ sở dữ liệu
         
         Args:
             audio_files: Đường dẫn đến file hoặc danh sách các file âm thanh
+                         (có thể là file-like object chứa nội dung file trong bộ nhớ)
             speaker_name: Tên người nói
+            progress: Hàm progress(số file đã xử lý, tổng số file) được gọi sau mỗi batch (tùy chọn)
             
         Returns:
             Thành công hay không
@@ -134,36 +353,111 @@ class SpeakerRecognitionApp:
             
         # Kiểm tra tồn tại của các file
         for audio_file in audio_files:
-            if not os.path.exists(audio_file):
+            if not hasattr(audio_file, "read") and not os.path.exists(audio_file):
                 print(f"File âm thanh {audio_file} không tồn tại")
                 return False
                 
         print(f"Đang thêm người nói {speaker_name} với {len(audio_files)} file âm thanh...")
         
-        # Trích xuất embeddings
-        all_embeddings = []
-        for audio_file in audio_files:
-            embedding = self.embedder.process_audio(audio_file)
-            if embedding is not None:
-                all_embeddings.append(embedding)
-                
-        if not all_embeddings:
+        # Trích xuất embeddings theo batch (từng nhóm nhỏ nếu cần báo tiến độ)
+        step = max(1, self.embedder.batch_size if progress else len(audio_files))
+        parts = []
+        for start in range(0, len(audio_files), step):
+            embeddings, _ = self.embedder.process_audio_batch(audio_files[start:start + step])
+            if len(embeddings):
+                parts.append(embeddings)
+            if progress:
+                progress(min(start + step, len(audio_files)), len(audio_files))
+        all_embeddings = np.vstack(parts) if parts else []
+
+        if len(all_embeddings) == 0:
             print("Không thể trích xuất embedding từ bất kỳ file âm thanh nào")
             return False
             
-        # Thêm tất cả embeddings vào cơ sở dữ liệu
-        for embedding in all_embeddings:
-            self.database.add_embedding(speaker_name, embedding)
+        # Thêm tất cả embeddings vào cơ sở dữ liệu (index được cập nhật trực tiếp)
+        self.add_speaker_embeddings(speaker_name, all_embeddings)
+        
+        print(f"Đã thêm người nói {speaker_name} vào cơ sở dữ liệu với {len(all_embeddings)} embeddings")
+        return True
+        
+    def add_speaker_embeddings(self, speaker_name, embeddings, sources=None):
+        """
+        Thêm embeddings đã trích xuất của một người nói vào cơ sở dữ liệu
+        
+        Args:
+            speaker_name: Tên người nói
+            embeddings: Ma trận (N, D) hoặc một vector embedding
+            sources: Danh sách file nguồn tương ứng (hoặc None)
+            
+        Returns:
+            Mảng id của các embeddings vừa thêm
+        """
+        return self._update_database(lambda database: database.add_batch(speaker_name, embeddings, sources))
         
-        # Xây dựng lại index
-        self.database.build_index()
+    def _update_database(self, update):
+        """
+        Sửa đổi cơ sở dữ liệu theo kiểu copy-on-write
         
-        # Lưu cơ sở dữ liệu
-        self.database.save(self.database_dir)
+        Các luồng ghi lần lượt sửa đổi một bản sao, lưu lại rồi mới gán bản sao cho
+        self.database. Phép gán tham chiếu là nguyên tử nên luồng đọc luôn thấy
+        hoặc database cũ hoặc database mới đã hoàn chỉnh. Khóa thư mục tuần tự hóa
+        các tiến trình cùng ghi vào database_dir; thay đổi của tiến trình khác được
+        tải về trước khi sửa đổi.
         
-        print(f"Đã thêm người nói {speaker_name} vào cơ sở dữ liệu với {len(all_embeddings)} embeddings")
+        Args:
+            update: Hàm nhận bản sao database và thực hiện thay đổi
+            
+        Returns:
+            Giá trị trả về của update
+        """
+        with self._write_lock, lock_directory(self.database_dir):
+            self._refresh_database()
+            database = self.database.copy()
+            try:
+                result = update(database)
+                database.commit(self.database_dir)
+            except BaseException:
+                # Bản sao không được dùng: gỡ các vectors nó đã thêm vào index dùng chung
+                database.discard()
+                raise
+            self._db_version = directory_version(self.database_dir)
+            self.database = database
+        return result
+        
+    def reload_database(self):
+        """
+        Tải lại cơ sở dữ liệu nếu tiến trình khác đã ghi thay đổi vào database_dir
+        
+        Chỉ stat hai file khi không có thay đổi nên có thể gọi định kỳ. Database mới
+        được tải đầy đủ rồi mới thay thế tham chiếu self.database, các request đang
+        chạy tiếp tục dùng database cũ.
+        
+        Returns:
+            True nếu database đã được tải lại
+        """
+        if directory_version(self.database_dir) == self._db_version:
+            return False
+        with self._write_lock, lock_directory(self.database_dir):
+            return self._refresh_database()
+            
+    def _refresh_database(self):
+        """Tải lại database nếu thư mục đã thay đổi (gọi khi đang giữ khóa ghi và khóa thư mục)"""
+        version = directory_version(self.database_dir)
+        if version == self._db_version:
+            return False
+        database = SpeakerDatabase.load(self.database_dir) if version is not None else None
+        self.database = database or SpeakerDatabase()
+        self._db_version = version
         return True
         
+    def after_fork(self):
+        """
+        Khởi tạo lại khóa ghi trong tiến trình con sau fork
+        Khóa có thể đang bị giữ bởi một luồng của tiến trình cha, luồng này không tồn tại
+        trong tiến trình con nên khóa sẽ không bao giờ được nhả
+        """
+        self._write_lock = threading.Lock()
+        
     def list_speakers(self):
         """Liệt kê danh sách người nói trong cơ sở dữ liệu"""
         # Đảm bảo database đã được khởi tạo
@@ -235,20 +529,40 @@ class SpeakerRecognitionApp:
         # Xóa người nói khỏi database
         print(f"Đang xóa người nói '{speaker_name}' khỏi cơ sở dữ liệu...")
         
-        # Xóa embeddings của người nói này
-        del self.database.embeddings[speaker_name]
-        
-        # Cập nhật danh sách tên
-        self.database.names = [name for name in self.database.names if name != speaker_name]
+        # Xóa embeddings, tên và các id tương ứng trong index của người nói này
+        if not self._update_database(lambda database: database.remove_speaker(speaker_name)):
+            print(f"Không tìm thấy người nói '{speaker_name}' trong cơ sở dữ liệu")
+            return False
         
-        # Xây dựng lại mapping và index từ đầu
-        self.database.embedding_to_name = []
-        self.database.build_index()
+        print(f"Đã xóa người nói '{speaker_name}' khỏi cơ sở dữ liệu")
+        return True
         
-        # Lưu cơ sở dữ liệu
-        self.database.save(self.database_dir)
+    def rebuild_index(self, index_type="auto"):
+        """
+        Xây dựng lại Faiss index với loại index mới
         
-        print(f"Đã xóa người nói '{speaker_name}' khỏi cơ sở dữ liệu")
+        Args:
+            index_type: "flat", "ivf_flat", "hnsw", "ivf_pq" hoặc "auto" (chọn theo số lượng vectors)
+            
+        Returns:
+            Thành công hay không
+        """
+        # Đảm bảo database đã được khởi tạo
+        if self.database is None:
+            self.initialize()
+            
+        if self.database.ntotal == 0:
+            print("Cơ sở dữ liệu trống")
+            return False
+            
+        with self._write_lock, lock_directory(self.database_dir):
+            self._refresh_database()
+            database = self.database.copy()
+            database.index_type = index_type
+            database.build_index()
+            database.save(self.database_dir)
+            self._db_version = directory_version(self.database_dir)
+            self.database = database
         return True
         
 def main():
@@ -261,10 +575,11 @@ def main():
     # Subcommand "prepare"
     prepare_parser = subparsers.add_parser("prepare", help="Chuẩn bị cơ sở dữ liệu")
     prepare_parser.add_argument("--dir", default="audio/speakers", help="Thư mục chứa file âm thanh")
+    prepare_parser.add_argument("--full", action="store_true", help="Xây dựng lại toàn bộ thay vì chỉ cập nhật file thay đổi")
     
     # Subcommand "identify"
     identify_parser = subparsers.add_parser("identify", help="Nhận dạng người nói")
-    identify_parser.add_argument("file", help="Đường dẫn đến file âm thanh")
+    identify_parser.add_argument("files", nargs="+", help="Đường dẫn đến các file âm thanh")
     identify_parser.add_argument("--threshold", type=float, default=0.6, 
                                 help="Ngưỡng độ tương đồng tối thiểu (cosine) để xác định là cùng người nói")
     
@@ -285,6 +600,11 @@ def main():
     remove_parser = subparsers.add_parser("remove", help="Xóa người nói khỏi cơ sở dữ liệu")
     remove_parser.add_argument("name", help="Tên người nói cần xóa")
     
+    # Subcommand "reindex"
+    reindex_parser = subparsers.add_parser("reindex", help="Xây dựng lại Faiss index với loại index khác")
+    reindex_parser.add_argument("--index-type", default="auto", choices=["auto", *INDEX_TYPES],
+                                help="Loại index (auto: chọn theo số lượng vectors)")
+    
     # Subcommand "check"
     check_parser = subparsers.add_parser("check", help="Kiểm tra độ tương đồng giữa hai file âm thanh")
     check_parser.add_argument("file1", help="Đường dẫn đến file âm thanh thứ nhất")
@@ -298,19 +618,24 @@ def main():
     
     # Xử lý các lệnh
     if args.command == "prepare":
-        app.prepare_database(args.dir)
+        app.prepare_database(args.dir, full=args.full)
         
     elif args.command == "identify":
         app.threshold = args.threshold
         app.initialize()
-        name, similarity, is_known = app.identify_file(args.file)
-        
-        if name is None:
-            print("Không thể nhận dạng người nói")
-        elif is_known:
-            print(f"Người nói được nhận dạng: {name} (độ tương đồng: {similarity:.4f})")
+        if len(args.files) == 1:
+            results = [app.identify_file(args.files[0])]
         else:
-            print(f"Người nói không xác định. Gần nhất: {name} (độ tương đồng: {similarity:.4f}, thấp hơn ngưỡng {args.threshold})")
+            results = app.identify_files(args.files)
+        
+        for audio_file, (name, similarity, is_known) in zip(args.files, results):
+            prefix = f"{audio_file}: " if len(args.files) > 1 else ""
+            if name is None:
+                print(f"{prefix}Không thể nhận dạng người nói")
+            elif is_known:
+                print(f"{prefix}Người nói được nhận dạng: {name} (độ tương đồng: {similarity:.4f})")
+            else:
+                print(f"{prefix}Người nói không xác định. Gần nhất: {name} (độ tương đồng: {similarity:.4f}, thấp hơn ngưỡng {args.threshold})")
             
     elif args.command == "add":
         app.add_speaker(args.files, args.name)
@@ -327,6 +652,9 @@ def main():
     elif args.command == "remove":
         app.remove_speaker(args.name)
         
+    elif args.command == "reindex":
+        app.rebuild_index(args.index_type)
+        
     elif args.command == "check":
         app.initialize()
         
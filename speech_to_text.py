@@ -2,53 +2,202 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
 import tempfile
 import speech_recognition as sr
 import pyaudio
 import wave
 import numpy as np
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from voice_activity import split_on_silence
+
+# Tần số lấy mẫu dùng khi chia âm thanh dài theo khoảng lặng
+LONG_FORM_SAMPLE_RATE = 16000
+# Âm thanh (giây) được giữ thêm ở hai đầu mỗi đoạn để không mất âm đầu/cuối của từ
+CHUNK_PADDING = 0.2
+
+class GoogleRecognizer:
+    """Backend gọi Google Web Speech API qua speech_recognition"""
+    
+    def __init__(self):
+        self.recognizer = sr.Recognizer()
+        
+    def recognize(self, audio_data, language):
+        """
+        Nhận dạng văn bản của một đoạn âm thanh
+        
+        Args:
+            audio_data: sr.AudioData
+            language: Mã ngôn ngữ
+            
+        Returns:
+            Văn bản (ném sr.UnknownValueError nếu không nhận dạng được, sr.RequestError nếu lỗi kết nối)
+        """
+        return self.recognizer.recognize_google(audio_data, language=language)
+        
+class LocalRecognizer:
+    """
+    Backend chạy cục bộ không cần mạng, dùng thay Google khi kiểm thử
+    Trả về độ dài đoạn âm thanh thay cho văn bản; delay mô phỏng thời gian chờ dịch vụ
+    """
+    
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        
+    def recognize(self, audio_data, language):
+        if self.delay:
+            time.sleep(self.delay)
+        duration = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+        return f"[{duration:.2f}s]"
+        
+# Các backend nhận dạng theo tên
+RECOGNIZER_BACKENDS = {
+    "google": GoogleRecognizer,
+    "local": LocalRecognizer
+}
 
 class SpeechToText:
     """
     Lớp xử lý chuyển đổi âm thanh thành văn bản
     """
     
-    def __init__(self, language="vi-VN"):
+    def __init__(self, language="vi-VN", backend="google", chunk_seconds=15.0, workers=4):
         """
         Khởi tạo với ngôn ngữ cụ thể
         
         Args:
             language: Mã ngôn ngữ (mặc định: tiếng Việt)
+            backend: Tên backend trong RECOGNIZER_BACKENDS hoặc đối tượng có phương thức
+                     recognize(audio_data, language)
+            chunk_seconds: Âm thanh dài hơn được chia theo khoảng lặng thành các đoạn không
+                           dài quá giá trị này và nhận dạng song song
+            workers: Số đoạn được gửi nhận dạng đồng thời
         """
         self.language = language
         self.recognizer = sr.Recognizer()
+        self.backend = RECOGNIZER_BACKENDS[backend]() if isinstance(backend, str) else backend
+        self.chunk_seconds = chunk_seconds
+        self.workers = workers
         
-    def recognize_from_file(self, audio_file):
+    def recognize_from_file(self, audio_file, long_form=None):
         """
         Nhận dạng văn bản từ file âm thanh
         
         Args:
-            audio_file: Đường dẫn tới file âm thanh
+            audio_file: Đường dẫn tới file âm thanh hoặc file-like object (WAV/AIFF/FLAC)
+            long_form: True để chia theo khoảng lặng và nhận dạng song song, False để gửi
+                       cả file trong một yêu cầu, None để tự chọn theo độ dài
             
         Returns:
-            Tuple (văn bản nhận dạng, trạng thái thành công)
+            Dictionary kết quả gồm success, message và data (chứa transcription; với
+            long form transcription có thêm segments gồm start, end, text của từng đoạn)
         """
         try:
             with sr.AudioFile(audio_file) as source:
                 audio_data = self.recognizer.record(source)
-                text = self.recognizer.recognize_google(audio_data, language=self.language)
-                return {
-                    "success": True,
-                    "message": "Nhận dạng văn bản thành công",
-                    "data": {
-                        "transcription": {
-                            "text": text,
-                            "language": self.language,
-                            "confidence": "high"
-                        }
+        except Exception as e:
+            return {
+                "success": False,
+                "message": f"Lỗi: {e}",
+                "data": None
+            }
+        return self._recognize_audio(audio_data, long_form)
+        
+    def recognize_signal(self, signal, sample_rate=16000, long_form=None):
+        """
+        Nhận dạng văn bản từ tín hiệu đã giải mã (không đọc lại file)
+        
+        Args:
+            signal: Mảng numpy hoặc tensor 1 chiều (mono, giá trị trong [-1, 1])
+            sample_rate: Tần số lấy mẫu của tín hiệu
+            long_form: Như recognize_from_file
+            
+        Returns:
+            Dictionary kết quả như recognize_from_file
+        """
+        samples = np.clip(np.asarray(signal, dtype=np.float32), -1.0, 1.0)
+        pcm = (samples * 32767).astype("<i2").tobytes()
+        return self._recognize_audio(sr.AudioData(pcm, sample_rate, 2), long_form)
+        
+    def _recognize_audio(self, audio_data, long_form=None):
+        """Nhận dạng cả đoạn âm thanh trong một yêu cầu hoặc theo từng đoạn nếu âm thanh dài"""
+        duration = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+        if long_form is None:
+            long_form = duration > self.chunk_seconds
+        if long_form:
+            return self._recognize_long(audio_data)
+        return self._recognize(audio_data)
+        
+    def _recognize_long(self, audio_data):
+        """
+        Chia âm thanh theo khoảng lặng, nhận dạng các đoạn song song rồi ghép kết quả
+        theo thứ tự thời gian (đoạn không có tiếng nói được bỏ qua)
+        """
+        rate = LONG_FORM_SAMPLE_RATE
+        samples = np.frombuffer(audio_data.get_raw_data(convert_rate=rate, convert_width=2), dtype="<i2")
+        chunks = split_on_silence(samples, rate, max_chunk=self.chunk_seconds)
+        if not chunks:
+            return {
+                "success": False,
+                "message": "Không phát hiện tiếng nói trong âm thanh",
+                "data": None
+            }
+            
+        pad = int(CHUNK_PADDING * rate)
+        
+        def recognize_chunk(chunk):
+            start, end = chunk
+            data = samples[max(0, int(start * rate) - pad):min(len(samples), int(end * rate) + pad)]
+            segment = {"start": round(start, 2), "end": round(end, 2), "text": ""}
+            try:
+                segment["text"] = self.backend.recognize(sr.AudioData(data.tobytes(), rate, 2), self.language)
+            except sr.UnknownValueError:
+                pass
+            except sr.RequestError as e:
+                segment["error"] = f"Lỗi kết nối đến dịch vụ nhận dạng: {e}"
+            except Exception as e:
+                segment["error"] = f"Lỗi: {e}"
+            return segment
+            
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(chunks)))) as pool:
+            segments = [segment for segment in pool.map(recognize_chunk, chunks) if segment["text"] or "error" in segment]
+            
+        failed = [segment for segment in segments if "error" in segment]
+        if len(failed) == len(segments):
+            return {
+                "success": False,
+                "message": failed[0]["error"] if failed else "Không thể nhận dạng văn bản từ âm thanh",
+                "data": None
+            }
+        return {
+            "success": True,
+            "message": "Nhận dạng văn bản thành công" + (f" ({len(failed)} đoạn bị lỗi)" if failed else ""),
+            "data": {
+                "transcription": {
+                    "text": " ".join(segment["text"] for segment in segments if segment["text"]),
+                    "language": self.language,
+                    "confidence": "high",
+                    "segments": segments
+                }
+            }
+        }
+        
+    def _recognize(self, audio_data):
+        """Gửi âm thanh đến backend nhận dạng và đóng gói kết quả"""
+        try:
+            text = self.backend.recognize(audio_data, self.language)
+            return {
+                "success": True,
+                "message": "Nhận dạng văn bản thành công",
+                "data": {
+                    "transcription": {
+                        "text": text,
+                        "language": self.language,
+                        "confidence": "high"
                     }
                 }
+            }
         except sr.UnknownValueError:
             return {
                 "success": False,
@@ -162,19 +311,40 @@ class SpeechToText:
 
 # Test function
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Chuyển âm thanh thành văn bản")
+    parser.add_argument("file", nargs="?", help="File âm thanh (WAV/AIFF/FLAC), bỏ trống để ghi âm 5 giây")
+    parser.add_argument("--language", default="vi-VN", help="Mã ngôn ngữ")
+    parser.add_argument("--backend", default="google", choices=list(RECOGNIZER_BACKENDS), help="Backend nhận dạng")
+    parser.add_argument("--workers", type=int, default=4, help="Số đoạn được nhận dạng đồng thời với file dài")
+    parser.add_argument("--chunk-seconds", type=float, default=15.0, help="Độ dài tối đa của mỗi đoạn (giây)")
+    args = parser.parse_args()
+    
     # Khởi tạo
-    stt = SpeechToText(language="vi-VN")
+    stt = SpeechToText(language=args.language, backend=args.backend, chunk_seconds=args.chunk_seconds,
+                       workers=args.workers)
     
-    # Ghi âm và nhận dạng
-    result, temp_file = stt.record_and_recognize(record_seconds=5)
+    temp_file = None
+    started = time.perf_counter()
+    if args.file:
+        result = stt.recognize_from_file(args.file)
+    else:
+        # Ghi âm và nhận dạng
+        result, temp_file = stt.record_and_recognize(record_seconds=5)
     
     if result["success"]:
-        print(f"Kết quả nhận dạng: {result['data']['transcription']['text']}")
+        transcription = result["data"]["transcription"]
+        for segment in transcription.get("segments", []):
+            print(f"[{segment['start']:8.2f} - {segment['end']:8.2f}] {segment['text'] or segment.get('error', '')}")
+        print(f"Kết quả nhận dạng: {transcription['text']}")
     else:
         print(f"Lỗi: {result['message']}")
+    print(f"Thời gian: {time.perf_counter() - started:.2f} giây")
         
     # Xóa file tạm
-    try:
-        os.remove(temp_file)
-    except:
-        pass 
\ No newline at end of file
+    if temp_file:
+        try:
+            os.remove(temp_file)
+        except:
+            pass 
\ No newline at end of file
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import numpy as np
+import torch
+
+# Định dạng mẫu PCM được hỗ trợ -> (dtype, hệ số chuẩn hóa về [-1, 1])
+PCM_FORMATS = {
+    "int16": (np.int16, 1.0 / 32768),
+    "float32": (np.float32, 1.0),
+}
+
+def decode_pcm(data, sample_format="int16"):
+    """
+    Chuyển dữ liệu PCM mono (little-endian) thành mảng float32
+
+    Args:
+        data: Bytes chứa các mẫu PCM
+        sample_format: "int16" hoặc "float32"
+
+    Returns:
+        Mảng numpy float32
+    """
+    dtype, scale = PCM_FORMATS[sample_format]
+    samples = np.frombuffer(data, dtype=np.dtype(dtype).newbyteorder("<"))
+    return samples.astype(np.float32) * scale
+
+class PcmDecoder:
+    """
+    Giải mã luồng PCM theo từng message
+    Message có thể bị cắt giữa một mẫu (số byte không chia hết cho kích thước mẫu),
+    các byte lẻ được giữ lại và ghép vào đầu message tiếp theo
+    """
+
+    def __init__(self, sample_format="int16"):
+        """
+        Args:
+            sample_format: "int16" hoặc "float32"
+        """
+        if sample_format not in PCM_FORMATS:
+            raise ValueError(f"Định dạng PCM không hỗ trợ: {sample_format}")
+        self.sample_format = sample_format
+        self.sample_width = np.dtype(PCM_FORMATS[sample_format][0]).itemsize
+        self._rest = b""
+
+    def decode(self, data):
+        """
+        Giải mã một message
+
+        Args:
+            data: Bytes chứa các mẫu PCM (có thể không trọn mẫu)
+
+        Returns:
+            Mảng numpy float32 các mẫu trọn vẹn đã nhận
+        """
+        if self._rest:
+            data = self._rest + data
+        usable = len(data) - len(data) % self.sample_width
+        self._rest = bytes(data[usable:])
+        return decode_pcm(data[:usable], self.sample_format)
+
+class StreamingIdentifier:
+    """
+    Nhận dạng người nói trên luồng âm thanh 16kHz đến liên tục
+    Giữ cửa sổ trượt gồm các mẫu gần nhất và cứ sau mỗi bước hop lại
+    trích xuất embedding của cửa sổ để tìm người nói gần nhất
+    """
+
+    def __init__(self, app, window=3.0, hop=0.5, min_duration=1.0, threshold=None, top_k=5):
+        """
+        Khởi tạo bộ nhận dạng luồng
+
+        Args:
+            app: Đối tượng SpeakerRecognitionApp đã khởi tạo
+            window: Độ dài cửa sổ (giây) dùng để trích xuất embedding
+            hop: Khoảng thời gian (giây) giữa hai lần nhận dạng
+            min_duration: Thời lượng âm thanh tối thiểu (giây) trước lần nhận dạng đầu tiên
+            threshold: Ngưỡng độ tương đồng (None để dùng ngưỡng của app)
+            top_k: Số kết quả gần nhất được xét
+        """
+        if not (0 < window < np.inf and 0 < hop < np.inf):
+            raise ValueError("window và hop phải là số dương hữu hạn")
+        self.app = app
+        self.sample_rate = app.embedder.sample_rate
+        self.window_samples = max(1, int(window * self.sample_rate))
+        self.hop_samples = max(1, int(hop * self.sample_rate))
+        self.threshold = app.threshold if threshold is None else threshold
+        self.top_k = top_k
+
+        self._buffer = np.zeros(0, dtype=np.float32)  # Tối đa window_samples mẫu gần nhất
+        self._total = 0                                # Tổng số mẫu đã nhận
+        self._next_emit = min(int(min_duration * self.sample_rate), self.window_samples)
+
+    def feed(self, samples):
+        """
+        Đưa thêm mẫu âm thanh vào luồng
+
+        Nếu một lần đưa vượt qua nhiều mốc hop, chỉ cửa sổ mới nhất được nhận dạng
+        để không bị chậm dần so với thời gian thực.
+
+        Args:
+            samples: Mảng float32 mono 16kHz
+
+        Returns:
+            List kết quả (rỗng nếu chưa đến mốc nhận dạng tiếp theo)
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        if len(samples) == 0:
+            return []
+
+        self._buffer = np.concatenate([self._buffer, samples])[-self.window_samples:]
+        self._total += len(samples)
+        if self._total < self._next_emit:
+            return []
+
+        # Mốc tiếp theo là mốc hop đầu tiên sau vị trí hiện tại
+        skipped = (self._total - self._next_emit) // self.hop_samples
+        self._next_emit += (skipped + 1) * self.hop_samples
+        return [self._identify()]
+
+    def _identify(self):
+        """Nhận dạng người nói trên cửa sổ hiện tại"""
+        started = time.perf_counter()
+        embedding = self.app.embed_signal(torch.from_numpy(self._buffer.copy()))
+
+        database = self.app.database
+        if database is None or database.ntotal == 0:
+            name, similarity, is_known = None, 0.0, False
+        else:
+            name, similarity, is_known = database.identify_speaker(embedding, self.threshold, self.top_k)
+
+        return {
+            "start": (self._total - len(self._buffer)) / self.sample_rate,
+            "end": self._total / self.sample_rate,
+            "speaker_name": name,
+            "similarity": float(similarity),
+            "is_known": bool(is_known),
+            "threshold": self.threshold,
+            "latency_ms": (time.perf_counter() - started) * 1000
+        }
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from background_jobs import JobManager
+
+def write_job(state_dir, job_id, finished_at, pid, age):
+    path = os.path.join(state_dir, f"{job_id}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"id": job_id, "status": "succeeded", "finished_at": finished_at, "pid": pid}, f)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+def test_prune_removes_files_left_by_other_workers(tmp_path):
+    state_dir = str(tmp_path)
+    # Tác vụ của các worker đã dừng: đã kết thúc, hoặc chưa kết thúc nhưng tiến trình đã chết
+    write_job(state_dir, "a1", time.time(), 999999999, age=300)
+    write_job(state_dir, "a2", None, 999999999, age=200)
+    # Tác vụ đang chạy ở tiến trình còn sống được giữ lại dù cũ
+    write_job(state_dir, "a3", None, os.getpid(), age=400)
+
+    manager = JobManager(max_finished=1, state_dir=state_dir)
+    job_id = manager.submit("test", lambda progress: {"ok": True})
+    manager.shutdown()
+
+    assert manager.get(job_id)["status"] == "succeeded"
+    assert sorted(os.listdir(state_dir)) == ["a3.json", f"{job_id}.json"]
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_diarization import list_audio_files, output_name
+
+def test_output_names_are_unique(tmp_path):
+    for rel_path in ["dir/x.wav", "dir/x.flac", "a/b.wav", "a__b.wav", "a_/b.wav", "a/_b.wav"]:
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+    keys = [key for key, _ in list_audio_files(str(tmp_path))]
+    names = [output_name(key) for key in keys]
+    assert len(keys) == 6 and len(set(names)) == 6
+    assert all(os.sep not in name and "/" not in name for name in names)
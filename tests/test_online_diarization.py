@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from online_diarization import OnlineDiarizer
+
+class RecordingEmbedder:
+    """Embedder giả: ghi lại độ dài các tín hiệu được embed"""
+
+    sample_rate = 16000
+
+    def __init__(self):
+        self.lengths = []
+
+    def embed_signals(self, signals, batch_size=None, use_cache=True):
+        self.lengths.extend(int(signal.shape[-1]) for signal in signals)
+        return np.ones((len(signals), 8), dtype=np.float32)
+
+def test_large_chunk_embeds_full_windows():
+    embedder = RecordingEmbedder()
+    diarizer = OnlineDiarizer(embedder, window=1.5, hop=0.75, max_windows=8, min_speech_ratio=0.0)
+    rng = np.random.default_rng(0)
+
+    # Một lần feed dài hơn max_windows cửa sổ, vị trí hiện tại nằm sau mốc cuối cùng
+    results = diarizer.feed(rng.normal(scale=0.1, size=int(7.03 * 16000)).astype(np.float32))
+
+    assert len(results) == 8
+    assert embedder.lengths == [diarizer.window_samples] * 8
+    assert all(result["speaker"] == "SPEAKER_00" for result in results)
+
+    # Lần feed rất dài: các cửa sổ cũ bị bỏ, các cửa sổ còn lại vẫn đủ độ dài
+    results = diarizer.feed(rng.normal(scale=0.1, size=int(20.3 * 16000)).astype(np.float32))
+    assert len(results) == 8
+    assert diarizer.skipped > 0
+    assert embedder.lengths == [diarizer.window_samples] * 16
+
+def test_chunked_feed_matches_window_count():
+    embedder = RecordingEmbedder()
+    diarizer = OnlineDiarizer(embedder, window=1.5, hop=0.75, min_speech_ratio=0.0)
+    signal = np.zeros(16000 * 10, dtype=np.float32)
+    for start in range(0, len(signal), 3000):
+        diarizer.feed(signal[start:start + 3000])
+
+    assert diarizer.windows == 12
+    assert diarizer.skipped == 0
+    assert set(embedder.lengths) == {diarizer.window_samples}
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import speaker_database
+from speaker_database import SpeakerDatabase, WAL_FILENAME
+
+def random_vectors(count, seed, dimension=16):
+    vectors = np.random.default_rng(seed).normal(size=(count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def make_database(index_type="flat"):
+    database = SpeakerDatabase(index_type=index_type)
+    database.add_batch("A", random_vectors(4, 0), ["a.wav"] * 4)
+    return database
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+@pytest.mark.parametrize("discard", [True, False])
+def test_discarded_copy_ids_are_not_reused(index_type, discard):
+    database = make_database(index_type)
+
+    # Bản sao bị bỏ (ví dụ commit lỗi) sau khi đã thêm vào index dùng chung
+    orphan = random_vectors(1, 1)
+    failed = database.copy()
+    failed.add_batch("X", orphan, ["x.wav"])
+    if discard:
+        failed.discard()
+
+    current = database.copy()
+    current.add_batch("B", random_vectors(1, 2), ["b.wav"])
+
+    assert current.identify_speakers(orphan, threshold=0.99, top_k=1)[0][2] is False
+    names, similarities = current.search(orphan[0], top_k=5)
+    assert len(names) == 5 and "X" not in names
+    assert max(similarities) < 0.99
+    if index_type == "flat" and discard:
+        assert current.index.ntotal == current.ntotal
+
+def test_copy_does_not_change_published_snapshot():
+    database = make_database()
+    query = random_vectors(1, 3)
+    before = database.identify_speakers(query, top_k=4)
+
+    updated = database.copy()
+    updated.add_batch("B", np.repeat(query, 3, axis=0), ["b.wav"] * 3)
+
+    assert database.ntotal == 4 and database.names == ["A"]
+    assert database.get_sources() == {"a.wav"}
+    assert database.identify_speakers(query, top_k=4) == before
+    assert updated.identify_speakers(query, top_k=4)[0][0] == "B"
+    assert updated.get_sources() == {"a.wav", "b.wav"}
+
+    # Bản sao tạo từ snapshot cũ không ghi đè các hàng của bản sao mới hơn
+    stale = database.copy()
+    stale.add_batch("C", random_vectors(2, 4), ["c.wav"] * 2)
+    assert updated.identify_speakers(query, top_k=4)[0][0] == "B"
+    assert list(updated.speaker_ids[-3:]) == [updated.names.index("B")] * 3
+    assert set(stale.ids) & set(updated.ids[4:]) == set()
+
+def test_remove_on_copy_keeps_original():
+    database = make_database()
+    database.add_batch("B", random_vectors(2, 5), ["b.wav"] * 2)
+
+    updated = database.copy()
+    updated.remove_speaker("A")
+
+    assert database.names == ["A", "B"] and database.ntotal == 6
+    assert updated.names == ["B"] and updated.ntotal == 2
+    assert database.identify_speakers(database.get_speaker_embeddings("A"), top_k=1)[0][0] == "A"
+
+def assert_same_database(loaded, database, query):
+    assert loaded.names == database.names and loaded.next_id == database.next_id
+    assert np.array_equal(loaded.ids, database.ids)
+    assert np.array_equal(loaded.vectors, database.vectors)
+    assert loaded.get_sources() == database.get_sources()
+    assert loaded.identify_speakers(query, top_k=4) == database.identify_speakers(query, top_k=4)
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_load_replays_log_after_snapshot(tmp_path, index_type):
+    directory = str(tmp_path)
+    database = make_database(index_type)
+    database.save(directory)
+
+    # Các thay đổi sau snapshot chỉ nằm trong wal.log
+    database.add_batch("B", random_vectors(3, 6), ["b.wav"] * 3)
+    database.remove_source("a.wav")
+    database.add_batch("C", random_vectors(2, 7), ["c.wav"] * 2)
+    database.remove_speaker("C")
+    database.commit(directory)
+    assert os.path.getsize(os.path.join(directory, WAL_FILENAME)) > 0
+
+    loaded = SpeakerDatabase.load(directory)
+    assert loaded.names == ["B"]
+    assert_same_database(loaded, database, random_vectors(3, 8))
+
+def test_load_ignores_torn_log_tail(tmp_path):
+    directory = str(tmp_path)
+    database = make_database()
+    database.save(directory)
+    database.add_batch("B", random_vectors(2, 9), ["b.wav"] * 2)
+
+    # Tiến trình dừng khi đang ghi bản ghi tiếp theo
+    with open(os.path.join(directory, WAL_FILENAME), 'ab') as f:
+        f.write(b"\x09\x00\x00\x00garbage")
+
+    loaded = SpeakerDatabase.load(directory)
+    assert_same_database(loaded, database, random_vectors(2, 10))
+
+    # Các thao tác sau khi khôi phục được ghi tiếp và đọc lại được
+    loaded.add_batch("C", random_vectors(1, 11), ["c.wav"])
+    reloaded = SpeakerDatabase.load(directory)
+    assert reloaded.names == ["A", "B", "C"]
+    assert_same_database(reloaded, loaded, random_vectors(2, 12))
+
+def test_crash_during_snapshot_keeps_previous_state(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    database = make_database()
+    database.save(directory)
+    database.add_batch("B", random_vectors(2, 13), ["b.wav"] * 2)
+
+    # Dừng sau khi đã ghi các file của snapshot mới nhưng trước khi metadata.json trỏ tới chúng
+    atomic_write_json = speaker_database._atomic_write_json
+    def crash(path, data):
+        if os.path.basename(path) == "metadata.json":
+            raise OSError("crash")
+        atomic_write_json(path, data)
+    monkeypatch.setattr(speaker_database, "_atomic_write_json", crash)
+    with pytest.raises(OSError):
+        database.save(directory)
+    monkeypatch.undo()
+
+    loaded = SpeakerDatabase.load(directory)
+    assert_same_database(loaded, database, random_vectors(2, 14))
+
+def test_copy_of_loaded_database(tmp_path):
+    directory = str(tmp_path)
+    make_database().save(directory)
+    database = SpeakerDatabase.load(directory)
+    query = random_vectors(1, 15)
+
+    updated = database.copy()
+    updated.add_batch("B", np.repeat(query, 2, axis=0), ["b.wav"] * 2)
+    updated.commit(directory)
+
+    assert database.names == ["A"] and database.ntotal == 4
+    assert database.identify_speakers(query, top_k=1)[0][0] == "A"
+    assert_same_database(SpeakerDatabase.load(directory), updated, query)
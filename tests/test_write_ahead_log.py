@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from write_ahead_log import WriteAheadLog
+
+def test_torn_tail_record_is_dropped(tmp_path):
+    path = str(tmp_path / "wal.log")
+    wal = WriteAheadLog(path, sync=False)
+    wal.append({"op": "add", "name": "A"}, b"\x01\x02")
+    wal.append({"op": "remove_speaker", "name": "B"})
+    wal.close()
+    valid_size = os.path.getsize(path)
+
+    # Tiến trình dừng khi đang ghi bản ghi thứ ba
+    with open(path, 'ab') as f:
+        f.write(b"\x03\x00\x00\x00\x00\x00\x00\x00\x40\x00\x00\x00torn")
+
+    wal = WriteAheadLog(path, sync=False)
+    records = wal.replay()
+    assert [(seq, record["name"], data) for seq, record, data in records] == [(1, "A", b"\x01\x02"), (2, "B", b"")]
+    assert os.path.getsize(path) == valid_size
+
+    # Bản ghi mới tiếp tục số thứ tự và đọc lại được
+    assert wal.append({"op": "remove_source", "source": "a.wav"}) == 3
+    wal.close()
+    assert [seq for seq, _, _ in WriteAheadLog(path).replay(after_seq=1)] == [2, 3]
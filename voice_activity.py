@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import webrtcvad
+
+# Tần số lấy mẫu và độ dài frame (ms) mà webrtcvad hỗ trợ
+VAD_SAMPLE_RATES = (8000, 16000, 32000, 48000)
+VAD_FRAME_MS = (10, 20, 30)
+
+def to_pcm16(samples):
+    """
+    Chuyển tín hiệu float trong [-1, 1] (hoặc int16) thành mảng int16
+
+    Args:
+        samples: Mảng numpy hoặc tensor 1 chiều
+
+    Returns:
+        Mảng numpy int16
+    """
+    samples = np.asarray(samples)
+    if samples.dtype == np.int16:
+        return samples
+    return (np.clip(samples.astype(np.float32), -1.0, 1.0) * 32767).astype(np.int16)
+
+def speech_frames(samples, sample_rate=16000, aggressiveness=2, frame_ms=30):
+    """
+    Phân loại từng frame là tiếng nói hay không bằng webrtcvad
+
+    Args:
+        samples: Tín hiệu mono (float trong [-1, 1] hoặc int16)
+        sample_rate: 8000, 16000, 32000 hoặc 48000
+        aggressiveness: Mức loại bỏ không phải tiếng nói của webrtcvad (0-3)
+        frame_ms: Độ dài frame (10, 20 hoặc 30 ms)
+
+    Returns:
+        Mảng bool, mỗi phần tử ứng với một frame (phần dư cuối tín hiệu bị bỏ)
+    """
+    if sample_rate not in VAD_SAMPLE_RATES or frame_ms not in VAD_FRAME_MS:
+        raise ValueError(f"webrtcvad không hỗ trợ {sample_rate}Hz / frame {frame_ms}ms")
+    pcm = to_pcm16(samples)
+    frame_len = sample_rate * frame_ms // 1000
+    vad = webrtcvad.Vad(aggressiveness)
+    data = pcm.astype("<i2").tobytes()
+    frame_bytes = frame_len * 2
+    return np.array([vad.is_speech(data[i * frame_bytes:(i + 1) * frame_bytes], sample_rate)
+                     for i in range(len(pcm) // frame_len)], dtype=bool)
+
+def _speech_runs(flags, min_silence_frames, min_speech_frames):
+    """Các đoạn tiếng nói (frame đầu, frame cuối) sau khi lấp khoảng lặng ngắn và bỏ đoạn nói quá ngắn"""
+    flags = flags.copy()
+    for value, min_frames in ((False, min_silence_frames), (True, min_speech_frames)):
+        change = np.flatnonzero(np.diff(flags.astype(np.int8))) + 1
+        bounds = np.concatenate([[0], change, [len(flags)]])
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            # Khoảng lặng ở hai đầu tín hiệu được giữ nguyên
+            inner = value or (start > 0 and end < len(flags))
+            if flags[start] == value and inner and end - start < min_frames:
+                flags[start:end] = not value
+    change = np.flatnonzero(np.diff(flags.astype(np.int8))) + 1
+    bounds = np.concatenate([[0], change, [len(flags)]])
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if flags[start]]
+
+def speech_regions(samples, sample_rate=16000, aggressiveness=2, frame_ms=30, min_silence=0.3, min_speech=0.25):
+    """
+    Tìm các đoạn có tiếng nói
+
+    Args:
+        samples: Tín hiệu mono (float trong [-1, 1] hoặc int16)
+        sample_rate: Tần số lấy mẫu (xem VAD_SAMPLE_RATES)
+        aggressiveness: Mức loại bỏ không phải tiếng nói của webrtcvad (0-3)
+        frame_ms: Độ dài frame VAD (ms)
+        min_silence: Khoảng lặng ngắn hơn (giây) được coi là một phần của đoạn nói
+        min_speech: Đoạn nói ngắn hơn (giây) bị bỏ
+
+    Returns:
+        List các tuple (bắt đầu, kết thúc) tính bằng giây
+    """
+    flags = speech_frames(samples, sample_rate, aggressiveness, frame_ms)
+    frame_s = frame_ms / 1000
+    runs = _speech_runs(flags, int(round(min_silence / frame_s)), int(round(min_speech / frame_s)))
+    return [(start * frame_s, end * frame_s) for start, end in runs]
+
+def split_on_silence(samples, sample_rate=16000, max_chunk=15.0, aggressiveness=2, frame_ms=30, min_silence=0.3,
+                     min_speech=0.25):
+    """
+    Chia tín hiệu dài thành các đoạn tiếng nói không dài quá max_chunk, cắt tại khoảng lặng
+
+    Các đoạn nói liền nhau được gộp miễn là không vượt quá max_chunk, khoảng lặng dài
+    giữa các đoạn bị bỏ. Đoạn nói liên tục dài hơn max_chunk được cắt tại frame có năng
+    lượng thấp nhất trong nửa sau của cửa sổ cho phép.
+
+    Args:
+        samples: Tín hiệu mono (float trong [-1, 1] hoặc int16)
+        sample_rate: Tần số lấy mẫu (xem VAD_SAMPLE_RATES)
+        max_chunk: Độ dài tối đa của một đoạn (giây)
+        aggressiveness, frame_ms, min_silence, min_speech: Như speech_regions
+
+    Returns:
+        List các tuple (bắt đầu, kết thúc) tính bằng giây, theo thứ tự thời gian
+    """
+    pcm = to_pcm16(samples)
+    flags = speech_frames(pcm, sample_rate, aggressiveness, frame_ms)
+    frame_s = frame_ms / 1000
+    frame_len = sample_rate * frame_ms // 1000
+    frames = pcm[:len(flags) * frame_len].astype(np.float32).reshape(-1, frame_len)
+    energy = (frames ** 2).mean(axis=1)
+    max_frames = max(2, int(max_chunk / frame_s))
+
+    chunks = []
+    for start, end in _speech_runs(flags, int(round(min_silence / frame_s)), int(round(min_speech / frame_s))):
+        while end - start > max_frames:
+            lo = start + max_frames // 2
+            cut = lo + int(np.argmin(energy[lo:start + max_frames]))
+            chunks.append((start, cut))
+            start = cut
+        if chunks and end - chunks[-1][0] <= max_frames:
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((start, end))
+    return [(start * frame_s, end * frame_s) for start, end in chunks]
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import struct
+import zlib
+
+# Header của mỗi bản ghi: số thứ tự (seq), độ dài payload, CRC32 của payload
+_HEADER = struct.Struct("<QII")
+# Payload: độ dài phần JSON, JSON mô tả thao tác, dữ liệu nhị phân (vectors)
+_JSON_LEN = struct.Struct("<I")
+
+class WriteAheadLog:
+    """
+    Nhật ký ghi trước (append-only) cho các thao tác thêm/xóa trên cơ sở dữ liệu
+    Mỗi thao tác được ghi thành một bản ghi có số thứ tự tăng dần và CRC,
+    bản ghi bị ghi dở khi tiến trình bị dừng đột ngột sẽ được bỏ qua khi đọc lại
+    """
+
+    def __init__(self, path, sync=True):
+        """
+        Khởi tạo nhật ký
+
+        Args:
+            path: Đường dẫn đến file nhật ký
+            sync: Gọi fsync sau mỗi lần ghi (không mất dữ liệu khi mất điện)
+        """
+        self.path = path
+        self.sync = sync
+        self.last_seq = 0
+        self._file = None
+
+    def replay(self, after_seq=0):
+        """
+        Đọc lại các bản ghi có số thứ tự lớn hơn after_seq
+        Phần cuối file bị hỏng (ghi dở) sẽ bị cắt bỏ
+
+        Args:
+            after_seq: Số thứ tự của bản ghi cuối cùng đã có trong snapshot
+
+        Returns:
+            List các tuple (seq, record, data) với record là dictionary mô tả thao tác
+            và data là dữ liệu nhị phân đi kèm
+        """
+        self.last_seq = max(self.last_seq, after_seq)
+        if not os.path.exists(self.path):
+            return []
+
+        records = []
+        valid_end = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                seq, length, crc = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+
+                valid_end = f.tell()
+                if seq <= after_seq:
+                    continue
+
+                json_len = _JSON_LEN.unpack_from(payload)[0]
+                record = json.loads(payload[_JSON_LEN.size:_JSON_LEN.size + json_len].decode('utf-8'))
+                data = payload[_JSON_LEN.size + json_len:]
+                records.append((seq, record, data))
+                self.last_seq = seq
+
+        # Cắt bỏ bản ghi ghi dở ở cuối file
+        if valid_end < os.path.getsize(self.path):
+            print(f"Bỏ qua {os.path.getsize(self.path) - valid_end} byte hỏng ở cuối {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_end)
+
+        return records
+
+    def append(self, record, data=b""):
+        """
+        Ghi một bản ghi vào cuối nhật ký
+
+        Args:
+            record: Dictionary mô tả thao tác (phải chuyển được sang JSON)
+            data: Dữ liệu nhị phân đi kèm
+
+        Returns:
+            Số thứ tự của bản ghi
+        """
+        record_json = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        payload = _JSON_LEN.pack(len(record_json)) + record_json + bytes(data)
+        seq = self.last_seq + 1
+
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.write(_HEADER.pack(seq, len(payload), zlib.crc32(payload)) + payload)
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+
+        self.last_seq = seq
+        return seq
+
+    def reset(self):
+        """Xóa toàn bộ bản ghi sau khi đã ghi snapshot (số thứ tự vẫn tiếp tục tăng)"""
+        self.close()
+        with open(self.path, 'wb') as f:
+            if self.sync:
+                os.fsync(f.fileno())
+
+    def size(self):
+        """Kích thước file nhật ký (byte)"""
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def close(self):
+        """Đóng file nhật ký"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None